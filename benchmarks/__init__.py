@@ -0,0 +1,2 @@
+# Benchmarks and local stand-ins. Run them from the repository root as modules, 
+# e.g. `python -m benchmarks.hfds_lookup --help`.
@@ -0,0 +1,83 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import statistics
+import tempfile
+import random
+import json
+import time
+
+from data_manager import NuggetLoader, NuggetSelection, PreloadNuggetStore
+
+# Cost of building the nugget set the alignment page shows for the active sentence.
+#
+# Before: load the topic's nuggets, deep copy them, add "*Other answer*" to each question with
+# `NuggetSet.add` (a linear scan each) and overlay the sentence's selections the same way.
+# After: a cached template per (topic, nugget version), with the selections as a shallow overlay.
+
+ADDITIONAL_OPTIONS = ("Not relevant", "Not a fact")
+
+
+def legacy_build(nugget_loader: NuggetLoader, topic_id: str, sent_id: str, selections: NuggetSelection):
+    nuggets_for_selection = nugget_loader[topic_id].clone()
+    for q in nuggets_for_selection.get_all_questions():
+        nuggets_for_selection.add(q, [("_", "*Other answer*")])
+
+    nuggets_for_selection.add("*Other Options*", [ ("_", f"*{o}*") for o in ADDITIONAL_OPTIONS ])
+
+    for q, a in selections:
+        nuggets_for_selection.add(q, [(sent_id, a)])
+    return nuggets_for_selection
+
+
+def cached_build(nugget_loader: NuggetLoader, topic_id: str, sent_id: str, selections: NuggetSelection):
+    from stage_nugget_alignment import get_selection_template
+    template = get_selection_template(topic_id, nugget_loader.version(topic_id), ADDITIONAL_OPTIONS, nugget_loader)
+    return template.with_selections(sent_id, selections)
+
+
+def _as_comparable(nugget_set):
+    return [ (q, { a: sorted(d) for a, d in a_dict.items() }) for q, a_dict in nugget_set.nugget_list ], nugget_set.group_assignment
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n_questions', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--n_sentences', type=int, default=30)
+
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for n_questions in args.n_questions:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            nugget_list = [
+                (f"Question {i}?", { f"answer {i}.{j}": [ f"doc-{rng.randrange(100)}" ] for j in range(rng.randint(1, 6)) })
+                for i in range(n_questions)
+            ]
+            PreloadNuggetStore(Path(tmp_dir) / "annotation.db").ingest(
+                [("300", json.dumps({'nugget_list': nugget_list, 'group_assignment': {}}))], 'revised'
+            )
+            nugget_loader = NuggetLoader("bench", db_path=Path(tmp_dir) / "annotation.db", load_dir=tmp_dir)
+
+            # one click per sentence, each with a couple of selected nuggets
+            sentences = [
+                (str(s), NuggetSelection({ (f"Question {rng.randrange(n_questions)}?", "answer 0.0") for _ in range(2) }))
+                for s in range(args.n_sentences)
+            ]
+
+            timings = {}
+            for name, build in [('before', legacy_build), ('after', cached_build)]:
+                elapsed = []
+                for sent_id, selections in sentences:
+                    start = time.perf_counter()
+                    build(nugget_loader, "300", sent_id, selections)
+                    elapsed.append(time.perf_counter() - start)
+                timings[name] = statistics.median(elapsed) * 1000
+
+            same = all(
+                _as_comparable(legacy_build(nugget_loader, "300", *sent)) == _as_comparable(cached_build(nugget_loader, "300", *sent))
+                for sent in sentences
+            )
+            print(
+                f"{n_questions:4d} questions  before {timings['before']:8.2f} ms  after {timings['after']:8.2f} ms per sentence"
+                f"  same nuggets: {same}"
+            )
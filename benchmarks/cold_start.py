@@ -0,0 +1,66 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, List, Tuple
+import subprocess
+import statistics
+import sys
+
+# Cold-start import cost of the app modules, each measured in a fresh interpreter with
+# `python -X importtime`. The doc backends are listed separately: they are now only paid
+# for by a server whose task configs select them.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+APP_MODULES = [
+    'task_resources', 'data_manager', 'page_utils', 'doc_viewer', 'nugget_editor',
+    'stage_nugget_creation', 'stage_citaiton_assessment', 'stage_nugget_revision', 'stage_nugget_alignment',
+    'entry'
+]
+BACKEND_MODULES = ['ir_datasets', 'datasets', 'http_doc_client', 'pandas']
+
+
+def import_times(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    # (total ms, [(top-level dependency, cumulative ms), ...]) of importing `module` in a fresh process
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+
+    total, deps = 0.0, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if name == module:
+            total = int(cumulative) / 1000
+        elif depth == 1: # imported directly by the interpreter's top-level import
+            deps[name] = deps.get(name, 0) + int(cumulative) / 1000
+    return total, sorted(deps.items(), key=lambda x: -x[1])
+
+
+def _loaded(module: str, candidates: List[str]) -> Dict[str, bool]:
+    code = f"import sys, {module}; print(' '.join(m for m in {candidates!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True).stdout.split()
+    return { m: m in out for m in candidates }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=APP_MODULES + BACKEND_MODULES)
+    parser.add_argument('--repeat', type=int, default=3, help="fresh processes per module; the median is reported")
+    parser.add_argument('--top', type=int, default=5, help="heaviest dependencies to list per module")
+
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [ import_times(module) for _ in range(args.repeat) ]
+        total = statistics.median([ t for t, _ in runs ])
+        deps = ", ".join(f"{name} {ms:.0f}" for name, ms in runs[0][1][:args.top])
+        print(f"{module:<28} {total:8.1f} ms   ({deps})")
+
+    print()
+    for module, loaded in _loaded('entry', ['pandas', 'ir_datasets', 'datasets', 'pyarrow', 'aiohttp']).items():
+        print(f"`import entry` loads {module:<12} {loaded}")
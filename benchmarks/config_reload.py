@@ -0,0 +1,93 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import tempfile
+import pickle
+import json
+import time
+
+from task_resources import get_task_registry, TaskRegistry
+
+# Per-rerun cost of getting the task configs in entry.py.
+#
+# Before: every rerun globbed the config directory, rebuilt each TaskConfig, re-read the
+# topic file and got the three resources from st.cache_data, which unpickles a fresh copy
+# on every hit. After: a st.cache_resource hit on the shared registry, plus `refresh`, which
+# stats the config files and their resources and reloads only the changed ones.
+
+
+def _inflate(config_dir: Path, output_dir: Path, factor: int):
+    # copy the configs with every topic of the resources repeated `factor` times
+    (output_dir / "resources").mkdir()
+    for fn in config_dir.glob("*.json"):
+        config = json.loads(fn.read_text())
+        config['output_dir'] = str(output_dir / "outputs")
+        for field in ['doc_pools_path', 'cited_sentences_path', 'report_runs_path']:
+            data = json.loads(Path(config[field]).read_text())
+            inflated = { f"{topic_id}-{i}": val for i in range(factor) for topic_id, val in data.items() }
+            config[field] = str(output_dir / "resources" / Path(config[field]).name)
+            Path(config[field]).write_text(json.dumps(inflated))
+        (output_dir / fn.name).write_text(json.dumps(config))
+
+
+def legacy_rerun(config_dir: Path, cache_data_storage):
+    configs = {}
+    for fn in config_dir.glob("*.json"):
+        config = json.loads(fn.read_text())
+        requests = {
+            topic[config.get('topic_id_field', 'request_id')]: topic
+            for topic in map(json.loads, open(config['topic_file']))
+        }
+        resources = [
+            pickle.loads(cache_data_storage[config[field]])
+            for field in ['doc_pools_path', 'cited_sentences_path', 'report_runs_path']
+        ]
+        configs[config['name']] = (config, requests, resources)
+        Path(config['output_dir']).mkdir(parents=True, exist_ok=True)
+    return configs
+
+
+def _time_per_call(fn, n: int):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) * 1000 / n
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--config_dir', type=Path, default=Path("./configs"))
+    parser.add_argument('--inflate', type=int, default=200, help="repeat every topic of the resources this many times")
+    parser.add_argument('--n_reruns', type=int, default=20)
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_dir = Path(tmp_dir)
+        _inflate(args.config_dir, config_dir, args.inflate)
+
+        size = sum(fn.stat().st_size for fn in (config_dir / "resources").iterdir())
+        print(f"{len(list(config_dir.glob('*.json')))} config(s), {size / 2**20:.1f} MiB of resources")
+
+        # what st.cache_data keeps after the first call
+        cache_data_storage = {
+            str(fn): pickle.dumps(json.loads(fn.read_text()))
+            for fn in (config_dir / "resources").iterdir()
+        }
+
+        start = time.perf_counter()
+        get_task_registry(str(config_dir))
+        print(f"registry, first build (once per process): {(time.perf_counter() - start) * 1000:10.2f} ms")
+
+        print(f"before, per rerun: {_time_per_call(lambda: legacy_rerun(config_dir, cache_data_storage), args.n_reruns):10.2f} ms")
+        print(f"after,  per rerun: {_time_per_call(lambda: get_task_registry(str(config_dir)), args.n_reruns):10.2f} ms")
+
+        registry = TaskRegistry(str(config_dir), min_refresh_interval=0)
+        print(f"refresh, nothing changed (unthrottled): {_time_per_call(registry.refresh, args.n_reruns):10.2f} ms")
+
+        fn = sorted(config_dir.glob("*.json"))[0]
+        config = json.loads(fn.read_text())
+        config['name'] = config['name'] + " (copy)"
+        (config_dir / f"copy_{fn.name}").write_text(json.dumps(config))
+        start = time.perf_counter()
+        changed = registry.refresh()
+        print(f"refresh, one config added:              {(time.perf_counter() - start) * 1000:10.2f} ms -- {changed}")
@@ -0,0 +1,125 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import tempfile
+import json
+
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.config_reload import _inflate
+
+# Time to get the numbers of `task_dashboard` for one user, against the number of assigned topics.
+#
+# Before: count_done / count_job / is_all_done on the three annotation managers for every topic
+# (pandas scans), and the revised nuggets of every topic parsed for the alignment step.
+# After: `get_progress_snapshot`, from counters the managers keep up to date in `annotate`.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def legacy_numbers(task_config, username):
+    from data_manager import get_manager, get_nugget_loader
+
+    user_topics = task_config.job_assignment.get(username, [])
+    relevance_assessment_manager = get_manager(task_config, username, 'relevance_assessment_manager')
+    citation_assessment_manager = get_manager(task_config, username, 'citation_assessment_manager')
+    nugget_alignment_manager = get_manager(task_config, username, 'nugget_alignment_manager')
+    nugget_loader = get_nugget_loader(task_config, username, use_revised_nugget=task_config.use_revised_nugget_only)
+
+    ret = {'nugget_creation': {}, 'citation_assessment': {}, 'nugget_alignment': {}}
+    for topic_id in [ t for t in user_topics if t in task_config.pooled_docs.keys() ]:
+        ret['nugget_creation'][topic_id] = (
+            relevance_assessment_manager.count_done(topic_id, level='doc_id'),
+            relevance_assessment_manager.count_job(topic_id, level='doc_id'),
+            relevance_assessment_manager.is_all_done(topic_id), True
+        )
+    for topic_id in [ t for t in user_topics if task_config.cited_sentences.keys() ]:
+        ret['citation_assessment'][topic_id] = (
+            min(citation_assessment_manager.count_done(topic_id, level='doc_id'), relevance_assessment_manager.count_done(topic_id, level='doc_id')),
+            citation_assessment_manager.count_job(topic_id, level='doc_id'),
+            citation_assessment_manager.is_all_done(topic_id), True
+        )
+    for topic_id in [ t for t in user_topics if t in task_config.report_runs.keys() ]:
+        activated = not task_config.force_citation_asssessment_before_report or citation_assessment_manager.is_all_done(topic_id)
+        if task_config.use_revised_nugget_only:
+            activated = activated and len(nugget_loader[topic_id]) > 0
+        ret['nugget_alignment'][topic_id] = (
+            nugget_alignment_manager.count_done(topic_id, level='run_id'),
+            nugget_alignment_manager.count_job(topic_id, level='run_id'),
+            nugget_alignment_manager.is_all_done(topic_id), activated
+        )
+    return ret
+
+
+def _dashboard_script(repo_root, config_dir, task_name, n_annotations):
+    import sys, time, random
+    sys.path.insert(0, repo_root)
+
+    import streamlit as st
+    from task_resources import get_task_registry
+    from data_manager import NuggetSelection, get_manager, get_progress_snapshot
+    from benchmarks.dashboard_progress import legacy_numbers
+
+    task_config = get_task_registry(config_dir)[task_name]
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    managers = {
+        name: get_manager(task_config, 'bench', name)
+        for name in ['relevance_assessment_manager', 'citation_assessment_manager', 'nugget_alignment_manager']
+    }
+    get_progress_snapshot(task_config, 'bench')
+    st.session_state['init'] = time.perf_counter() - start
+
+    # annotate between two dashboard visits, so the counters have to follow
+    for name, manager in managers.items():
+        slot = manager.slot_names[0]
+        keys = list(manager.content_df.index)
+        for key in rng.sample(keys, k=min(n_annotations, len(keys))):
+            value = NuggetSelection({("q", "a")}) if slot == 'nugget' else rng.choice(["0", "1"])
+            manager.annotate(key=key, slot=slot, annotation=value)
+
+    start = time.perf_counter()
+    legacy = legacy_numbers(task_config, 'bench')
+    st.session_state['before'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    snapshot = get_progress_snapshot(task_config, 'bench')
+    st.session_state['after'] = time.perf_counter() - start
+
+    st.session_state['same'] = legacy == {
+        stage: { t: (p.n_done, p.n_job, p.is_done, p.available) for t, p in topics.items() }
+        for stage, topics in snapshot.items()
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--config_dir', type=Path, default=Path("./configs"))
+    parser.add_argument('--inflate', type=int, nargs='+', default=[1, 5, 20], help="repeat every topic of the resources this many times")
+    parser.add_argument('--n_annotations', type=int, default=200, help="annotations per manager between the two measurements")
+
+    args = parser.parse_args()
+
+    for factor in args.inflate:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_dir = Path(tmp_dir)
+            _inflate(args.config_dir, config_dir, factor)
+
+            # assign every topic to the user
+            config_fn = next(config_dir.glob("*.json"))
+            config = json.loads(config_fn.read_text())
+            topics = list(json.loads(Path(config['doc_pools_path']).read_text()).keys())
+            config['job_assignment'] = {'bench': topics}
+            config_fn.write_text(json.dumps(config))
+
+            at = AppTest.from_function(
+                _dashboard_script, args=(str(REPO_ROOT), str(config_dir), config['name'], args.n_annotations), default_timeout=600
+            )
+            at.run()
+            assert not at.exception, at.exception
+
+            print(
+                f"{len(topics):5d} topics  managers + counters {at.session_state['init'] * 1000:8.1f} ms (once per session)"
+                f"   dashboard before {at.session_state['before'] * 1000:9.1f} ms  after {at.session_state['after'] * 1000:7.2f} ms"
+                f"   same numbers: {at.session_state['same']}"
+            )
@@ -0,0 +1,127 @@
+from argparse import ArgumentParser
+from typing import Dict, Optional
+from pathlib import Path
+import asyncio
+import threading
+import random
+import json
+
+from aiohttp import web
+
+# Local stand-in for the central document API used by `doc_service: http_api`.
+#
+# Serve a jsonl collection ({"id": ..., "title": ..., "text": ...} per line):
+#   python -m benchmarks.doc_api_stand_in --docs collection.jsonl --port 8765
+# or make up a deterministic document for every requested id:
+#   python -m benchmarks.doc_api_stand_in --synthetic --latency_ms 20 --failure_rate 0.05
+#
+# and point a task config to it with `"doc_service": "http_api", "collection_id": "http://localhost:8765/<any-name>"`.
+
+_WORDS = [
+    "report", "pandemic", "suicide", "rates", "japan", "government", "policy", "study", "women", "economic",
+    "increase", "decline", "health", "ministry", "data", "year", "support", "crisis", "survey", "impact"
+]
+
+def synthetic_doc(doc_id: str, doc_len: int = 400):
+    rng = random.Random(doc_id)
+    paragraphs = []
+    while doc_len > 0:
+        n = min(doc_len, rng.randint(30, 120))
+        paragraphs.append(" ".join(rng.choices(_WORDS, k=n)).capitalize() + ".")
+        doc_len -= n
+    return {'title': f"Document {doc_id}", 'text': "\n\n".join(paragraphs)}
+
+
+class StandInDocAPI:
+
+    def __init__(
+            self, docs: Optional[Dict[str, Dict[str, str]]] = None, synthetic_doc_len: int = None,
+            latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0
+        ):
+        assert docs is not None or synthetic_doc_len is not None
+        self.docs = docs
+        self.synthetic_doc_len = synthetic_doc_len
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+
+        self.stats = {'requests': 0, 'docs_served': 0, 'injected_failures': 0}
+
+        self.app = web.Application()
+        self.app.router.add_get('/health', self._health)
+        self.app.router.add_post('/{collection:.*}/docs', self._lookup)
+
+    def _get(self, doc_id: str):
+        if self.docs is not None:
+            return self.docs.get(doc_id, None)
+        return synthetic_doc(doc_id, self.synthetic_doc_len)
+
+    async def _health(self, request: web.Request):
+        return web.json_response(self.stats)
+
+    async def _lookup(self, request: web.Request):
+        self.stats['requests'] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if self.rng.random() < self.failure_rate:
+            self.stats['injected_failures'] += 1
+            return web.json_response({'error': 'injected failure'}, status=503)
+
+        doc_ids = (await request.json())['doc_ids']
+        docs = { doc_id: self._get(doc_id) for doc_id in doc_ids }
+        docs = { doc_id: doc for doc_id, doc in docs.items() if doc is not None }
+        self.stats['docs_served'] += len(docs)
+
+        return web.json_response({'docs': docs})
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0):
+        """Start serving on a background thread; returns the base url and a stop function."""
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(self.app)
+
+        async def _start():
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            return site._server.sockets[0].getsockname()[1]
+
+        thread = threading.Thread(target=loop.run_forever, name="doc-api-stand-in", daemon=True)
+        thread.start()
+        bound_port = asyncio.run_coroutine_threadsafe(_start(), loop).result()
+
+        def _stop():
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+        return f"http://{host}:{bound_port}", _stop
+
+
+def load_jsonl_docs(fn: str):
+    docs = {}
+    with open(fn) as fr:
+        for doc in map(json.loads, fr):
+            docs[doc['id']] = {'title': doc.get('title', ""), 'text': doc['text']}
+    return docs
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--docs', type=Path, default=None, help="jsonl file with id, title and text fields")
+    parser.add_argument('--synthetic', action='store_true', default=False, help="serve a made-up document for any id")
+    parser.add_argument('--doc_len', type=int, default=400, help="words per synthetic document")
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency_ms', type=float, default=0.0)
+    parser.add_argument('--failure_rate', type=float, default=0.0)
+
+    args = parser.parse_args()
+    assert args.synthetic or args.docs is not None, "Need either --docs or --synthetic"
+
+    api = StandInDocAPI(
+        docs=load_jsonl_docs(args.docs) if args.docs is not None else None,
+        synthetic_doc_len=args.doc_len if args.synthetic else None,
+        latency=args.latency_ms / 1000, failure_rate=args.failure_rate
+    )
+    web.run_app(api.app, host=args.host, port=args.port)
@@ -0,0 +1,70 @@
+from argparse import ArgumentParser
+import statistics
+import time
+
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from doc_viewer import segment_text, render_paragraphs
+from data_manager import get_doc_contents
+from benchmarks.doc_api_stand_in import synthetic_doc
+
+# Bytes the server sends for the document panel on every rerun of the page,
+# measured as the serialized ForwardMsg deltas of the elements it creates.
+
+
+def _element_size(kind: str, body: str):
+    msg = ForwardMsg()
+    getattr(msg.delta.new_element, kind).body = body
+    return msg.ByteSize()
+
+
+def before(doc, doc_id):
+    # st.write(title) + st.caption(doc_id) + st.write(text), all markdown
+    return sum([
+        _element_size('markdown', f"**{doc['title']}**") if doc['title'] != "" else 0,
+        _element_size('markdown', f"Doc ID: {doc_id}"),
+        _element_size('markdown', doc['text'])
+    ])
+
+
+def after(doc, doc_id, paragraphs, page_size):
+    return sum([
+        _element_size('html', f"<p><b>{doc['title']}</b></p>") if doc['title'] != "" else 0,
+        _element_size('markdown', f"Doc ID: {doc_id}"),
+        _element_size('html', render_paragraphs(paragraphs[:page_size])),
+        _element_size('markdown', "Load more (000 paragraphs left)") if len(paragraphs) > page_size else 0 # button label
+    ])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--doc_service', type=str, default=None)
+    parser.add_argument('--collection_id', type=str, default=None)
+    parser.add_argument('--doc_ids', type=str, default=None, help="file with one doc id per line; synthetic docs if not given")
+    parser.add_argument('--n_docs', type=int, default=200)
+    parser.add_argument('--doc_len', type=int, nargs='+', default=[300, 3000, 30000], help="words per synthetic doc")
+    parser.add_argument('--page_size', type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.doc_ids is not None:
+        doc_ids = [ l.strip() for l in open(args.doc_ids) if l.strip() != "" ]
+        docsets = {'collection': get_doc_contents(args.doc_service, args.collection_id, doc_ids)}
+    else:
+        docsets = {
+            f'synthetic {n} words': { f"doc-{i}": synthetic_doc(f"doc-{i}", n) for i in range(args.n_docs) }
+            for n in args.doc_len
+        }
+
+    for name, docs in docsets.items():
+        start = time.perf_counter()
+        segments = { doc_id: segment_text(doc['text']) for doc_id, doc in docs.items() }
+        seg_ms = (time.perf_counter() - start) * 1000 / len(docs)
+
+        b = [ before(doc, doc_id) for doc_id, doc in docs.items() ]
+        a = [ after(doc, doc_id, segments[doc_id], args.page_size) for doc_id, doc in docs.items() ]
+        print(
+            f"{name:<24} per-rerun payload: before {statistics.mean(b)/1024:8.1f} KiB (max {max(b)/1024:8.1f}), "
+            f"after {statistics.mean(a)/1024:6.1f} KiB (max {max(a)/1024:6.1f}); "
+            f"segmentation {seg_ms:.2f} ms/doc, once per doc"
+        )
@@ -0,0 +1,185 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import statistics
+import tempfile
+import random
+import time
+import json
+import sys
+
+from streamlit.testing.v1 import AppTest
+from streamlit.proto.WidgetStates_pb2 import WidgetState, WidgetStates
+
+# Server-side time of a click in the nugget editor -- an answer added to a nugget -- on the nugget
+# creation, citation and alignment pages of a synthetic topic with `--n_questions` nuggets.
+#
+# Before, the click reran the page fragment, in which the editor found the new selection, saved it and
+# called `st.rerun()`, which reran the whole app. AppTest follows that `st.rerun()` within the same run,
+# so the time of the click run is what the annotator waited, minus the part of entry.py in the app rerun.
+# After, the editor is its own fragment and the click reruns the editor only. AppTest always runs the
+# full script, so the click is timed as the run minus the part of the page outside of the editor.
+#
+# `--repo` runs the pages of another checkout, e.g., the commit before the editor became a fragment:
+#
+#   git worktree add /tmp/before <commit>
+#   python -m benchmarks.editor_rerun --repo /tmp/before
+#   python -m benchmarks.editor_rerun
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+PAGES = {
+    'nugget_creation': ('stage_nugget_creation', 'nugget_creation_page'),
+    'citation_assessment': ('stage_citaiton_assessment', 'citation_assessment_page'),
+    'nugget_alignment': ('stage_nugget_alignment', 'nugget_alignment_page'),
+}
+
+
+def make_task(config_fn: Path, output_dir: Path, topic_id: str, n_questions: int, n_groups: int, seed: int = 0):
+    from data_manager import PreloadNuggetStore
+
+    config = json.loads(config_fn.read_text())
+    config['output_dir'] = str(output_dir / "outputs")
+    config['doc_service'] = 'bench'
+    # the managers only hold the topics assigned to the user
+    config['job_assignment'] = {'bench': [topic_id]}
+    Path(config['output_dir']).mkdir(parents=True)
+    (output_dir / "configs").mkdir()
+    (output_dir / "configs" / config_fn.name).write_text(json.dumps(config))
+
+    rng = random.Random(seed)
+    doc_ids = json.loads(Path(config['doc_pools_path']).read_text())[topic_id] \
+            + list(json.loads(Path(config['cited_sentences_path']).read_text())[topic_id].keys()) \
+            + [ str(i) for i in range(30) ] # sentence ids of the alignment page
+    nugget_list = [
+        (f"Question {i} about the topic?", {
+            f"answer {i}.{j}": rng.sample(doc_ids, k=rng.randint(1, 4))
+            for j in range(rng.randint(1, 6))
+        })
+        for i in range(n_questions)
+    ]
+    group_assignment = { q: f"group {rng.randrange(n_groups)}" for q, _ in nugget_list if rng.random() < 0.7 }
+
+    PreloadNuggetStore(Path(config['output_dir']) / "annotation.db").ingest(
+        [(topic_id, json.dumps({'nugget_list': nugget_list, 'group_assignment': group_assignment}))], 'revised'
+    )
+    return config['name'], config['collection_id'], output_dir / "configs", doc_ids
+
+
+def _page_script(repo_root, config_dir, module_name, page_name, collection_id, doc_ids):
+    import sys, time, importlib
+    sys.path.insert(0, repo_root)
+
+    import streamlit as st
+    from types import SimpleNamespace
+    from task_resources import get_task_registry
+    from data_manager import get_doc_cache, freeze_doc
+    from benchmarks.doc_api_stand_in import synthetic_doc
+
+    for doc_id in doc_ids:
+        get_doc_cache().put(('bench', collection_id, doc_id), freeze_doc(synthetic_doc(doc_id, 800)))
+
+    st.session_state['task_configs'] = get_task_registry(config_dir)
+    module = importlib.import_module(module_name)
+
+    timings = st.session_state.setdefault('timings', {'page': [], 'editor': []})
+    # the module stays imported between the runs -- wrap the original function only once
+    draw_nugget_editor = module.__dict__.setdefault('_untimed_draw_nugget_editor', module.draw_nugget_editor)
+    def _timed_editor(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            draw_nugget_editor(*args, **kwargs)
+        finally:
+            timings['editor'].append(time.perf_counter() - start)
+    module.draw_nugget_editor = _timed_editor
+
+    start = time.perf_counter()
+    try:
+        getattr(module, page_name)(SimpleNamespace(current_user='bench', is_admin=False))
+    finally:
+        # also the runs cut short by `st.rerun()`
+        timings['page'].append(time.perf_counter() - start)
+
+
+def _click_answer(at: AppTest, rng: random.Random):
+    # adds one answer to a nugget of the editor, by position -- the options of the tree are the formatted labels
+    candidates = []
+    for pills in at.button_group:
+        if not (pills.key or "").endswith("/select"):
+            continue
+        # not `pills.indices`, which goes through the format function of the previous run
+        values = set(at.session_state[pills.key] or []) if pills.key in at.session_state else set()
+        selected = [ i for i, o in enumerate(pills.options) if o.content.rsplit(" (", 1)[0] in values ]
+        unselected = [ i for i, o in enumerate(pills.options) if i not in selected and o.content not in ("+", ":material/add:") ]
+        if unselected:
+            candidates.append((pills, selected, unselected))
+    pills, selected, unselected = rng.choice(candidates)
+
+    state = WidgetState(id=pills.id)
+    state.int_array_value.data[:] = sorted(selected + [rng.choice(unselected)])
+    states = WidgetStates()
+    states.widgets.append(state)
+    return states
+
+
+def run_page(repo_root: Path, config_dir: Path, task_name: str, topic_id: str, collection_id: str, doc_ids, page: str, n_clicks: int, seed: int = 0):
+    module_name, page_name = PAGES[page]
+    at = AppTest.from_function(
+        _page_script, args=(str(repo_root), str(config_dir), module_name, page_name, collection_id, doc_ids), default_timeout=60
+    )
+    at.query_params['task'] = task_name
+    at.query_params['topic'] = topic_id
+    # the first run loads the managers
+    at._run()
+    assert not at.exception, at.exception
+
+    rng = random.Random(seed)
+    clicks = []
+    for _ in range(n_clicks):
+        states = _click_answer(at, rng)
+        timings = at.session_state['timings']
+        n_page, n_editor = len(timings['page']), len(timings['editor'])
+
+        start = time.perf_counter()
+        at._run(states)
+        wall = time.perf_counter() - start
+        assert not at.exception, at.exception
+
+        timings = at.session_state['timings']
+        page_s, editor_s = timings['page'][n_page:], timings['editor'][n_editor:]
+        clicks.append((wall, len(page_s), sum(page_s), sum(editor_s)))
+    return clicks
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--repo', type=Path, default=REPO_ROOT, help="checkout whose pages are timed")
+    parser.add_argument('--config', type=Path, default=Path("./configs/mini-test_config.json"))
+    parser.add_argument('--topic', type=str, default="300")
+    parser.add_argument('--n_questions', type=int, nargs='+', default=[20, 80])
+    parser.add_argument('--n_groups', type=int, default=5)
+    parser.add_argument('--n_clicks', type=int, default=10)
+
+    args = parser.parse_args()
+    repo_root = args.repo.resolve()
+    # the modules of that checkout, also for the ones imported here
+    sys.path.insert(0, str(repo_root))
+
+    import nugget_editor
+    # the editor reruns alone if it is a fragment of its own
+    editor_fragment = hasattr(nugget_editor, '_nugget_editor')
+    print(f"{repo_root}: {'editor fragment' if editor_fragment else 'page fragment + st.rerun()'}, median ms per click")
+
+    for n_questions in args.n_questions:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            task_name, collection_id, config_dir, doc_ids = make_task(args.config, Path(tmp_dir), args.topic, n_questions, args.n_groups)
+
+            for page in PAGES:
+                clicks = run_page(repo_root, config_dir, task_name, args.topic, collection_id, doc_ids, page, args.n_clicks)
+                per_click = [
+                    wall - page_s + editor_s if editor_fragment else wall
+                    for wall, _, page_s, editor_s in clicks
+                ]
+                print(
+                    f"{n_questions:3d} nuggets  {page:<20} click {statistics.median(per_click) * 1000:7.1f}"
+                    f"   (run {statistics.median(c[0] for c in clicks) * 1000:7.1f}, page runs {statistics.median(c[1] for c in clicks):.0f}"
+                    f", page {statistics.median(c[2] for c in clicks) * 1000:7.1f}, editor {statistics.median(c[3] for c in clicks) * 1000:7.1f})"
+                )
@@ -0,0 +1,83 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import statistics
+import random
+
+from streamlit.testing.v1 import AppTest
+
+# Render time and widget count of the two nugget editors of `nugget_revision_page` (the frozen
+# source viewer and the editor) on synthetic nugget sets of growing size, drawing every nugget
+# (`page_size=None`, before) or one page of them (after).
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def make_nugget_set(n_questions: int, n_groups: int, seed: int = 0):
+    from data_manager import NuggetSet
+
+    rng = random.Random(seed)
+    return NuggetSet.from_list(
+        [
+            (f"Question {i} about the topic?", {
+                f"answer {i}.{j}": [ f"doc-{rng.randrange(200)}" for _ in range(rng.randint(1, 4)) ]
+                for j in range(rng.randint(1, 6))
+            })
+            for i in range(n_questions)
+        ],
+        { f"Question {i} about the topic?": f"group {rng.randrange(n_groups)}" for i in range(n_questions) if rng.random() < 0.7 }
+    )
+
+
+def _revision_script(repo_root, n_questions, n_groups, page_size):
+    import sys, time
+    sys.path.insert(0, repo_root)
+
+    import streamlit as st
+    from nugget_editor import draw_nugget_editor
+    from benchmarks.editor_window import make_nugget_set
+
+    source_nugget_set = make_nugget_set(n_questions, n_groups)
+    edit_nugget_set = source_nugget_set.clone()
+
+    start = time.perf_counter()
+    source_col, editor_col = st.columns([4, 6])
+    with source_col:
+        draw_nugget_editor(
+            source_nugget_set, current_doc_id="_post_hoc_edit_", key_prefix="bench/source_nugget_viewer",
+            page_size=page_size, highlight_group_name=False,
+            allow_nugget_answer_selection=False, allow_nugget_answer_creation=False,
+            allow_nugget_question_creation=False, allow_nugget_group_edit=False, allow_nugget_question_edit=False,
+        )
+    with editor_col:
+        draw_nugget_editor(
+            edit_nugget_set, current_doc_id="_post_hoc_edit_", key_prefix="bench/nugget_editor",
+            page_size=page_size,
+            allow_nugget_answer_selection=True, allow_nugget_answer_creation=False,
+            allow_nugget_question_creation=False, allow_nugget_group_edit=True, allow_nugget_question_edit=True,
+        )
+    st.session_state.setdefault('timings', []).append(time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n_questions', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('--n_groups', type=int, default=10)
+    parser.add_argument('--page_size', type=int, default=25)
+    parser.add_argument('--n_reruns', type=int, default=5)
+
+    args = parser.parse_args()
+
+    for n_questions in args.n_questions:
+        for page_size in [None, args.page_size]:
+            at = AppTest.from_function(
+                _revision_script, args=(str(REPO_ROOT), n_questions, args.n_groups, page_size), default_timeout=300
+            )
+            for _ in range(args.n_reruns):
+                # without the widget states of the previous run -- AppTest cannot replay an empty `st.pills`
+                at._run()
+                assert not at.exception, at.exception
+
+            n_widgets = len(at.button_group) + len(at.selectbox) + len(at.toggle) + len(at.button) + len(at.text_input)
+            render_ms = statistics.median(at.session_state['timings']) * 1000
+            mode = "all nuggets" if page_size is None else f"page of {page_size}"
+            print(f"{n_questions:4d} questions  {mode:<12}  {render_ms:8.1f} ms  {n_widgets:5d} widgets")
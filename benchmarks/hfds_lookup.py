@@ -0,0 +1,86 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import random
+import string
+import tempfile
+import time
+
+import datasets as hfds
+
+from data_manager import _read_hfds_rows, _iter_hfds
+
+
+def _legacy_lookup(ds: hfds.arrow_dataset.Dataset, idx: int):
+    # what `get_doc_content` used to do
+    return {
+        'title': ds[idx]['title'] if 'title' in ds[idx] else "",
+        'text': ds[idx]['text']
+    }
+
+
+def _make_synthetic_ds(output_dir: Path, n_docs: int, doc_len: int, n_extra_columns: int):
+    rng = random.Random(0)
+    words = [ "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(5000) ]
+
+    def _gen():
+        for i in range(n_docs):
+            yield {
+                'id': f"doc-{i}",
+                'title': " ".join(rng.choices(words, k=8)),
+                'text': " ".join(rng.choices(words, k=doc_len)),
+                # NeuCLIR-style splits carry more than just title and text
+                **{ f'extra_{c}': " ".join(rng.choices(words, k=doc_len // 4)) for c in range(n_extra_columns) }
+            }
+
+    hfds.Dataset.from_generator(_gen, cache_dir=str(output_dir / "cache")).save_to_disk(str(output_dir / "ds"))
+    return hfds.load_from_disk(str(output_dir / "ds")) # memory-mapped, same as load_dataset
+
+
+def _time(fn, n: int):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return elapsed, n / elapsed
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--collection_id', type=str, default=None, 
+                        help="hf_datasets collection id (<user>/<project>#<branch>:<subset>); synthetic data if not given.")
+    parser.add_argument('--n_docs', type=int, default=200_000)
+    parser.add_argument('--doc_len', type=int, default=400, help="words per synthetic document")
+    parser.add_argument('--n_extra_columns', type=int, default=2)
+    parser.add_argument('--n_lookups', type=int, default=2000)
+    parser.add_argument('--batch_size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.collection_id is not None:
+            ds, _ = next(_iter_hfds(args.collection_id))
+        else:
+            print(f"Building synthetic dataset with {args.n_docs} documents...")
+            ds = _make_synthetic_ds(Path(tmp_dir), args.n_docs, args.doc_len, args.n_extra_columns)
+
+        rng = random.Random(args.seed)
+        indices = [ rng.randrange(len(ds)) for _ in range(args.n_lookups) ]
+
+        # sanity check -- both paths should return the same content
+        for idx in indices[:50]:
+            assert _legacy_lookup(ds, idx) == _read_hfds_rows(ds, [idx])[0]
+
+        print(f"{len(ds)} documents, columns {ds.column_names}, {len(indices)} lookups")
+
+        results = {
+            'legacy ds[idx] (3 row reads)': _time(lambda: [ _legacy_lookup(ds, idx) for idx in indices ], len(indices)),
+            'arrow slice (single)': _time(lambda: [ _read_hfds_rows(ds, [idx]) for idx in indices ], len(indices)),
+            f'arrow slices (batch of {args.batch_size})': _time(lambda: [
+                _read_hfds_rows(ds, indices[i: i+args.batch_size]) 
+                for i in range(0, len(indices), args.batch_size)
+            ], len(indices)),
+        }
+
+        baseline = results['legacy ds[idx] (3 row reads)'][0]
+        for name, (elapsed, throughput) in results.items():
+            print(f"{name:<32} {elapsed*1000/len(indices):8.3f} ms/doc {throughput:10.1f} docs/s  x{baseline/elapsed:.1f}")
@@ -0,0 +1,77 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+import urllib.request
+import json
+import time
+
+from http_doc_client import HttpDocClient, DocServiceError
+from benchmarks.doc_api_stand_in import StandInDocAPI
+
+
+def _unpooled_lookup(collection_url: str, doc_id: str):
+    # one connection per lookup, no batching -- the naive client
+    req = urllib.request.Request(
+        f"{collection_url}/docs", data=json.dumps({'doc_ids': [doc_id]}).encode(),
+        headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())['docs'].get(doc_id)
+
+
+def _safe(fn):
+    # count failed lookups instead of aborting the benchmark
+    def _wrapped(*args):
+        try:
+            fn(*args)
+            return 0
+        except DocServiceError:
+            return 1
+    return _wrapped
+
+
+def _run(name: str, fn, n_docs: int, api: StandInDocAPI):
+    n_requests = api.stats['requests']
+    start = time.perf_counter()
+    n_failed = sum(fn())
+    elapsed = time.perf_counter() - start
+    print(f"{name:<40} {n_docs/elapsed:10.1f} docs/s {api.stats['requests'] - n_requests:6d} http requests {n_failed:5d} failed")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n_docs', type=int, default=2000)
+    parser.add_argument('--n_sessions', type=int, default=16, help="concurrent annotator sessions (threads)")
+    parser.add_argument('--latency_ms', type=float, default=5.0, help="server side latency per request")
+    parser.add_argument('--failure_rate', type=float, default=0.0)
+    parser.add_argument('--doc_len', type=int, default=400)
+
+    args = parser.parse_args()
+
+    api = StandInDocAPI(synthetic_doc_len=args.doc_len, latency=args.latency_ms / 1000, failure_rate=args.failure_rate)
+    base_url, stop = api.start_in_thread()
+    collection_url = f"{base_url}/bench"
+
+    client = HttpDocClient()
+    doc_ids = [ f"doc-{i}" for i in range(args.n_docs) ]
+    print(f"{args.n_docs} docs, {args.n_sessions} sessions, {args.latency_ms}ms server latency, {args.failure_rate} failure rate")
+
+    try:
+        if args.failure_rate == 0:
+            with ThreadPoolExecutor(args.n_sessions) as pool:
+                _run("unpooled, one request per doc", lambda: pool.map(
+                    _safe(lambda d: _unpooled_lookup(collection_url, d)), doc_ids
+                ), args.n_docs, api)
+
+        _run("pooled, sequential lookups", lambda: map(_safe(lambda d: client.lookup(collection_url, d)), doc_ids), args.n_docs, api)
+
+        with ThreadPoolExecutor(args.n_sessions) as pool:
+            _run("pooled, concurrent sessions (coalesced)", lambda: pool.map(
+                _safe(lambda d: client.lookup(collection_url, d)), doc_ids
+            ), args.n_docs, api)
+
+        _run("pooled, lookup_many", lambda: [ _safe(client.lookup_many)(collection_url, doc_ids) ], args.n_docs, api)
+
+        print(f"client stats: {client.stats}")
+    finally:
+        client.close()
+        stop()
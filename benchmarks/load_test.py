@@ -0,0 +1,325 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from typing import List, Tuple
+from dataclasses import asdict, replace
+from pathlib import Path
+import tempfile
+import random
+import time
+import json
+import os
+
+from unittest.mock import MagicMock
+
+import streamlit
+from streamlit.testing.v1 import AppTest
+from streamlit.runtime import Runtime
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.proto.WidgetStates_pb2 import WidgetState, WidgetStates
+
+import storage_backend
+from storage_backend import get_backend
+from page_utils import AuthManager
+from benchmarks.synthetic import WorkloadSize, make_synthetic_task
+from benchmarks.doc_api_stand_in import StandInDocAPI
+
+# Simultaneous annotators on one app process: `--n_users` sessions of entry.py, driven headlessly with
+# AppTest, log in, open the task dashboard and work on the nugget creation, citation assessment and
+# nugget alignment pages of a synthetic task (`benchmarks/synthetic.py`), with a think time between
+# two clicks. Documents come from the local stand-in of the document API.
+#
+#   python -m benchmarks.load_test --n_users 1 4 8 16 --duration 60 --think_time 2
+#
+# Reports the p50/p95/p99 latency of the interactions -- the server-side run of the script after a click,
+# plus the overhead of AppTest -- and how many of them failed on the database: a "Database error"
+# shown to the annotator, or an exception. Writes that were spooled (see `storage_backend.WriteSpool`)
+# are counted separately; they are not lost.
+#
+# Only full reruns of the script are measured. A click inside a fragment (`st.fragment`, the nugget
+# creation page) reruns only the fragment on a server, but AppTest has no fragment reruns -- it starts
+# a new script runner, without the fragments of the previous run, for each interaction -- so the
+# nugget_creation numbers are an upper bound of what an annotator waits.
+#
+# The harness relies on internals of Streamlit (`AppTest._run`, `Runtime.instance`, the widget state
+# protos) and on `page_utils._get_session_id`, so it is tied to the Streamlit version of requirements.txt.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STREAMLIT_VERSION = "1.40.0" # the one the internals above were checked against
+PASSWORD = "load-test-password"
+
+# page -> action -> weight
+CLICK_MIX = {
+    'nugget_creation': {'next': 3, 'next_unfinished': 2, 'no_nugget': 3, 'select_answer': 2},
+    'citation_assessment': {'next': 3, 'next_unfinished': 1, 'no_nugget': 1, 'support': 5},
+    'nugget_alignment': {'next': 2, 'next_unfinished': 1, 'select_sentence': 3, 'select_answer': 4},
+}
+PAGE_MIX = {'nugget_creation': 4, 'citation_assessment': 4, 'nugget_alignment': 2}
+DASHBOARD_BUTTONS = {'nugget_creation': 'creation', 'citation_assessment': 'supportive', 'nugget_alignment': 'alignment'}
+
+
+def _entry_script(repo_root, user_db_path, config_dir):
+    import sys, runpy
+    sys.path.insert(0, repo_root)
+    import streamlit as st
+    import page_utils
+
+    # no browser, so no session cookie -- each simulated annotator brings its token in the session state
+    page_utils._get_session_id = lambda: st.session_state.get('load_test/session_id', None)
+
+    sys.argv = ["entry.py", "--user_db_path", user_db_path, "--task_config_path", config_dir]
+    runpy.run_path(f"{repo_root}/entry.py", run_name="__main__")
+
+
+def _share_runtime():
+    # AppTest sets up a runtime for each run and removes it when the run ends -- under the other sessions
+    # still running. One runtime for all of them instead, like the single runtime of a server process.
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+def _widget_states(*widgets):
+    # only the widgets the annotator touched -- replaying all of them fails on an empty `st.pills`
+    states = WidgetStates()
+    for widget in widgets:
+        states.widgets.append(widget if isinstance(widget, WidgetState) else widget._widget_state)
+    return states
+
+
+def _find(elements, key_suffix: str = None, key: str = None):
+    return [ e for e in elements if (key is not None and e.key == key) or (key_suffix is not None and (e.key or "").endswith(key_suffix)) ]
+
+
+class Annotator:
+
+    def __init__(self, username: str, task_name: str, user_db_path: str, config_dir: str, think_time: float, seed: int):
+        self.username = username
+        self.task_name = task_name
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+
+        self.at = AppTest.from_function(
+            _entry_script, args=(str(REPO_ROOT), user_db_path, config_dir), default_timeout=120
+        )
+        self.at.session_state['load_test/session_id'] = f"load-test-{username}-{seed}"
+
+        # (page, action, seconds, database error, exception)
+        self.interactions: List[Tuple[str, str, float, bool, bool]] = []
+
+    def _think(self):
+        # log-normal, with `think_time` as the median
+        if self.think_time > 0:
+            time.sleep(self.think_time * self.rng.lognormvariate(0, 0.5))
+
+    def _interact(self, page: str, action: str, *widgets):
+        start = time.perf_counter()
+        self.at._run(_widget_states(*widgets) if widgets else None)
+        elapsed = time.perf_counter() - start
+
+        db_error = any( "Database error" in e.value for e in self.at.error )
+        self.interactions.append((page, action, elapsed, db_error, len(self.at.exception) > 0))
+
+    def login(self):
+        self._interact('login', 'open')
+        self.at.text_input[0].set_value(self.username)
+        self.at.text_input[1].set_value(PASSWORD)
+        submit = _find(self.at.button, key_suffix="FormSubmitter:my_form-Login")
+        submit[0].click()
+        self._interact('login', 'submit', self.at.text_input[0], self.at.text_input[1], submit[0])
+        assert len(self.at.sidebar.button) > 1, f"{self.username} could not log in"
+
+    def open_dashboard(self):
+        task_button = [ b for b in self.at.sidebar.button if b.label == self.task_name ][0]
+        task_button.click()
+        self._interact('task_dashboard', 'open', task_button)
+
+    def open_page(self, page: str):
+        buttons = [
+            b for b in self.at.button
+            if (b.key or "").startswith(f"{self.task_name}/entry/{DASHBOARD_BUTTONS[page]}/") and not b.disabled
+        ]
+        if len(buttons) == 0:
+            return False
+        button = self.rng.choice(buttons)
+        button.click()
+        self._interact(page, 'open', button)
+        return True
+
+    def _action(self, page: str, action: str):
+        if action in ('next', 'next_unfinished'):
+            nav = _find(self.at.button_group, key='doc_nav')
+            if nav:
+                nav[0].set_value([action])
+                return nav
+
+        elif action == 'no_nugget':
+            boxes = [ c for c in _find(self.at.checkbox, key_suffix="/no_nugget") if not c.disabled ]
+            if boxes:
+                return [boxes[0].set_value(not boxes[0].value)]
+
+        elif action == 'support':
+            selects = [ s for s in self.at.selectbox if (s.key or "").startswith("supportive ") ]
+            if selects:
+                select = self.rng.choice(selects)
+                return [select.set_value(self.rng.choice(select.options))]
+
+        elif action == 'select_sentence':
+            buttons = _find(self.at.button, key_suffix="/sent_select_btn")
+            if buttons:
+                return [self.rng.choice(buttons).click()]
+
+        elif action == 'select_answer':
+            answers = [ p for p in _find(self.at.button_group, key_suffix="/select") if len(p.options) > 0 ]
+            if answers:
+                # by position -- the options of the tree are the formatted labels, not the answers
+                pills = self.rng.choice(answers)
+                selected = list(pills.indices)
+                unselected = [ i for i, o in enumerate(pills.options) if i not in selected and o.content != ":material/add:" ]
+                if unselected:
+                    state = WidgetState(id=pills.id)
+                    state.int_array_value.data[:] = sorted(selected + [self.rng.choice(unselected)])
+                    return [state]
+        return None
+
+    def work(self, page: str, n_clicks: int):
+        actions, weights = zip(*CLICK_MIX[page].items())
+        for _ in range(n_clicks):
+            self._think()
+            action = self.rng.choices(actions, weights)[0]
+            widgets = self._action(page, action)
+            if widgets is not None:
+                self._interact(page, action, *widgets)
+
+    def run(self, stop_at: float):
+        self.login()
+        pages, weights = zip(*PAGE_MIX.items())
+        while time.monotonic() < stop_at:
+            self._think()
+            self.open_dashboard()
+            self._think()
+            if self.open_page(self.rng.choices(pages, weights)[0]):
+                self.work(self.at.query_params['page'][0], self.rng.randint(3, 10))
+        return self
+
+
+def _percentiles(samples: List[float]):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+def _count_rows(db_path: str):
+    # annotations and nugget saves of the annotators
+    backend = get_backend(db_path)
+    return sum(
+        backend.query(f"select count(*) from {table};")[1][0][0]
+        for table in ['doc_binary_rel', 'sent2doc', 'sent2nugget', 'nuggets']
+    )
+
+
+def run_load(n_users: int, size: WorkloadSize, duration: float, think_time: float, doc_latency: float, seed: int = 0):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        doc_url, stop_docs = StandInDocAPI(synthetic_doc_len=400, latency=doc_latency).start_in_thread()
+
+        config_fn = make_synthetic_task(
+            Path(tmp_dir), replace(size, n_users=n_users), name="load-test", seed=seed,
+            doc_service='http_api', collection_id=f"{doc_url}/synthetic"
+        )
+        # every stage reachable from the dashboard from the start
+        config = json.loads(config_fn.read_text())
+        config['force_citation_asssessment_before_report'] = False
+        config_fn.write_text(json.dumps(config))
+
+        user_db_path = str(Path(tmp_dir) / "user_db.db")
+        auth_manager = AuthManager(user_db_path)
+        for username in config['job_assignment']:
+            auth_manager.add_user(username, PASSWORD, table_init=True)
+
+        db_path = str(Path(config['output_dir']) / "annotation.db")
+        rows_before = _count_rows(db_path)
+        spool_before = storage_backend.get_write_spool().metrics()
+        # created one after the other: AppTest writes the script file of each, which the running ones read
+        annotators = [
+            Annotator(username, config['name'], user_db_path, str(config_fn.parent), think_time, seed * 1000 + i)
+            for i, username in enumerate(config['job_assignment'])
+        ]
+        stop_at = time.monotonic() + duration
+        start = time.perf_counter()
+        # the managers print every statement they log
+        with ThreadPoolExecutor(n_users) as pool, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            list(pool.map(lambda annotator: annotator.run(stop_at), annotators))
+        wall = time.perf_counter() - start
+        spool_after = storage_backend.get_write_spool().metrics()
+        while storage_backend.get_write_spool().metrics()['pending'] > 0:
+            time.sleep(0.1)
+        rows_written = _count_rows(db_path) - rows_before
+        stop_docs()
+
+    interactions = [ i for a in annotators for i in a.interactions ]
+    latencies = [ seconds for _, _, seconds, _, _ in interactions ]
+    return {
+        'n_users': n_users,
+        'interactions': len(interactions),
+        'per_second': len(interactions) / wall,
+        **_percentiles(latencies),
+        'db_error_rate': sum( db_error for *_, db_error, _ in interactions ) / len(interactions),
+        'exception_rate': sum( exception for *_, exception in interactions ) / len(interactions),
+        'rows_written': rows_written,
+        'spooled': spool_after['spooled'] - spool_before['spooled'],
+        'retries': spool_after['retries'] - spool_before['retries'],
+        'by_page': {
+            page: { 'n': len(samples), **_percentiles(samples) }
+            for page in sorted({ p for p, *_ in interactions })
+            for samples in [[ s for p, _, s, _, _ in interactions if p == page ]]
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n_users', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of annotation per run")
+    parser.add_argument('--think_time', type=float, default=1.0, help="median seconds between two clicks")
+    parser.add_argument('--doc_latency_ms', type=float, default=20.0, help="latency of the document API")
+    parser.add_argument('--n_topics', type=int, default=5)
+    parser.add_argument('--n_docs', type=int, default=50)
+    parser.add_argument('--n_runs', type=int, default=10)
+    parser.add_argument('--n_sentences', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None)
+
+    args = parser.parse_args()
+
+    if streamlit.__version__ != STREAMLIT_VERSION:
+        parser.error(f"written against streamlit {STREAMLIT_VERSION} (see requirements.txt), found {streamlit.__version__}")
+
+    _share_runtime()
+
+    # the writes spooled during the run go there, not to the working directory
+    spool_dir = tempfile.TemporaryDirectory()
+    os.environ.setdefault("RAG_SPOOL_DIR", spool_dir.name)
+
+    size = WorkloadSize(n_topics=args.n_topics, n_docs=args.n_docs, n_runs=args.n_runs, n_sentences=args.n_sentences)
+    results = []
+    for n_users in args.n_users:
+        result = run_load(n_users, size, args.duration, args.think_time, args.doc_latency_ms / 1000, args.seed)
+        results.append(result)
+        print(
+            f"{n_users:3d} users  {result['interactions']:5d} interactions ({result['per_second']:5.1f}/s)"
+            f"  p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms"
+            f"  db errors {result['db_error_rate'] * 100:5.2f}%  exceptions {result['exception_rate'] * 100:5.2f}%"
+            f"  rows written {result['rows_written']}  spooled {result['spooled']}  retries {result['retries']}"
+        )
+        for page, stats in result['by_page'].items():
+            print(f"      {page:<20} n {stats['n']:5d}  p50 {stats['p50_ms']:7.1f}  p95 {stats['p95_ms']:7.1f}  p99 {stats['p99_ms']:7.1f} ms")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({
+            'size': asdict(size), 'think_time': args.think_time, 'streamlit': streamlit.__version__,
+            'full_reruns_only': True, 'results': results
+        }, indent=2))
@@ -0,0 +1,73 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import statistics
+import tempfile
+import time
+import os
+
+# Cost of the timing instrumentation (`metrics.timed`) on the task pages. The page-to-page noise of a
+# full run is larger than the instrumentation itself, so the overhead is estimated as
+# (instrumented calls per run x cost of one timed call) / page time.
+# With RAG_METRICS unset, `timed` returns the functions as they are -- there is no cost to measure.
+
+os.environ['RAG_METRICS'] = "1"
+
+from streamlit.testing.v1 import AppTest
+
+import metrics
+from benchmarks.editor_rerun import REPO_ROOT, PAGES, make_task, _page_script
+
+
+def cost_per_call(n: int = 200_000):
+    def _noop():
+        pass
+    _timed_noop = metrics.timed("bench", "noop")(_noop)
+
+    elapsed = {}
+    for name, func in [('raw', _noop), ('timed', _timed_noop)]:
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        elapsed[name] = (time.perf_counter() - start) / n
+    return elapsed['timed'] - elapsed['raw']
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--config', type=Path, default=Path("./configs/mini-test_config.json"))
+    parser.add_argument('--topic', type=str, default="300")
+    parser.add_argument('--n_questions', type=int, default=40)
+    parser.add_argument('--n_runs', type=int, default=10)
+
+    args = parser.parse_args()
+
+    per_call = cost_per_call()
+    print(f"one timed call costs {per_call * 1e6:.2f} us")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        task_name, collection_id, config_dir, doc_ids = make_task(args.config, Path(tmp_dir), args.topic, args.n_questions, 5)
+
+        for page, (module_name, page_name) in PAGES.items():
+            at = AppTest.from_function(
+                _page_script, args=(str(REPO_ROOT), str(config_dir), module_name, page_name, collection_id, doc_ids), default_timeout=60
+            )
+            at.query_params['task'] = task_name
+            at.query_params['topic'] = args.topic
+
+            # the first run loads the managers
+            at._run()
+            n_calls_before = sum( h.n for h in metrics.snapshot().values() )
+            for _ in range(args.n_runs):
+                at._run()
+                assert not at.exception, at.exception
+            n_calls = (sum( h.n for h in metrics.snapshot().values() ) - n_calls_before) / args.n_runs
+
+            page_ms = statistics.median(at.session_state['timings']['page'][1:]) * 1000
+            overhead_ms = n_calls * per_call * 1000
+            print(
+                f"{page:<20} page {page_ms:7.1f} ms  {n_calls:6.0f} timed calls per run"
+                f"  overhead {overhead_ms:6.3f} ms ({overhead_ms / page_ms * 100:.2f}%)"
+            )
+
+    print()
+    print("\n".join( line for line in metrics.render_prometheus().splitlines() if 'le=' not in line )[:3000])
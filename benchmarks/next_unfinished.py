@@ -0,0 +1,89 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import statistics
+import tempfile
+import random
+import time
+
+from data_manager import ActivityLogMananger, AnnotationManager
+
+# Cost of "Next Unfinished" on the citation assessment page of a topic with `--n_docs` documents,
+# near the end of the topic (only `--n_pending` documents left).
+#
+# Before: `is_all_done` on both managers, document by document, from the current one on.
+# After: `next_pending` on both managers, a bisect in the sorted positions of the pending documents.
+
+
+def legacy_next(managers, topic_id, order, current):
+    l = list(range(len(order)))
+    for idx in l[current+1:] + l[:current+1]:
+        if all( m.is_all_done(topic_id, order[idx]) for m in managers ):
+            continue
+        return idx
+    return None
+
+
+def queue_next(managers, topic_id, order, current):
+    candidates = [ m.next_pending(topic_id, 'doc_id', order, current) for m in managers ]
+    return min(( c for c in candidates if c is not None ), key=lambda c: (c - current - 1) % len(order), default=None)
+
+
+def make_managers(tmp_dir: Path, n_docs: int, n_pending: int, seed: int = 0):
+    rng = random.Random(seed)
+    docs = [ f"doc-{i:05d}" for i in range(n_docs) ]
+    cited_sentences = { "300": { d: { f"run-{r}": { str(s): "" for s in range(2) } for r in range(rng.randint(1, 3)) } for d in docs } }
+
+    logger = ActivityLogMananger(tmp_dir / "log.db", "bench")
+    citation = AnnotationManager(
+        tmp_dir / "annotation.db", tmp_dir, logger, table_name="sent2doc", content_obj=cited_sentences,
+        slot_names='annot', level_names=['topic_id', 'doc_id', 'run_id', 'sent_id']
+    )
+    relevance = AnnotationManager(
+        tmp_dir / "annotation.db", tmp_dir, logger, table_name="doc_binary_rel", content_obj={"300": docs},
+        slot_names='no_nugget_found', level_names=['topic_id', 'doc_id']
+    )
+
+    # everything is done but a few documents, spread over the topic
+    citation.content_df['annot'] = "1"
+    relevance.content_df['no_nugget_found'] = "0"
+    for doc_id in rng.sample(docs, k=n_pending):
+        rng.choice([citation, relevance]).content_df.loc[("300", doc_id), :] = None
+    citation.content_df['content'] = ""
+    relevance.content_df['content'] = ""
+
+    return [citation, relevance], docs
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n_docs', type=int, nargs='+', default=[100, 400, 1600])
+    parser.add_argument('--n_pending', type=int, default=3)
+    parser.add_argument('--n_clicks', type=int, default=20)
+
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for n_docs in args.n_docs:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            managers, order = make_managers(Path(tmp_dir), n_docs, args.n_pending)
+            clicks = [ rng.randrange(n_docs) for _ in range(args.n_clicks) ]
+
+            timings = {}
+            for name, find in [('before', legacy_next), ('after', queue_next)]:
+                elapsed = []
+                for current in clicks:
+                    start = time.perf_counter()
+                    find(managers, "300", order, current)
+                    elapsed.append(time.perf_counter() - start)
+                timings[name] = statistics.median(elapsed) * 1000
+
+            # the queues follow the annotations
+            same = all( legacy_next(managers, "300", order, c) == queue_next(managers, "300", order, c) for c in clicks )
+            for citation_key in rng.sample(list(managers[0].content_df.index), k=20):
+                managers[0].annotate(citation_key, 'annot', rng.choice([None, "0", "1"]))
+                same = same and all( legacy_next(managers, "300", order, c) == queue_next(managers, "300", order, c) for c in clicks )
+
+            print(
+                f"{n_docs:5d} documents  before {timings['before']:9.2f} ms  after {timings['after']:6.3f} ms per click"
+                f"  same documents: {same}"
+            )
@@ -0,0 +1,153 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import subprocess
+import tempfile
+import filecmp
+import random
+import json
+import time
+import sys
+
+# Wall clock and peak RSS of `scripts/prepare_utils.py` on synthetic RAG runs, against the old
+# in-memory version of the script (`legacy_build` below), and whether the outputs are identical.
+# Peak RSS is the largest single process (the script or one of its workers).
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+OUTPUTS = ['report-sentences.json', 'citation-to-sentences.json', 'document_pool.json']
+
+
+def make_runs(output_dir: Path, n_runs: int, n_topics: int, n_sents: int, n_docs: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = [ "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9))) for _ in range(2000) ]
+
+    fns = []
+    for r in range(n_runs):
+        fn = output_dir / f"run-{r}.jsonl"
+        topics = [ str(300 + t) for t in range(n_topics) ]
+        rng.shuffle(topics) # runs do not list the topics in the same order
+        with fn.open('w') as fw:
+            for topic_id in topics:
+                fw.write(json.dumps({
+                    'request_id': topic_id,
+                    'sentences': [
+                        {
+                            'text': " ".join(rng.choices(words, k=rng.randint(10, 40))),
+                            'citations': [ f"{topic_id}-doc-{rng.randrange(n_docs)}" for _ in range(rng.choice([0, 1, 1, 2, 3])) ]
+                        }
+                        for _ in range(rng.randint(1, n_sents))
+                    ]
+                }) + "\n")
+        fns.append(fn)
+
+    qrels_fn = output_dir / "qrels.txt"
+    with qrels_fn.open('w') as fw:
+        for t in range(n_topics):
+            for d in rng.sample(range(n_docs * 2), k=min(20, n_docs)):
+                fw.write(f"{300 + t} 0 {300 + t}-doc-{d} {rng.choice([0, 1, 2])}\n")
+
+    return fns, qrels_fn
+
+
+def legacy_build(name: str, input_reports, output_dir: Path, qrels, add_rel_docs: bool, construct_doc_pool: bool):
+    # the previous version of scripts/prepare_utils.py, minus the checks
+    import pandas as pd
+    import ir_measures as irms
+
+    all_runs = {
+        (f.stem if f.suffix == ".jsonl" else f.name): [ json.loads(l) for l in f.open() ]
+        for f in map(Path, input_reports)
+    }
+
+    data = {}
+    for run_id, run in all_runs.items():
+        for topic_run in run:
+            data.setdefault(topic_run['request_id'], {})[ run_id ] = {
+                i: s['text'] for i, s in enumerate(topic_run['sentences'])
+            }
+    with (output_dir / f"{name}.report-sentences.json").open('w') as fw:
+        json.dump(data, fw)
+
+    data = {}
+    for run_id, run in all_runs.items():
+        for topic_run in run:
+            docs = data.setdefault(topic_run['request_id'], {})
+            for i, sent in enumerate(topic_run['sentences']):
+                for doc_id in sent['citations']:
+                    docs.setdefault(doc_id, {}).setdefault(run_id, {})[i] = sent['text']
+
+    if add_rel_docs:
+        for fn in qrels:
+            qrel = pd.DataFrame(irms.read_trec_qrels(fn)).set_index(['query_id', 'relevance']).doc_id
+            if 0 in qrel.index.get_level_values('relevance').unique():
+                qrel = qrel.drop(0, level='relevance')
+            for request_id in data:
+                if request_id not in qrel.index:
+                    continue
+                for doc_id in qrel.loc[request_id]:
+                    if doc_id not in data[request_id]:
+                        data[request_id][doc_id] = {}
+
+    with (output_dir / f"{name}.citation-to-sentences.json").open('w') as fw:
+        json.dump(data, fw)
+
+    if construct_doc_pool:
+        with (output_dir / f"{name}.document_pool.json").open('w') as fw:
+            json.dump({ topic_id: list(d.keys()) for topic_id, d in data.items() }, fw)
+
+
+def _measure(cmd):
+    # wall clock and peak RSS (MiB) of `cmd` run in a fresh process
+    wrapper = (
+        "import resource, subprocess, sys, time; start = time.perf_counter(); "
+        "proc = subprocess.run(sys.argv[1:], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True); "
+        "assert proc.returncode == 0, proc.stderr[-2000:]; "
+        "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)"
+    )
+    out = subprocess.run([sys.executable, "-c", wrapper, *cmd], cwd=REPO_ROOT, capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr[-2000:]
+    elapsed, rss = map(float, out.stdout.split())
+    return elapsed, rss
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n_runs', type=int, default=60)
+    parser.add_argument('--n_topics', type=int, default=300)
+    parser.add_argument('--n_sents', type=int, default=30, help="max sentences per report")
+    parser.add_argument('--n_docs', type=int, default=200, help="candidate docs to cite per topic")
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 4])
+    parser.add_argument('--num_shards', type=int, default=64)
+    parser.add_argument('--_legacy', nargs='+', default=None, help="(internal) run the legacy build: name output_dir qrels runs...")
+
+    args = parser.parse_args()
+
+    if args._legacy is not None:
+        name, output_dir, qrels, *runs = args._legacy
+        legacy_build(name, runs, Path(output_dir), [qrels], add_rel_docs=True, construct_doc_pool=True)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        (tmp_dir / "runs").mkdir()
+        runs, qrels_fn = make_runs(tmp_dir / "runs", args.n_runs, args.n_topics, args.n_sents, args.n_docs)
+        size = sum(fn.stat().st_size for fn in runs)
+        print(f"{len(runs)} runs x {args.n_topics} topics, {size / 2**20:.1f} MiB of run files")
+
+        (tmp_dir / "legacy").mkdir()
+        elapsed, rss = _measure([
+            sys.executable, "-m", "benchmarks.prepare_utils", "--_legacy", "bench", str(tmp_dir / "legacy"), str(qrels_fn), *map(str, runs)
+        ])
+        print(f"{'legacy (in memory)':<24} {elapsed:8.2f} s  peak RSS {rss:8.1f} MiB")
+
+        for num_workers in args.num_workers:
+            output_dir = tmp_dir / f"workers-{num_workers}"
+            elapsed, rss = _measure([
+                sys.executable, "scripts/prepare_utils.py", "--name", "bench", "--output_dir", str(output_dir),
+                "--input_reports", *map(str, runs), "--qrels", str(qrels_fn), "--add_rel_docs", "--construct_doc_pool",
+                "--num_workers", str(num_workers), "--num_shards", str(args.num_shards)
+            ])
+            identical = all(
+                filecmp.cmp(tmp_dir / "legacy" / f"bench.{fn}", output_dir / f"bench.{fn}", shallow=False)
+                for fn in OUTPUTS
+            )
+            print(f"{f'streaming, {num_workers} workers':<24} {elapsed:8.2f} s  peak RSS {rss:8.1f} MiB  identical outputs: {identical}")
@@ -0,0 +1,124 @@
+from argparse import ArgumentParser
+from typing import List
+from pathlib import Path
+import asyncio
+import threading
+import sqlite3
+import random
+
+from aiohttp import web
+
+# Local stand-in for the networked store of `storage_backend.RqliteBackend`: the part of the rqlite
+# HTTP API the managers use, served from one sqlite file.
+#
+#   python -m benchmarks.sql_stand_in --db_path ./shared.db --port 4001
+#
+# and point the task configs to it with `"storage_url": "http://localhost:4001"` (or pass the url as
+# `--user_db_path` of entry.py). Like rqlite, the server holds a single database, so give each task
+# its own server.
+
+
+class StandInSqlServer:
+
+    def __init__(self, db_path: str, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.db_path = str(db_path)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+
+        self.stats = {'requests': 0, 'statements': 0, 'errors': 0, 'injected_failures': 0}
+
+        # writes of all the clients go through this one connection, one request at a time
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._lock = asyncio.Lock()
+
+        self.app = web.Application()
+        self.app.router.add_get('/status', self._status)
+        self.app.router.add_post('/db/execute', self._execute)
+        self.app.router.add_post('/db/query', self._query)
+
+    async def _status(self, request: web.Request):
+        return web.json_response(self.stats)
+
+    def _run(self, statements: List[List], transaction: bool, query: bool):
+        results = []
+        if transaction:
+            self._conn.execute("begin")
+        for query_string, *args in statements:
+            self.stats['statements'] += 1
+            try:
+                cursor = self._conn.execute(query_string, args)
+            except sqlite3.Error as e:
+                self.stats['errors'] += 1
+                results.append({'error': str(e)})
+                if transaction:
+                    self._conn.execute("rollback")
+                    return results
+                continue
+
+            if query:
+                results.append({
+                    'columns': [ d[0] for d in cursor.description or [] ],
+                    'values': [ list(row) for row in cursor.fetchall() ]
+                })
+            else:
+                results.append({'last_insert_id': cursor.lastrowid, 'rows_affected': cursor.rowcount})
+        if transaction:
+            self._conn.execute("commit")
+        return results
+
+    async def _handle(self, request: web.Request, query: bool):
+        self.stats['requests'] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if self.rng.random() < self.failure_rate:
+            self.stats['injected_failures'] += 1
+            return web.json_response({'error': 'injected failure'}, status=503)
+
+        statements = await request.json()
+        async with self._lock:
+            results = self._run(statements, 'transaction' in request.query, query)
+        return web.json_response({'results': results})
+
+    async def _execute(self, request: web.Request):
+        return await self._handle(request, query=False)
+
+    async def _query(self, request: web.Request):
+        return await self._handle(request, query=True)
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0):
+        """Start serving on a background thread; returns the base url and a stop function."""
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(self.app)
+
+        async def _start():
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            return site._server.sockets[0].getsockname()[1]
+
+        thread = threading.Thread(target=loop.run_forever, name="sql-stand-in", daemon=True)
+        thread.start()
+        bound_port = asyncio.run_coroutine_threadsafe(_start(), loop).result()
+
+        def _stop():
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+        return f"http://{host}:{bound_port}", _stop
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--db_path', type=Path, default=Path("./shared.db"))
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=4001)
+    parser.add_argument('--latency_ms', type=float, default=0.0)
+    parser.add_argument('--failure_rate', type=float, default=0.0)
+
+    args = parser.parse_args()
+
+    server = StandInSqlServer(args.db_path, latency=args.latency_ms / 1000, failure_rate=args.failure_rate)
+    web.run_app(server.app, host=args.host, port=args.port)
@@ -0,0 +1,89 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import statistics
+import tempfile
+import random
+import time
+
+from data_manager import ActivityLogMananger, AnnotationManager, NuggetSaverManager, NuggetSet, SqliteManager
+from benchmarks.sql_stand_in import StandInSqlServer
+
+# The managers on the two storage backends: a sqlite file in output_dir (the default) and the
+# networked store (`storage_url`), here the local stand-in server. `--n_nodes` annotators write
+# at the same time, each through its own managers, as if on different annotation hosts.
+# Reports the latency of `annotate` and `flush`, and checks that every write is in the store and
+# that a fresh manager reads back what the writer holds in memory.
+
+CITED_SENTENCES = {
+    str(t): { f"doc-{d}": { f"run-{r}": { str(s): "" for s in range(3) } for r in range(2) } for d in range(20) }
+    for t in range(5)
+}
+
+
+def _annotator(location: str, username: str, n_writes: int, seed: int):
+    rng = random.Random(seed)
+    logger = ActivityLogMananger(location, username)
+    manager = AnnotationManager(
+        location, "/tmp", logger, table_name="sent2doc", content_obj=CITED_SENTENCES,
+        slot_names='annot', level_names=['topic_id', 'doc_id', 'run_id', 'sent_id']
+    )
+    nugget_manager = NuggetSaverManager(location, tempfile.mkdtemp(), logger)
+
+    # each sentence once -- the rows only have second resolution timestamps to tell the latest one
+    keys = rng.sample(list(manager.content_df.index), k=n_writes)
+    annotate, flush = [], []
+    for i, key in enumerate(keys):
+        start = time.perf_counter()
+        manager.annotate(key, 'annot', str(i))
+        annotate.append(time.perf_counter() - start)
+
+        if i % 10 == 0:
+            topic_id = rng.choice(list(CITED_SENTENCES))
+            nugget_manager[topic_id].add(f"Question {i}?", [(f"doc-{i}", f"answer {i}")])
+            start = time.perf_counter()
+            nugget_manager.flush(topic_id)
+            flush.append(time.perf_counter() - start)
+
+    return manager, annotate, flush
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--n_nodes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--n_writes', type=int, default=200, help="annotations per annotator")
+    parser.add_argument('--latency_ms', type=float, default=1.0, help="network latency added by the stand-in")
+
+    args = parser.parse_args()
+
+    for n_nodes in args.n_nodes:
+        for backend in ['sqlite', 'networked']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                stop = None
+                if backend == 'sqlite':
+                    location = str(Path(tmp_dir) / "annotation.db")
+                else:
+                    location, stop = StandInSqlServer(Path(tmp_dir) / "shared.db", latency=args.latency_ms / 1000).start_in_thread()
+
+                # create the tables once, before the annotators race for it
+                _annotator(location, "setup", 0, 0)
+
+                with ThreadPoolExecutor(n_nodes) as pool:
+                    results = list(pool.map(
+                        lambda i: _annotator(location, f"user-{i}", args.n_writes, i), range(n_nodes)
+                    ))
+
+                n_rows = SqliteManager(location).execute_simple("select count(*) from sent2doc;")[0][0]
+                same = all(
+                    manager.content_df.equals(_annotator(location, manager.username, 0, 0)[0].content_df)
+                    for manager, _, _ in results
+                )
+                if stop is not None:
+                    stop()
+
+            annotate_ms = statistics.median( t for _, a, _ in results for t in a ) * 1000
+            flush_ms = statistics.median( t for _, _, f in results for t in f ) * 1000
+            print(
+                f"{n_nodes} annotators  {backend:<9}  annotate {annotate_ms:6.2f} ms  flush {flush_ms:6.2f} ms"
+                f"  rows {n_rows}/{n_nodes * args.n_writes}  read back the same: {same}"
+            )
@@ -0,0 +1,205 @@
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+import statistics
+import subprocess
+import platform
+import tempfile
+import random
+import time
+import json
+import io
+import os
+
+# Times the operations of the managers on synthetic tasks (`benchmarks/synthetic.py`) of a few sizes,
+# and writes the numbers as json, so two releases can be compared:
+#
+#   python -m benchmarks.suite --sizes small medium --output before.json
+#   ... (another revision)
+#   python -m benchmarks.suite --sizes small medium --output after.json --compare before.json
+#
+# Timings are in milliseconds: the median, the 95th percentile and the number of calls per operation.
+
+SIZES = {
+    # topics, docs per topic, runs per topic, sentences per report
+    'small': (10, 100, 10, 20),
+    'medium': (50, 200, 20, 30),
+    'large': (100, 300, 30, 40),
+}
+
+MANAGER_NAMES = ['relevance_assessment_manager', 'citation_assessment_manager', 'nugget_alignment_manager']
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _stats(samples: List[float]):
+    samples = sorted(samples)
+    return {
+        'n': len(samples),
+        'median_ms': statistics.median(samples) * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000,
+        'total_ms': sum(samples) * 1000,
+    }
+
+
+class Timer:
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    def __call__(self, name: str, func: Callable, *args, **kwargs):
+        # the managers print every statement they log; that is not what is measured here
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            ret = func(*args, **kwargs)
+            self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        return ret
+
+    def results(self):
+        return { name: _stats(samples) for name, samples in self.samples.items() }
+
+
+def run_size(size, tmp_dir: Path, repeats: int, n_calls: int, seed: int = 0):
+    import streamlit as st
+    from task_resources import TaskConfig
+    from data_manager import NuggetSet, NuggetSelection, get_manager, get_nugget_loader, get_progress_snapshot, export_data
+    from benchmarks.synthetic import make_synthetic_task
+
+    timer = Timer()
+    rng = random.Random(seed)
+
+    start = time.perf_counter()
+    config_fn = make_synthetic_task(tmp_dir, size, seed=seed)
+    generate_s = time.perf_counter() - start
+
+    task_config = timer("task_config", TaskConfig.from_json, config_fn)
+    username = next(iter(task_config.job_assignment))
+    topic_ids = list(task_config.job_assignment[username])
+
+    for _ in range(repeats):
+        # a new session: nothing of the previous one is kept
+        st.session_state.clear()
+        for name in MANAGER_NAMES:
+            timer(f"construct/{name}", get_manager, task_config, username, name)
+        timer("progress_snapshot/first", get_progress_snapshot, task_config, username)
+        timer("progress_snapshot/again", get_progress_snapshot, task_config, username)
+
+    relevance = get_manager(task_config, username, 'relevance_assessment_manager')
+    citation = get_manager(task_config, username, 'citation_assessment_manager')
+    alignment = get_manager(task_config, username, 'nugget_alignment_manager')
+    nugget_manager = get_manager(task_config, username, 'nugget_manager')
+    nugget_loader = get_nugget_loader(task_config, username)
+
+    citation_keys = list(citation.content_df.index)
+    alignment_keys = list(alignment.content_df.index)
+    for i in range(n_calls):
+        topic_id = rng.choice(topic_ids)
+        doc_id = rng.choice(task_config.pooled_docs[topic_id])
+
+        timer("annotate/citation", citation.annotate, rng.choice(citation_keys), 'annot', f"value {i}")
+        timer("annotate/relevance", relevance.annotate, (topic_id, doc_id), 'no_nugget_found', str(i % 2))
+        timer(
+            "annotate/alignment", alignment.annotate, rng.choice(alignment_keys), 'nugget',
+            NuggetSelection({(f"Question {i % 7} about {topic_id}?", f"answer {i % 7}.0")})
+        )
+        timer("is_all_done", citation.is_all_done, topic_id, doc_id)
+        timer("count_done", relevance.count_done, topic_id, level='doc_id')
+        # with the progress counters of `annotate` kept up to date
+        timer("progress_snapshot/after_annotate", get_progress_snapshot, task_config, username)
+
+    for i in range(n_calls):
+        topic_id = rng.choice(topic_ids)
+        nugget_set: NuggetSet = timer("nugget_loader/get", nugget_loader.get, topic_id)
+        revised = timer("nugget_loader/get_revised", nugget_loader.get, topic_id, source='revised')
+        timer("nugget_set/merge", lambda a, b: a + b, revised, nugget_set)
+        timer(
+            "nugget_set/add", nugget_manager[topic_id].add,
+            f"Question {i} added?", [ (doc_id, f"answer {i}") for doc_id in rng.sample(task_config.pooled_docs[topic_id], k=2) ]
+        )
+        timer("nugget_manager/flush", nugget_manager.flush, topic_id)
+
+    for _ in range(repeats):
+        timer("export_data", export_data, task_config, username, MANAGER_NAMES + ['nugget_manager'])
+
+    result = {
+        'size': asdict(size),
+        'label': size.label,
+        'generate_s': generate_s,
+        'db_mb': (tmp_dir / "outputs" / "annotation.db").stat().st_size / 2**20,
+        'units': { name: int(get_manager(task_config, username, name).content_df.shape[0]) for name in MANAGER_NAMES },
+        'operations': timer.results(),
+    }
+    st.session_state.clear()
+    return result
+
+
+def compare(results: Dict, baseline: Dict):
+    old = { (r['label'], op): stats for r in baseline['results'] for op, stats in r['operations'].items() }
+    print(f"\ncompared to {baseline['meta'].get('revision', None)} ({baseline['meta'].get('timestamp', '')}), median ms")
+    for r in results['results']:
+        for op, stats in r['operations'].items():
+            before = old.get((r['label'], op), None)
+            if before is None:
+                continue
+            ratio = stats['median_ms'] / before['median_ms'] if before['median_ms'] > 0 else float('inf')
+            print(f"{r['label']:<28} {op:<46} {before['median_ms']:10.3f} -> {stats['median_ms']:10.3f}  x{ratio:5.2f}")
+
+
+if __name__ == '__main__':
+    from benchmarks.synthetic import WorkloadSize
+
+    parser = ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], help=f"of {list(SIZES)}, or topics,docs,runs,sentences")
+    parser.add_argument('--n_users', type=int, default=4)
+    parser.add_argument('--annotated', type=float, default=0.5)
+    parser.add_argument('--repeats', type=int, default=3, help="of the per-session operations -- construction, first snapshot, export")
+    parser.add_argument('--n_calls', type=int, default=100, help="of the per-click operations")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None)
+    parser.add_argument('--compare', type=Path, default=None, help="results of an earlier run")
+
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeats': args.repeats, 'n_calls': args.n_calls, 'seed': args.seed,
+        },
+        'results': []
+    }
+
+    # the writes spooled during the run go there, not to the working directory
+    spool_dir = tempfile.TemporaryDirectory()
+    os.environ.setdefault("RAG_SPOOL_DIR", spool_dir.name)
+
+    for size_name in args.sizes:
+        n_topics, n_docs, n_runs, n_sentences = SIZES[size_name] if size_name in SIZES else map(int, size_name.split(","))
+        size = WorkloadSize(
+            n_topics=n_topics, n_docs=n_docs, n_runs=n_runs, n_sentences=n_sentences,
+            n_users=args.n_users, annotated=args.annotated
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = run_size(size, Path(tmp_dir), args.repeats, args.n_calls, args.seed)
+        results['results'].append(result)
+
+        print(f"\n{result['label']}  units {result['units']}  db {result['db_mb']:.1f} MB  generated in {result['generate_s']:.1f} s")
+        for op, stats in result['operations'].items():
+            print(f"  {op:<40} median {stats['median_ms']:10.3f} ms   p95 {stats['p95_ms']:10.3f} ms   n {stats['n']:4d}")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.compare is not None:
+        compare(results, json.loads(args.compare.read_text()))
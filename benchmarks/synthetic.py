@@ -0,0 +1,224 @@
+from argparse import ArgumentParser
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+from pathlib import Path
+import random
+import json
+
+from storage_backend import get_backend
+from benchmarks.doc_api_stand_in import _WORDS
+
+# A synthetic task at campaign scale: topics, doc pools, cited sentences, report runs and a task
+# config, plus an annotation.db with the history a campaign that far along would have left -- edited
+# annotations, nuggets of every annotator and the revised nuggets of the topics.
+#
+#   python -m benchmarks.synthetic --out_dir ./synthetic --n_topics 50 --n_docs 200 --n_runs 20 --n_sentences 30
+#
+# writes ./synthetic/configs/<name>_config.json, which entry.py can serve with `--task_config_dir ./synthetic/configs`.
+
+
+@dataclass(frozen=True)
+class WorkloadSize:
+    n_topics: int = 10
+    n_docs: int = 100         # pooled documents per topic
+    n_runs: int = 10          # report runs per topic
+    n_sentences: int = 20     # sentences per report
+    n_citations: int = 2      # documents cited by each sentence
+    n_users: int = 2          # every topic is assigned to all of them
+    n_questions: int = 30     # nuggets per topic
+    annotated: float = 0.5    # fraction of the annotation units done
+    edits: float = 0.2        # fraction of the done units annotated more than once
+
+    @property
+    def label(self):
+        return f"{self.n_topics}t x {self.n_docs}d x {self.n_runs}r x {self.n_sentences}s"
+
+
+# table, resource, slot and levels of the annotation managers, as `data_manager.get_manager` builds them
+ANNOTATION_TABLES = {
+    'relevance_assessment_manager': ("doc_binary_rel", 'doc_pools', 'no_nugget_found', ['topic_id', 'doc_id']),
+    'citation_assessment_manager': ("sent2doc", 'cited_sentences', 'annot', ['topic_id', 'doc_id', 'run_id', 'sent_id']),
+    'nugget_alignment_manager': ("sent2nugget", 'report_runs', 'nugget', ['topic_id', 'run_id', 'sent_id']),
+}
+
+
+def _sentence(rng: random.Random, n_words: int = 20):
+    return " ".join(rng.choices(_WORDS, k=n_words)).capitalize() + "."
+
+
+def make_resources(size: WorkloadSize, seed: int = 0):
+    rng = random.Random(seed)
+    topic_ids = [ f"T{t:04d}" for t in range(size.n_topics) ]
+
+    requests = [
+        {'request_id': topic_id, 'problem_statement': _sentence(rng, 25), 'background': _sentence(rng, 40)}
+        for topic_id in topic_ids
+    ]
+    doc_pools = { topic_id: [ f"{topic_id}-d{d:05d}" for d in range(size.n_docs) ] for topic_id in topic_ids }
+
+    report_runs: Dict[str, Dict[str, Dict[str, str]]] = {}
+    cited_sentences: Dict[str, Dict[str, Dict[str, Dict[str, str]]]] = {}
+    for topic_id in topic_ids:
+        report_runs[topic_id] = {}
+        cited = cited_sentences[topic_id] = {}
+        for r in range(size.n_runs):
+            run_id = f"run-{r:03d}"
+            report_runs[topic_id][run_id] = {}
+            for s in range(size.n_sentences):
+                text = report_runs[topic_id][run_id][str(s)] = _sentence(rng)
+                for doc_id in rng.sample(doc_pools[topic_id], k=min(size.n_citations, size.n_docs)):
+                    cited.setdefault(doc_id, {}).setdefault(run_id, {})[str(s)] = text
+
+    return requests, doc_pools, cited_sentences, report_runs
+
+
+def make_nugget_set(topic_id: str, doc_ids: List[str], n_questions: int, rng: random.Random):
+    nugget_list = [
+        (f"Question {i} about {topic_id}?", {
+            f"answer {i}.{j}": rng.sample(doc_ids, k=min(len(doc_ids), rng.randint(1, 4)))
+            for j in range(rng.randint(1, 5))
+        })
+        for i in range(n_questions)
+    ]
+    group_assignment = { q: f"group {rng.randrange(5)}" for q, _ in nugget_list if rng.random() < 0.5 }
+    return {'nugget_list': nugget_list, 'group_assignment': group_assignment}
+
+
+def _annotation_value(slot: str, nugget_set: Dict, rng: random.Random):
+    if slot == 'no_nugget_found':
+        return rng.choice(["0", "1"])
+    if slot == 'annot':
+        return rng.choice(["not supported", "supported"])
+    # a NuggetSelection
+    q, answers = rng.choice(nugget_set['nugget_list'])
+    return json.dumps(sorted([[q, a] for a in rng.sample(list(answers), k=1)]))
+
+
+def _iter_units(resource, levels: int, prefix=()):
+    # the full keys of the annotation units, like `data_manager._flatten_dict`
+    if isinstance(resource, list):
+        resource = dict.fromkeys(resource)
+    for key, val in resource.items():
+        if levels == 1:
+            yield (*prefix, key)
+        else:
+            yield from _iter_units(val, levels - 1, (*prefix, key))
+
+
+def populate_history(db_path: str, resources: Dict, usernames: List[str], size: WorkloadSize, seed: int = 0):
+    """
+    Writes the annotations, nuggets and revised nuggets of `usernames` to `db_path` in bulk, with timestamps
+    spread over the last weeks. Returns the number of rows per table.
+    """
+    from data_manager import ActivityLogMananger, NuggetSaverManager, PreloadNuggetStore
+
+    rng = random.Random(seed)
+    backend = get_backend(db_path)
+    start = datetime.now() - timedelta(days=21)
+    def _ts():
+        return (start + timedelta(seconds=rng.randrange(21 * 24 * 3600))).strftime("%Y-%m-%d %H:%M:%S")
+
+    revised = {
+        topic_id: make_nugget_set(topic_id, doc_ids, size.n_questions, rng)
+        for topic_id, doc_ids in resources['doc_pools'].items()
+    }
+    counts = {'preload_nuggets': PreloadNuggetStore(db_path).ingest(
+        ( (topic_id, json.dumps(nugget_set)) for topic_id, nugget_set in revised.items() ), 'revised', overwrite=True
+    )}
+
+    NuggetSaverManager(db_path, "/tmp", ActivityLogMananger(db_path, "synthetic"))
+
+    for table, resource, slot, levels in ANNOTATION_TABLES.values():
+        # the table `AnnotationManager` creates
+        backend.execute(f"""
+            create table if not exists {table} (
+                username string, {", ".join( f"{col} string" for col in levels )},
+                slot_name string, annotation string,
+                ts datetime default current_timestamp
+            );
+        """)
+        rows = []
+        for username in usernames:
+            for key in _iter_units(resources[resource], len(levels)):
+                if rng.random() >= size.annotated:
+                    continue
+                for _ in range(1 + (rng.random() < size.edits) * rng.randint(1, 3)):
+                    rows.append((username, *key, slot, _annotation_value(slot, revised[key[0]], rng), _ts()))
+        # in the order they were made, like the app appends them
+        rows.sort(key=lambda row: row[-1])
+        counts[table] = backend.executemany(
+            f"insert into {table} (username, {', '.join(levels)}, slot_name, annotation, ts) values ({', '.join(['?'] * (len(levels) + 4))});",
+            rows
+        )
+
+    counts['nuggets'] = backend.executemany(
+        "insert into nuggets (username, topic_id, nugget_json, ts) values (?, ?, ?, ?);",
+        (
+            (username, topic_id, json.dumps(make_nugget_set(topic_id, doc_ids, size.n_questions, rng)), _ts())
+            for username in usernames for topic_id, doc_ids in resources['doc_pools'].items()
+        )
+    )
+    return counts
+
+
+def make_synthetic_task(
+        out_dir: Path, size: WorkloadSize, name: str = "synthetic", seed: int = 0,
+        doc_service: str = 'ir_datasets', collection_id: str = "synthetic", with_history: bool = True
+    ) -> Path:
+    """Writes the resources, the task config and (optionally) the annotation history; returns the config file."""
+    out_dir = Path(out_dir)
+    (out_dir / "resources").mkdir(parents=True, exist_ok=True)
+    (out_dir / "configs").mkdir(exist_ok=True)
+    (out_dir / "outputs").mkdir(exist_ok=True)
+
+    requests, doc_pools, cited_sentences, report_runs = make_resources(size, seed)
+    with (out_dir / "resources" / "requests.jsonl").open("w") as fw:
+        for request in requests:
+            fw.write(json.dumps(request) + "\n")
+    for fn, data in [("doc_pools.json", doc_pools), ("cited_sentences.json", cited_sentences), ("report_runs.json", report_runs)]:
+        (out_dir / "resources" / fn).write_text(json.dumps(data))
+
+    usernames = [ f"annotator-{u}" for u in range(size.n_users) ]
+    config = {
+        'name': name,
+        'output_dir': str(out_dir / "outputs"),
+        'job_assignment': { username: [ r['request_id'] for r in requests ] for username in usernames },
+        'topic_file': str(out_dir / "resources" / "requests.jsonl"),
+        'doc_pools_path': str(out_dir / "resources" / "doc_pools.json"),
+        'cited_sentences_path': str(out_dir / "resources" / "cited_sentences.json"),
+        'report_runs_path': str(out_dir / "resources" / "report_runs.json"),
+        'load_nugget_from': "db",
+        'collection_id': collection_id,
+        'doc_service': doc_service,
+    }
+    config_fn = out_dir / "configs" / f"{name}_config.json"
+    config_fn.write_text(json.dumps(config, indent=4))
+
+    if with_history:
+        populate_history(
+            str(out_dir / "outputs" / "annotation.db"),
+            {'doc_pools': doc_pools, 'cited_sentences': cited_sentences, 'report_runs': report_runs},
+            usernames, size, seed
+        )
+    return config_fn
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--out_dir', type=Path, required=True)
+    parser.add_argument('--name', type=str, default="synthetic")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no_history', action='store_true')
+    parser.add_argument('--doc_service', type=str, default='ir_datasets')
+    parser.add_argument('--collection_id', type=str, default="synthetic")
+    for field_name, default in asdict(WorkloadSize()).items():
+        parser.add_argument(f'--{field_name}', type=type(default), default=default)
+
+    args = parser.parse_args()
+
+    size = WorkloadSize(**{ k: getattr(args, k) for k in asdict(WorkloadSize()) })
+    config_fn = make_synthetic_task(
+        args.out_dir, size, args.name, args.seed, args.doc_service, args.collection_id, with_history=not args.no_history
+    )
+    print(f"{size.label}  ->  {config_fn}")
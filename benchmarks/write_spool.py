@@ -0,0 +1,132 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import tempfile
+import threading
+import sqlite3
+import random
+import time
+
+import storage_backend
+from storage_backend import StorageError, WriteSpool, get_backend
+from data_manager import ActivityLogMananger, AnnotationManager
+from benchmarks.sql_stand_in import StandInSqlServer
+
+# Annotation writes while the store is unavailable for `--outage` seconds, with `--n_annotators`
+# annotating all along:
+#   lock: another connection holds an exclusive lock on the sqlite file (e.g., a long export or a backup)
+#   outage: the networked store answers every request with HTTP 503
+#
+# Before: one attempt per write; the ones that fail are lost (the UI has already shown them).
+# After: `WriteSpool` -- retries within a deadline, then the spool, replayed once the store is back.
+
+CITED_SENTENCES = {
+    str(t): { f"doc-{d}": { f"run-{r}": { str(s): "" for s in range(3) } for r in range(3) } for d in range(30) }
+    for t in range(4)
+}
+
+
+def _make_manager(location: str, username: str):
+    return AnnotationManager(
+        location, "/tmp", ActivityLogMananger(location, username), table_name="sent2doc", content_obj=CITED_SENTENCES,
+        slot_names='annot', level_names=['topic_id', 'doc_id', 'run_id', 'sent_id']
+    )
+
+
+def _annotate(location: str, username: str, duration: float, legacy: bool, seed: int):
+    rng = random.Random(seed)
+    manager = _make_manager(location, username)
+    if legacy and hasattr(manager.backend, 'busy_timeout'):
+        manager.backend.busy_timeout = 5.0 # sqlite3's default, which it used to wait
+    keys = rng.sample(list(manager.content_df.index), k=len(manager.content_df))
+
+    n_writes, stop_at = 0, time.monotonic() + duration
+    for i, key in enumerate(keys):
+        if time.monotonic() > stop_at:
+            break
+        if legacy:
+            # what `execute_simple` used to do: one attempt, and an error message
+            manager.content_df.loc[[key], 'annot'] = str(i)
+            try:
+                manager.backend.execute(
+                    "insert into sent2doc (topic_id, doc_id, run_id, sent_id, slot_name, annotation, username) values (?, ?, ?, ?, ?, ?, ?);",
+                    (*key, 'annot', str(i), username)
+                )
+            except StorageError:
+                pass
+        else:
+            manager.annotate(key, 'annot', str(i))
+        n_writes += 1
+        time.sleep(rng.uniform(0.01, 0.05)) # clicks
+    return manager, n_writes
+
+
+def _make_unavailable(scenario: str, location: str, server: StandInSqlServer, start: float, duration: float):
+    time.sleep(start)
+    if scenario == 'lock':
+        conn = sqlite3.connect(location)
+        conn.execute("begin exclusive")
+        time.sleep(duration)
+        conn.rollback()
+        conn.close()
+    else:
+        server.failure_rate = 1.0
+        time.sleep(duration)
+        server.failure_rate = 0.0
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', default=['lock', 'outage'])
+    parser.add_argument('--n_annotators', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--outage', type=float, default=6.0, help="longer than the 5s sqlite3 used to wait for a lock")
+    parser.add_argument('--deadline', type=float, default=2.0, help="retry deadline of the spool")
+
+    args = parser.parse_args()
+
+    for scenario in args.scenarios:
+        for mode in ['before', 'after']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                server, stop = None, None
+                if scenario == 'lock':
+                    location = str(Path(tmp_dir) / "annotation.db")
+                else:
+                    server = StandInSqlServer(Path(tmp_dir) / "shared.db")
+                    location, stop = server.start_in_thread()
+                spool = storage_backend._write_spool = WriteSpool(Path(tmp_dir) / "spool", deadline=args.deadline, replay_interval=0.2)
+                _make_manager(location, "setup")
+
+                max_lag = 0.0
+                def _watch():
+                    global max_lag
+                    while not done.is_set():
+                        max_lag = max(max_lag, spool.replay_lag)
+                        time.sleep(0.05)
+                done = threading.Event()
+                threading.Thread(target=_watch, daemon=True).start()
+                threading.Thread(target=_make_unavailable, args=(scenario, location, server, 1.0, args.outage), daemon=True).start()
+
+                with ThreadPoolExecutor(args.n_annotators) as pool:
+                    results = list(pool.map(
+                        lambda i: _annotate(location, f"user-{i}", args.duration, mode == 'before', i), range(args.n_annotators)
+                    ))
+
+                start = time.perf_counter()
+                while spool.metrics()['pending'] > 0:
+                    time.sleep(0.05)
+                drain = time.perf_counter() - start
+                done.set()
+
+                n_writes = sum( n for _, n in results )
+                n_rows = get_backend(location).query("select count(*) from sent2doc where username != 'setup';")[1][0][0]
+                same = all( m.content_df.equals(_make_manager(location, m.username).content_df) for m, _ in results )
+                if stop is not None:
+                    stop()
+
+            metrics = spool.metrics()
+            print(
+                f"{scenario:<6} {mode:<6}  writes {n_writes:4d}  in the store {n_rows:4d}  lost {n_writes - n_rows:4d}"
+                f"  retries {metrics['retries']:4d}  spooled {metrics['spooled']:4d}  max replay lag {max_lag:4.1f}s"
+                f"  drained {drain:4.1f}s after  store matches the UI: {same}"
+            )
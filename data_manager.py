@@ -1,68 +1,88 @@
-from typing import Iterable, Set, Tuple, List, Dict, Literal, Mapping, Union
+from typing import Iterable, Iterator, Set, Tuple, List, Dict, Literal, Mapping, Union, TYPE_CHECKING
 from pathlib import Path
 
 import streamlit as st
 
-import sqlite3
-import pandas as pd
 import io
+import os
 import zipfile
 import json
 import pickle
+import re
 from copy import deepcopy
+from collections import OrderedDict
+from weakref import WeakValueDictionary
+from dataclasses import dataclass
+from bisect import bisect_right, insort
 from hashlib import md5
+import concurrent.futures
 
 from task_resources import TaskConfig
+from storage_backend import StorageError, get_backend, get_write_spool
+from metrics import timed, register_gauges
+from doc_cache import DocumentCache, DocumentStore, freeze_doc
 
-import ir_datasets as irds
+# The document backends are heavy to import and a server typically uses only one of them, so they are 
+# imported where they are used, i.e., only once a task config selects that `doc_service`. Same for 
+# pandas, which is only needed once a task page builds its managers.
+if TYPE_CHECKING:
+    import pandas as pd
+    import datasets as hfds
 
-# try:
-import datasets as hfds
-# except ImportError as e:
-#     hfds = None
+def _statement_label(manager, query: str, *args, **kwargs):
+    # e.g., "insert sent2doc" -- the kind of statement and its table, not the query itself
+    table = re.search(r"\b(?:from|into|update|exists)\s+(\w+)", query, flags=re.IGNORECASE)
+    return f"{query.split(None, 1)[0].lower()} {table.group(1) if table else ''}".strip()
 
-from tqdm import tqdm
 
 class SqliteManager:
 
     def __init__(self, db_path: str, persistent_connection: bool = True):
+        # `db_path` is a sqlite file or the url of a networked store, see `storage_backend.py`
         self.db_path = str(db_path)
         self.persistent_connection = persistent_connection
 
-        self._conn = None
-    
-    @property
-    def conn(self):
-        if self.persistent_connection:
-            if self._conn is None:
-                self._conn = sqlite3.connect(self.db_path)
-            return self._conn
-        return sqlite3.connect(self.db_path)
+        self.backend = get_backend(self.db_path, persistent_connection)
 
     def table_exists(self, table_name: str):
-        return len(self.execute_simple(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';")) > 0
-
-    def execute_simple(self, query: str, args = None, query_only: bool = None, conn: sqlite3.Connection=None):
-        if conn is None:
-            conn = self.conn
-
+        records = self.execute_simple(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';")
+        # unknown if the read failed -- the callers create the table `if not exists` anyway
+        return records is not None and len(records) > 0
+
+    @staticmethod
+    def _read_failed():
+        st.error("Database error. Try again later.")
+        # nothing to show without the rows, the page ends here and the next rerun reads again;
+        # outside of a script run this returns and the caller gets None
+        st.stop()
+
+    @timed("sql", label=_statement_label)
+    def execute_simple(self, query: str, args = None, query_only: bool = None):
+        query = query.strip()
         if query_only is None:
             query_only = query.lower().startswith('select')
 
-        try:
-            query = query.strip()
-            if args:
-                cursor = conn.execute(query, args)
-            else:
-                cursor = conn.execute(query)
+        if query_only:
+            try:
+                # retried while the store is locked, like the writes
+                return get_write_spool().read(lambda : self.backend.query(query, args))[1]
+            except StorageError:
+                return self._read_failed()
 
-            if query_only:
-                return cursor.fetchall()
-            
-            conn.commit()
-        except sqlite3.OperationalError:
+        try:
+            # retried while the store is locked or unreachable, then kept in the spool until it is back
+            if get_write_spool().execute(self.backend, self.db_path, query, args):
+                st.toast("Saved locally, will be written to the database shortly.", icon=":material/sync:")
+        except StorageError:
             st.error("Database error. Try again later.")
 
+    def read_frame(self, query: str, args = None) -> "pd.DataFrame":
+        try:
+            return get_write_spool().read(lambda : self.backend.read_frame(query, args))
+        except StorageError:
+            self._read_failed()
+            raise
+
 
 class ActivityLogMananger(SqliteManager):
 
@@ -260,6 +280,28 @@ class NuggetSet:
         
         return new_nugget_set
 
+    def with_selections(self, doc_id: str, selections: Iterable[Tuple[str, str]]) -> 'NuggetSet':
+        # this set plus the (question, answer) pairs selected for `doc_id`, without copying the untouched
+        # questions -- the result shares them with this set, so neither should be modified afterwards
+        selected: Dict[str, List[str]] = {}
+        for question, answer in selections:
+            selected.setdefault(question.strip(), []).append(answer)
+
+        ret = self.__class__()
+        ret.group_assignment = self.group_assignment
+        ret.nugget_list = list(self.nugget_list)
+        for idx, (question, a_dict) in enumerate(ret.nugget_list):
+            if question in selected:
+                a_dict = dict(a_dict)
+                for answer in selected.pop(question):
+                    a_dict[answer] = a_dict.get(answer, set()) | {doc_id}
+                ret.nugget_list[idx] = (question, a_dict)
+
+        for question, answers in selected.items(): # not in this set
+            ret.nugget_list.append((question, { answer: {doc_id} for answer in answers }))
+        
+        return ret
+
     def doc_has_nugget(self, doc_id: str):
         for q, a_dict in self.nugget_list:
             for d in a_dict.values():
@@ -287,6 +329,7 @@ class NuggetSet:
         }, indent=indent)
 
     def as_dataframe(self):
+        import pandas as pd
         return pd.DataFrame({
             'Question': [ q for q, _ in self.nugget_list ],
             'Answers': [ "; ".join(sorted(a_dict.keys())) for _, a_dict in self.nugget_list ]
@@ -336,9 +379,93 @@ class NuggetSelection(set):
         return json.dumps(sorted(self))
 
     def as_dataframe(self):
+        import pandas as pd
         return pd.DataFrame(sorted(self), columns=['Question', 'Answer'])
 
 
+class PreloadNuggetStore(SqliteManager):
+    """
+    Nuggets shared by all annotators of a task, one row per (topic, kind) -- the ones prepared 
+    outside of the app (`preload`, see `scripts/ingest_preload.py`) and the `revised` ones. 
+    Topics are read on demand instead of parsing every `nuggets_*.{preload,revised}.json` file. 
+    """
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path, persistent_connection=False)
+
+        if not self.table_exists('preload_nuggets'):
+            self.execute_simple("""
+                create table if not exists preload_nuggets (
+                    topic_id string, kind string, nugget_json string, 
+                    ts datetime default current_timestamp, primary key (topic_id, kind)
+                );
+            """)
+
+    def get(self, topic_id: str, kind: Literal['preload', 'revised']) -> Union[str, None]:
+        records = self.execute_simple(
+            """select nugget_json from preload_nuggets where topic_id = ? and kind = ?;""", (topic_id, kind)
+        )
+        return records[0][0] if records else None
+
+    def put(self, topic_id: str, kind: Literal['preload', 'revised'], nugget_json: str):
+        self.execute_simple(
+            """insert or replace into preload_nuggets (topic_id, kind, nugget_json) values (?, ?, ?);""", 
+            (topic_id, kind, nugget_json)
+        )
+
+    def iter_all(self, kind: Literal['preload', 'revised']):
+        yield from self.execute_simple(
+            """select topic_id, nugget_json from preload_nuggets where kind = ? order by topic_id;""", (kind, )
+        ) or []
+
+    def count_nuggets(self, kind: Literal['preload', 'revised']) -> Dict[str, Union[int, None]]:
+        # questions per topic, counted by sqlite without loading the sets; None for the deprecated formats
+        return {
+            str(topic_id): n
+            for topic_id, n in self.execute_simple(
+                """select topic_id, json_array_length(nugget_json, '$.nugget_list') from preload_nuggets where kind = ?;""", (kind, )
+            ) or []
+        }
+
+    def ingest(self, records: Iterable[Tuple[str, str]], kind: Literal['preload', 'revised'], overwrite: bool=False) -> int:
+        # streams (topic_id, nugget_json) into the table in one transaction; returns the number of rows written
+        return self.backend.executemany(
+            f"""insert or {'replace' if overwrite else 'ignore'} into preload_nuggets (topic_id, kind, nugget_json) values (?, ?, ?);""",
+            ( (str(topic_id), kind, nugget_json) for topic_id, nugget_json in records )
+        )
+
+
+class CursorStore(SqliteManager):
+    """
+    Where each annotator left off, e.g., the current document of a topic, so that the pages 
+    resume there after logging in again. 
+    """
+
+    def __init__(self, db_path: str, username: str):
+        super().__init__(db_path, persistent_connection=False)
+        self.username = username
+
+        if not self.table_exists('cursors'):
+            self.execute_simple("""
+                create table if not exists cursors (
+                    username string, cursor_key string, position integer, 
+                    ts datetime default current_timestamp, primary key (username, cursor_key)
+                );
+            """)
+
+    def get(self, cursor_key: str, default: int=0) -> int:
+        records = self.execute_simple(
+            """select position from cursors where username = ? and cursor_key = ?;""", (self.username, cursor_key)
+        )
+        return records[0][0] if records else default
+
+    def put(self, cursor_key: str, position: int):
+        self.execute_simple(
+            """insert or replace into cursors (username, cursor_key, position) values (?, ?, ?);""", 
+            (self.username, cursor_key, position)
+        )
+
+
 class NuggetLoader(SqliteManager):
 
     def __init__(
@@ -355,29 +482,34 @@ class NuggetLoader(SqliteManager):
 
         super().__init__(db_path, persistent_connection=False)
         self.load_dir = Path(load_dir)
+        self.shared_nuggets = PreloadNuggetStore(db_path) if db_path is not None else None
 
         self.username = username
         self.use_json = use_json
         self.combine_nuggets_from_multiple_users = combine_nuggets_from_multiple_users
         self.use_revised_nugget_only = use_revised_nugget_only
     
-    def iter_nugget_sets_from_json(
+    def iter_nugget_json_from_json(
             self, topic_id: str, 
             use_revised_nugget_only: bool=None, combine_nuggets_from_multiple_users: bool=None
-        ):
+        ) -> Iterator[str]:
         use_revised_nugget_only = use_revised_nugget_only \
             if use_revised_nugget_only is not None else self.use_revised_nugget_only
         combine_nuggets_from_multiple_users = combine_nuggets_from_multiple_users \
             if combine_nuggets_from_multiple_users is not None else self.combine_nuggets_from_multiple_users
 
         if use_revised_nugget_only:
+            nugget_json = self.shared_nuggets.get(topic_id, 'revised') if self.shared_nuggets is not None else None
+            if nugget_json is not None:
+                yield nugget_json
+                return
             fns = self.load_dir.glob(f"nuggets_{topic_id}.revised.json")
         else:
             fns = self.load_dir.glob(f"nuggets_{topic_id}_{"*" if combine_nuggets_from_multiple_users else self.username}.json")
 
-        yield from map(lambda fn: NuggetSet.from_json(fn.read_text()), fns)
-        
-    def iter_nuggest_sets_from_db(self, topic_id: str, combine_nuggets_from_multiple_users: bool=None):
+        yield from map(lambda fn: fn.read_text(), fns)
+
+    def iter_nugget_json_from_db(self, topic_id: str, combine_nuggets_from_multiple_users: bool=None) -> Iterator[str]:
         combine_nuggets_from_multiple_users = combine_nuggets_from_multiple_users \
             if combine_nuggets_from_multiple_users is not None else self.combine_nuggets_from_multiple_users
         
@@ -391,38 +523,105 @@ class NuggetLoader(SqliteManager):
                 """select nugget_json from nuggets where topic_id = ?;""", (topic_id, )
             )
 
-        yield from map(NuggetSet.from_json, records)
-        
-    def get(self, topic_id: str, source: str=None) -> NuggetSet:
+        yield from ( nugget_json for nugget_json, in records or [] )
+
+    def iter_nugget_sets_from_json(
+            self, topic_id: str, 
+            use_revised_nugget_only: bool=None, combine_nuggets_from_multiple_users: bool=None
+        ):
+        yield from map(NuggetSet.from_json, self.iter_nugget_json_from_json(
+            topic_id, use_revised_nugget_only, combine_nuggets_from_multiple_users
+        ))
         
-        use_json = self.use_json
-        use_revised_nugget_only = None
+    def iter_nuggest_sets_from_db(self, topic_id: str, combine_nuggets_from_multiple_users: bool=None):
+        yield from map(NuggetSet.from_json, self.iter_nugget_json_from_db(topic_id, combine_nuggets_from_multiple_users))
+
+    def _nugget_json(self, topic_id: str, source: str=None) -> List[str]:
+        # the serialized nugget sets `get` combines
+        if source == 'preload':
+            nugget_json = self.shared_nuggets.get(topic_id, 'preload') if self.shared_nuggets is not None else None
+            if nugget_json is None:
+                nugget_json = (self.load_dir / f"nuggets_{topic_id}.preload.json").read_text()
+            return [nugget_json]
+
         if source == 'revised':
-            use_json = True
-            use_revised_nugget_only = True
-        elif source == 'db':
-            use_json = False
-            use_revised_nugget_only = None
-        elif source == 'preload':
-            return NuggetSet.from_json( (self.load_dir / f"nuggets_{topic_id}.preload.json").read_text() )
-
-        return sum(
-            (self.iter_nugget_sets_from_json if use_json else self.iter_nuggest_sets_from_db)(topic_id, use_revised_nugget_only=use_revised_nugget_only),
-            NuggetSet()
-        )
+            return list(self.iter_nugget_json_from_json(topic_id, use_revised_nugget_only=True))
+        if source == 'db' or not self.use_json:
+            return list(self.iter_nugget_json_from_db(topic_id))
+        return list(self.iter_nugget_json_from_json(topic_id))
+        
+    @timed("manager")
+    def get(self, topic_id: str, source: str=None) -> NuggetSet:
+        nugget_jsons = self._nugget_json(topic_id, source)
+        if source == 'preload':
+            return NuggetSet.from_json(nugget_jsons[0])
+
+        return sum(map(NuggetSet.from_json, nugget_jsons), NuggetSet())
+
+    def version(self, topic_id: str, source: str=None) -> str:
+        # changes whenever what `get` returns changes, without parsing the nuggets
+        return md5("\0".join(self._nugget_json(topic_id, source)).encode()).hexdigest()
+
+    def count_revised_nuggets(self, topic_ids: Iterable[str]) -> Dict[str, int]:
+        # len(self.get(topic_id, source='revised')) of each topic, with one query for the ones in the table
+        # and one directory listing for the rest -- only the topics with a json file left are parsed
+        counts = self.shared_nuggets.count_nuggets('revised') if self.shared_nuggets is not None else {}
+        with_files = { fn.name[len("nuggets_"):-len(".revised.json")] for fn in self.load_dir.glob("nuggets_*.revised.json") }
+        return {
+            topic_id: counts[topic_id] if counts.get(topic_id, None) is not None 
+                      else len(self.get(topic_id, source='revised')) if topic_id in counts or topic_id in with_files
+                      else 0
+            for topic_id in topic_ids
+        }
+
+    def count_db_nuggets(self, topic_ids: Iterable[str]) -> Dict[str, int]:
+        # len(self.get(topic_id, source='db')) of each topic; only topics with several rows (or a deprecated
+        # format) are parsed, the others are counted by sqlite
+        topic_ids = list(topic_ids)
+        user_filter, args = ("", ()) if self.combine_nuggets_from_multiple_users else (" where username = ?", (self.username, ))
+        rows = {
+            str(topic_id): (n_rows, n)
+            for topic_id, n_rows, n in self.execute_simple(
+                f"""select topic_id, count(*), max(json_array_length(nugget_json, '$.nugget_list')) from nuggets{user_filter} group by topic_id;""", 
+                args
+            ) or []
+        }
+        return {
+            topic_id: 0 if topic_id not in rows
+                      else rows[topic_id][1] if rows[topic_id][0] == 1 and rows[topic_id][1] is not None
+                      else len(self.get(topic_id, source='db'))
+            for topic_id in topic_ids
+        }
+
+    def count_nuggets(self, topic_ids: Iterable[str]) -> Dict[str, int]:
+        # len(self[topic_id]) of each topic, from where `get` would read them
+        if self.use_json:
+            return self.count_revised_nuggets(topic_ids) if self.use_revised_nugget_only \
+                   else { topic_id: len(self.get(topic_id)) for topic_id in topic_ids }
+        return self.count_db_nuggets(topic_ids)
 
     def __getitem__(self, topic_id: str):
         return self.get(topic_id, source=None)
 
 class NuggetSaverManager(SqliteManager):
 
-    def __init__(self, db_path: str, output_dir: str, log_manager: ActivityLogMananger, is_admin: bool=False):
+    def __init__(
+            self, db_path: str, output_dir: str, log_manager: ActivityLogMananger, 
+            is_admin: bool=False, max_cached_topics: int=64
+        ):
         super().__init__(db_path, persistent_connection=False)
         self.logger = log_manager
         self.username = self.logger.username
         self.output_dir = Path(output_dir)
+        self.is_admin = is_admin
 
-        self.topic_nuggets: Dict[str, NuggetSet] = {}
+        # (username, topic_id) -> NuggetSet, loaded when first asked for; least recently used ones are dropped,
+        # after saving the edits not flushed yet. A page may still hold a dropped set, so it is handed out
+        # again while it is alive, and edits on it can still be flushed.
+        self.max_cached_topics = max_cached_topics
+        self._topic_nuggets: OrderedDict[Tuple[str, str], NuggetSet] = OrderedDict()
+        self._evicted: WeakValueDictionary[Tuple[str, str], NuggetSet] = WeakValueDictionary()
+        self._saved_digest: Dict[Tuple[str, str], str] = {} # md5 of the json as loaded or last flushed
 
         if not self.table_exists('nuggets'):
             self.execute_simple("""
@@ -431,74 +630,138 @@ class NuggetSaverManager(SqliteManager):
                     nugget_json string, ts datetime default current_timestamp
                 );
             """)
-
-        if not is_admin:
-            existing_nugget_records = self.execute_simple("""select topic_id, nugget_json from nuggets where username = ?;""", (self.username, ))
-        else:
-            existing_nugget_records = self.execute_simple("""select topic_id, nugget_json from nuggets;""")
-        # print(existing_nugget_records)
-        for topic_id, nugget_json in existing_nugget_records:
-            self.topic_nuggets[str(topic_id)] = NuggetSet.from_json(nugget_json)
-
-        for fn in self.output_dir.glob("nuggets_*.revised.json"):
-            topic_id = fn.stem.replace(".revised", "").split("_", 2)[1]
-            if topic_id not in self.topic_nuggets:
-                self.topic_nuggets[topic_id] = NuggetSet.from_json(fn.read_text())
-
-        for fn in self.output_dir.glob("nuggets_*.preload.json"):
-            topic_id = fn.stem.replace(".preload", "").split("_", 2)[1]
-            if topic_id not in self.topic_nuggets:
-                self.topic_nuggets[topic_id] = NuggetSet.from_json(fn.read_text())
+        self.execute_simple("""create index if not exists nuggets_username_topic on nuggets (username, topic_id);""")
+
+        # revised and preload nuggets are only read when the topic is opened
+        self.shared_nuggets = PreloadNuggetStore(db_path)
+
+    def _load_shared(self, topic_id: str) -> Union[NuggetSet, None]:
+        # revised over preload; the table over the (older) json files
+        for kind in ['revised', 'preload']:
+            nugget_json = self.shared_nuggets.get(topic_id, kind)
+            if nugget_json is None and (self.output_dir / f"nuggets_{topic_id}.{kind}.json").exists():
+                nugget_json = (self.output_dir / f"nuggets_{topic_id}.{kind}.json").read_text()
+            if nugget_json is not None:
+                return NuggetSet.from_json(nugget_json)
+        return None
+
+    # `_load` and `flush` agree on the row of a user's topic: the last one, should there be several
+    _ROW_OF_TOPIC = "select rowid from nuggets where username = ? and topic_id = ? order by rowid desc limit 1"
+
+    def _load(self, username: str, topic_id: str) -> Union[NuggetSet, None]:
+        records = self.execute_simple(
+            f"""select nugget_json from nuggets where rowid = ({self._ROW_OF_TOPIC});""", (username, topic_id)
+        )
+        if records:
+            return NuggetSet.from_json(records[0][0])
+        return self._load_shared(topic_id)
+
+    @staticmethod
+    def _digest(nugget_set: NuggetSet):
+        return md5(nugget_set.as_json().encode()).hexdigest()
+
+    def _cache(self, key: Tuple[str, str], nugget_set: NuggetSet, saved: bool = True):
+        self._topic_nuggets[key] = nugget_set
+        if saved:
+            self._saved_digest[key] = self._digest(nugget_set)
+        while len(self._topic_nuggets) > self.max_cached_topics:
+            old_key, old_set = self._topic_nuggets.popitem(last=False)
+            if old_key[0] == self.username and self._saved_digest.get(old_key, None) != self._digest(old_set):
+                self._write(old_key[1], old_set)
+            self._evicted[old_key] = old_set
+        return nugget_set
+
+    def _lookup(self, key: Tuple[str, str]) -> Union[NuggetSet, None]:
+        if key in self._topic_nuggets:
+            self._topic_nuggets.move_to_end(key)
+            return self._topic_nuggets[key]
+        nugget_set = self._evicted.pop(key, None)
+        if nugget_set is not None:
+            # its digest was kept, edits made on it since it was dropped still count as unsaved
+            return self._cache(key, nugget_set, saved=False)
+        return None
+
+    @timed("manager")
+    def get(self, topic_id: str, username: str=None) -> NuggetSet:
+        # nuggets of another user are only for admins
+        username = username or self.username
+        assert username == self.username or self.is_admin
+
+        key = (username, str(topic_id))
+        nugget_set = self._lookup(key)
+        if nugget_set is not None:
+            return nugget_set
+        
+        return self._cache(key, self._load(username, str(topic_id)) or NuggetSet())
         
     def __getitem__(self, topic_id: str):
-        if topic_id not in self.topic_nuggets:
-            self.topic_nuggets[topic_id] = NuggetSet()
-
-        return self.topic_nuggets[topic_id]
+        return self.get(topic_id)
 
     def __contains__(self, topic_id: str):
-        return topic_id in self.topic_nuggets
-
-    def flush(self, topic_id: str):
-        assert topic_id in self 
-
+        key = (self.username, str(topic_id))
+        if self._lookup(key) is None:
+            nugget_set = self._load(*key)
+            if nugget_set is None:
+                return False
+            self._cache(key, nugget_set)
+        return True
+
+    def _write(self, topic_id: str, nugget_set: NuggetSet):
         sql_query, sql_args = f"""
             insert or replace into nuggets (rowid, username, topic_id, nugget_json) values (
-            (select rowid from nuggets where topic_id = "{topic_id}" and username = "{self.username}"), ?, ?, json(?));
-        """, (self.username, topic_id, self[topic_id].as_json())
+            ({self._ROW_OF_TOPIC}), ?, ?, json(?));
+        """, (self.username, topic_id, self.username, topic_id, nugget_set.as_json())
 
         self.logger.log(sql_query, sql_args)
         self.execute_simple(sql_query, sql_args)
+        self._saved_digest[(self.username, topic_id)] = self._digest(nugget_set)
         # also save a text version
         
         with (self.output_dir / f"nuggets_{topic_id}_{self.username}.json").open("w") as fw:
-            fw.write(self[topic_id].as_json(indent=4))
+            fw.write(nugget_set.as_json(indent=4))
+
+    @timed("manager")
+    def flush(self, topic_id: str):
+        topic_id = str(topic_id)
+        nugget_set = self._lookup((self.username, topic_id))
+        if nugget_set is None:
+            # never handed out, so there is nothing to save -- unless there is nothing at all
+            if self._load(self.username, topic_id) is None:
+                raise KeyError(f"No nuggets of {self.username} for topic {topic_id} to flush")
+            return
+        self._write(topic_id, nugget_set)
         
+    @timed("manager")
     def save_revised_nugget(self, topic_id: str, nugget_to_save: NuggetSet):
+        self.shared_nuggets.put(topic_id, 'revised', nugget_to_save.as_json())
         with (self.output_dir / f"nuggets_{topic_id}.revised.json").open("w") as fw:
             fw.write(nugget_to_save.as_json(indent=4))
 
     def to_tsv(self, all_data: bool=False):
-
-        return pd.read_sql_query(
-            f"select * from nuggets", self.conn
+        return self.read_frame(
+            f"select * from nuggets"
         ).astype(str).sort_values('ts', ascending=False).to_csv(index=False, sep="\t")
 
 
 
 def _flatten_dict(obj: Mapping[str, Mapping]):
     for key, val in obj.items():
-        if isinstance(val, list):
+        if isinstance(val, (list, tuple)):
             # val = { i: v for i, v in enumerate(val) }
             val = { v: "" for v in val }
 
-        if isinstance(val, dict):
+        if isinstance(val, Mapping):
             yield from ( ((key, *cum_key), v) for cum_key, v in _flatten_dict(val) )
         else: 
             yield (key, ), val
 
 def _multi_level_dict_to_series(obj: Mapping[str, Mapping], names= List[str]):
-    return pd.Series(dict(_flatten_dict(obj))).rename_axis(names)
+    import pandas as pd
+    flat = dict(_flatten_dict(obj))
+    if len(flat) == 0:
+        # e.g., a user without topics in this task
+        return pd.Series([], index=pd.MultiIndex.from_tuples([], names=names), dtype=object)
+    return pd.Series(flat).rename_axis(names)
 
 
 class AnnotationManager(SqliteManager):
@@ -511,6 +774,7 @@ class AnnotationManager(SqliteManager):
             level_names: Tuple[str], 
             slot_names: Union[Tuple[str], str]
         ):
+            import pandas as pd
             super().__init__(db_path, persistent_connection=False)
             self.logger = log_manager
             self.username = log_manager.username
@@ -536,16 +800,24 @@ class AnnotationManager(SqliteManager):
                     );
                 """)
 
-            record = pd.read_sql_query(
-                f"select * from {self.table_name} where username = ?", self.conn, params=(self.username, )
+            record = self.read_frame(
+                f"select * from {self.table_name} where username = ?", (self.username, )
             ).astype(str).sort_values('ts', ascending=False)\
             .groupby(self.content_df.index.names + ['slot_name']).first()\
             ['annotation'].unstack('slot_name')
         
+            # annotations of units not in `content_obj`, e.g., of topics the user is no longer assigned to
+            record = record[record.index.isin(self.content_df.index)]
             for slot in self.slot_names:
                 if slot in record.columns:
                     self.content_df.loc[record.index, slot] = record[slot]
 
+            # progress counters, built on first use and kept up to date by `annotate`
+            self._missing: Dict[Tuple, Set[str]] = None
+            self._progress: Dict[str, Tuple[Dict[str, int], Dict[str, Dict[str, int]]]] = {}
+            # (topic, level) -> (order of the units, unit -> position, sorted positions of the pending units)
+            self._queues: Dict[Tuple[str, str], Tuple[List[str], Dict[str, int], List[int]]] = {}
+
     
     @property
     def slot_names(self):
@@ -559,6 +831,7 @@ class AnnotationManager(SqliteManager):
         return keys in self.content_df.index
 
     def __getitem__(self, keys):
+        import pandas as pd
         if keys not in self:
             return iter([])
         
@@ -570,6 +843,7 @@ class AnnotationManager(SqliteManager):
             for key, val in sel.to_dict().items()
         }
 
+    @timed("manager")
     def is_all_done(self, *keys):
         if keys not in self:
             return True
@@ -580,6 +854,7 @@ class AnnotationManager(SqliteManager):
 
         return not d.loc[keys].isna().any().any().item()
 
+    @timed("manager")
     def count_done(self, *keys, level=None):
         if keys not in self:
             return 0
@@ -593,6 +868,7 @@ class AnnotationManager(SqliteManager):
     
         return d.groupby(level).apply(lambda x: ~x.isna().any().any()).sum().item()
 
+    @timed("manager")
     def count_job(self, *keys, level=None):
         if keys not in self:
             return 0
@@ -606,7 +882,103 @@ class AnnotationManager(SqliteManager):
         
         return d.loc[keys].index.get_level_values(level).unique().size
 
+    @staticmethod
+    def _is_missing(slot: str, value):
+        import pandas as pd
+        return pd.isna(value) or (slot == 'nugget' and value == "[]")
+
+    @property
+    def missing_slots(self) -> Dict[Tuple, Set[str]]:
+        # full key -> slots not annotated yet, only for the rows with any
+        if self._missing is None:
+            d = self.content_df.drop('content', axis=1)
+            missing = d.isna()
+            if 'nugget' in missing.columns:
+                missing['nugget'] |= (d['nugget'] == "[]")
+            missing = missing[missing.any(axis=1)]
+            self._missing = {
+                key: { slot for slot, is_missing in zip(missing.columns, row) if is_missing }
+                for key, row in zip(missing.index, missing.itertuples(index=False))
+            }
+        return self._missing
+
+    def _level_progress(self, level: str):
+        # (topic -> number of units at `level`, topic -> { unit: rows with missing slots })
+        if level not in self._progress:
+            import pandas as pd
+            pos = self.level_names.index(level)
+            index = self.content_df.index
+            n_units = pd.Series(index.get_level_values(pos)).groupby(index.get_level_values(0)).nunique()
+
+            pending: Dict[str, Dict[str, int]] = {}
+            for key in self.missing_slots:
+                units = pending.setdefault(key[0], {})
+                units[key[pos]] = units.get(key[pos], 0) + 1
+
+            self._progress[level] = ({ t: int(n) for t, n in n_units.items() }, pending)
+        return self._progress[level]
+
+    @timed("manager")
+    def progress(self, topic_id: str, level: str) -> Tuple[int, int, bool]:
+        # (count_done, count_job, is_all_done) of the topic at `level`, from the counters
+        n_units, pending = self._level_progress(level)
+        if topic_id not in n_units:
+            return 0, 0, True
+
+        n_pending = len(pending.get(topic_id, {}))
+        return n_units[topic_id] - n_pending, n_units[topic_id], n_pending == 0
+
+    @timed("manager")
+    def next_pending(self, topic_id: str, level: str, order: List[str], current: int) -> Union[int, None]:
+        # position in `order` of the first unit after `current`, wrapping around, that is not done; None if all are
+        queue = self._queues.get((topic_id, level), None)
+        if queue is None or queue[0] != order:
+            _, pending = self._level_progress(level)
+            position = { unit: i for i, unit in enumerate(order) }
+            queue = (list(order), position, sorted( position[u] for u in pending.get(topic_id, {}) if u in position ))
+            self._queues[(topic_id, level)] = queue
+
+        positions = queue[2]
+        if len(positions) == 0:
+            return None
+        i = bisect_right(positions, current)
+        return positions[i] if i < len(positions) else positions[0]
+
+    def _update_progress(self, key: Tuple, slot: str, annotation):
+        if self._missing is None:
+            return
+
+        slots = self._missing.pop(key, set())
+        was_pending = len(slots) > 0
+        if self._is_missing(slot, annotation):
+            slots.add(slot)
+        else:
+            slots.discard(slot)
+        if len(slots) > 0:
+            self._missing[key] = slots
+
+        is_pending = len(slots) > 0
+        if was_pending == is_pending:
+            return
+        for level, (_, pending) in self._progress.items():
+            unit = key[self.level_names.index(level)]
+            units = pending.setdefault(key[0], {})
+            units[unit] = units.get(unit, 0) + (1 if is_pending else -1)
+
+            # the unit itself switched between pending and done
+            queue = self._queues.get((key[0], level), None)
+            if queue is not None and unit in queue[1] and units[unit] == int(is_pending):
+                if is_pending:
+                    insort(queue[2], queue[1][unit])
+                else:
+                    queue[2].pop(bisect_right(queue[2], queue[1][unit]) - 1)
+
+            if units[unit] == 0:
+                del units[unit]
+
+    @timed("manager")
     def annotate(self, key: List[str], slot: str, annotation):
+        import pandas as pd
         assert slot in self.slot_names
 
         if isinstance(annotation, NuggetSelection):
@@ -617,6 +989,11 @@ class AnnotationManager(SqliteManager):
             # print(f"-- same value for {key}, skip update")
             return
 
+        if key in self:
+            self._update_progress(tuple(key), slot, annotation)
+        else:
+            # a new row, rebuild the counters on next use
+            self._missing, self._progress, self._queues = None, {}, {}
         self.content_df.loc[pd.MultiIndex.from_tuples([key]), slot] = annotation
 
         # save to db
@@ -633,8 +1010,8 @@ class AnnotationManager(SqliteManager):
         if not all_data:
             return self.content_df.to_csv(sep="\t")
         
-        return pd.read_sql_query(
-            f"select * from {self.table_name};", self.conn
+        return self.read_frame(
+            f"select * from {self.table_name};"
         ).astype(str).sort_values('ts', ascending=False).to_csv(index=False, sep="\t")
 
 
@@ -645,10 +1022,11 @@ def session_set_default(session_key, default=None):
     
     return st.session_state[session_key]
 
-def _hash_hfds(ds: hfds.arrow_dataset.Dataset):
+def _hash_hfds(ds: "hfds.arrow_dataset.Dataset"):
     return md5("".join(sorted([ f['filename'] for f in ds.cache_files ])).encode()).hexdigest()
 
-def _get_hfds_id_mapping(ds: hfds.arrow_dataset.Dataset) -> Dict[str, int]:
+def _get_hfds_id_mapping(ds: "hfds.arrow_dataset.Dataset") -> Dict[str, int]:
+    from tqdm import tqdm
     cache_fn = Path(ds.cache_files[0]['filename']).parent / f"{_hash_hfds(ds)}.doc_id_mapping.pkl"
     if cache_fn.exists():
         with cache_fn.open('rb') as f:
@@ -664,55 +1042,196 @@ def _get_hfds_id_mapping(ds: hfds.arrow_dataset.Dataset) -> Dict[str, int]:
 
 @st.cache_resource
 def _get_hfds_ds(ds_id, revision=None, split=None):
+    import datasets as hfds
     ds = hfds.load_dataset(ds_id, revision=revision, split=split)
     return ds, _get_hfds_id_mapping(ds)
     
     
 
-@st.cache_data(ttl=600)
+@st.cache_resource
+def _get_http_doc_client():
+    # one keep-alive pool per process, shared by all sessions
+    from http_doc_client import HttpDocClient
+    return HttpDocClient()
+
+def _iter_hfds(collection_id: str):
+    # <user>/<project>#<branch>:<subset>+...
+    for ds_id in collection_id.split('+'):
+        ds_id, subset = ds_id.split(":")
+        ds_id, revision = ds_id.split('#')
+        yield _get_hfds_ds(ds_id, revision=revision, split=subset)
+
+def _read_hfds_rows(ds: "hfds.arrow_dataset.Dataset", indices: List[int]) -> List[Dict[str, str]]:
+    import pyarrow as pa
+    # Read only the title/text columns straight from the (memory-mapped) arrow table 
+    # instead of going through `ds[idx]`, which formats the entire row into a dict. 
+    table = ds.data.table
+    if ds._indices is not None:
+        indices = ds._indices.column(0).take(indices).to_pylist()
+
+    table = table.select([ col for col in ('title', 'text') if col in table.column_names ])
+    if len(indices) == 1:
+        rows = table.slice(indices[0], 1) # zero-copy
+    else:
+        # `take` has a large per-call cost on chunked tables; gathering slices is much cheaper
+        rows = pa.concat_tables([ table.slice(idx, 1) for idx in indices ])
+
+    texts = rows.column('text').to_pylist()
+    titles = rows.column('title').to_pylist() if 'title' in rows.column_names else [""]*len(texts)
+    return [
+        {'title': title or "", 'text': text}
+        for title, text in zip(titles, texts)
+    ]
+
+
+@st.cache_resource
+def get_doc_cache():
+    # shared by all sessions of the process; size it with RAG_DOC_CACHE_MB
+    cache = DocumentCache(max_bytes=int(float(os.environ.get('RAG_DOC_CACHE_MB', 512)) * 2**20))
+    register_gauges("doc_cache", cache.stats)
+    return cache
+
+
+@st.cache_resource
+def get_doc_store():
+    # optional persistent store in front of the backends, filled by `scripts/prewarm_documents.py`
+    if os.environ.get('RAG_DOC_STORE_PATH', None) is None:
+        return None
+    return DocumentStore(os.environ['RAG_DOC_STORE_PATH'])
+
+
+class DocumentUnavailable(RuntimeError):
+    """The document backend failed or did not answer in time, e.g., the document API is down."""
+
+
+def _unavailable_doc(service: str, collection_id: str, doc_id: str, error: Exception):
+    st.error(f"Document {doc_id} is unavailable right now, try again later. ({error})")
+    return freeze_doc({'title': "", 'text': f"Unavailable: {service} {collection_id} // {doc_id}"})
+
+
+@timed("doc")
 def get_doc_content(service: str, collection_id: str, doc_id: str):
-    if service == 'ir_datasets':
-        doc = irds.load(collection_id).docs.lookup(doc_id)
-        return {
-            'title': doc.title if hasattr(doc, 'title') else "",
-            'text': doc.default_text()
-        }
+    # returns a read-only mapping that is shared with other sessions -- do not modify
+    try:
+        doc = get_doc_cache().get_or_load(
+            (service, collection_id, doc_id), 
+            lambda : _freeze_found(_load_doc_contents(service, collection_id, [doc_id]).get(doc_id, None))
+        )
+        # a document the backend did not return is not cached, a later (complete) response may have it
+        return doc if doc is not None else _missing_doc(service, collection_id, doc_id)
+    except DocumentUnavailable as e:
+        # not cached, so it is fetched again once the backend is back
+        return _unavailable_doc(service, collection_id, doc_id, e)
+
+
+@timed("doc")
+def get_doc_contents(service: str, collection_id: str, doc_ids: Iterable[str]):
+    # batch version of `get_doc_content`; only documents not in the cache go to the backend
+    cache = get_doc_cache()
+    ret = { doc_id: cache.get((service, collection_id, doc_id)) for doc_id in doc_ids }
+
+    missing = [ doc_id for doc_id, doc in ret.items() if doc is None ]
+    if len(missing) > 0:
+        try:
+            loaded = _load_doc_contents(service, collection_id, missing)
+        except DocumentUnavailable as e:
+            return { **ret, **{ doc_id: _unavailable_doc(service, collection_id, doc_id, e) for doc_id in missing } }
+        for doc_id in missing:
+            if loaded.get(doc_id, None):
+                ret[doc_id] = cache.put((service, collection_id, doc_id), freeze_doc(loaded[doc_id]))
+            else:
+                ret[doc_id] = _missing_doc(service, collection_id, doc_id)
     
-    elif service == 'hf_datasets' and hfds is not None:
-        # <user>/<project>#<branch>:<subset>+...
-        for ds_id in collection_id.split('+'):
-            ds_id, subset = ds_id.split(":")
-            ds_id, revision = ds_id.split('#')
-            ds, mapping = _get_hfds_ds(ds_id, revision=revision, split=subset)
-            idx = mapping.get(doc_id, None)
-            if idx is not None:
-                return {
-                    'title': ds[idx]['title'] if 'title' in ds[idx] else "",
-                    'text': ds[idx]['text']
-                }
-
-    return {'title': "", "text": f"Suppose to be {service} {collection_id} // {doc_id}"}
+    return ret
+
+
+def _freeze_found(doc: Union[Mapping[str, str], None]):
+    return freeze_doc(doc) if doc else None
+
+def _missing_doc(service: str, collection_id: str, doc_id: str):
+    return freeze_doc({'title': "", "text": f"Suppose to be {service} {collection_id} // {doc_id}"})
+
+
+def _load_doc_contents(service: str, collection_id: str, doc_ids: List[str]) -> Dict[str, Dict[str, str]]:
+    # persistent store first, then the backend; whatever the backend returns is written through
+    store = get_doc_store()
+    ret = store.get_many(service, collection_id, doc_ids) if store is not None else {}
+
+    missing = [ doc_id for doc_id in doc_ids if doc_id not in ret ]
+    if len(missing) > 0:
+        fetched = _fetch_doc_contents(service, collection_id, missing)
+        if store is not None and len(fetched) > 0:
+            store.put_many(service, collection_id, fetched)
+        ret.update(fetched)
+
+    return ret
+
+
+@timed("doc")
+def _fetch_doc_contents(service: str, collection_id: str, doc_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    # only returns the documents found in the backend
+    doc_ids = list(doc_ids)
+    ret = {}
+
+    if service == 'ir_datasets':
+        import ir_datasets as irds
+        for doc_id, doc in irds.load(collection_id).docs.lookup(doc_ids).items():
+            ret[doc_id] = {
+                'title': doc.title if hasattr(doc, 'title') else "",
+                'text': doc.default_text()
+            }
+
+    elif service == 'hf_datasets':
+        for ds, mapping in _iter_hfds(collection_id):
+            found = [ (doc_id, mapping[doc_id]) for doc_id in doc_ids if doc_id not in ret and doc_id in mapping ]
+            if len(found) > 0:
+                rows = _read_hfds_rows(ds, [ idx for _, idx in found ])
+                ret.update(zip([ doc_id for doc_id, _ in found ], rows))
+            if len(ret) == len(doc_ids):
+                break
+
+    elif service == 'http_api':
+        # collection_id is the url of the collection endpoint
+        from http_doc_client import DocServiceError
+        try:
+            docs = _get_http_doc_client().lookup_many(collection_id, doc_ids)
+        except (DocServiceError, concurrent.futures.TimeoutError) as e:
+            raise DocumentUnavailable(f"{collection_id}: {e!r}") from e
+        for doc_id, doc in docs.items():
+            ret[doc_id] = {'title': doc.get('title', None) or "", 'text': doc['text']}
+
+    return ret
+
+
+def _user_resource(resource: Mapping[str, Mapping], task_config: TaskConfig, username: str) -> Dict[str, Mapping]:
+    # only the topics assigned to the user -- a compiled resource (.db) reads those and not the whole file
+    return { topic_id: resource[topic_id] for topic_id in task_config.job_assignment.get(username, []) if topic_id in resource }
 
 
 def get_manager(task_config: TaskConfig, username: str, manager_name: str, is_admin=False) -> AnnotationManager:
     output_dir = Path(task_config.output_dir)
 
-    logger = session_set_default(f'{task_config.name}/logger', lambda : ActivityLogMananger(output_dir / "log.db", username))
+    logger = session_set_default(f'{task_config.name}/logger', lambda : ActivityLogMananger(task_config.db_location("log.db"), username))
 
     if manager_name == "nugget_manager":
         return session_set_default(
             f'{task_config.name}/nugget_manager', 
-            lambda : NuggetSaverManager(output_dir / "annotation.db", output_dir, logger, is_admin=is_admin)
+            lambda : NuggetSaverManager(task_config.db_location("annotation.db"), output_dir, logger, is_admin=is_admin)
+        )
+
+    if manager_name == "cursor_store":
+        return session_set_default(
+            f'{task_config.name}/cursor_store', lambda : CursorStore(task_config.db_location("annotation.db"), username)
         )
 
     if manager_name == "relevance_assessment_manager":
         return session_set_default(
             f'{task_config.name}/{manager_name}', 
             lambda : AnnotationManager(
-                output_dir / "annotation.db", # could be different
+                task_config.db_location("annotation.db"), # could be different
                 output_dir, logger,
                 table_name="doc_binary_rel", 
-                content_obj=task_config.pooled_docs, 
+                content_obj=_user_resource(task_config.pooled_docs, task_config, username), 
                 slot_names='no_nugget_found',
                 level_names=['topic_id', 'doc_id']
             )
@@ -722,10 +1241,10 @@ def get_manager(task_config: TaskConfig, username: str, manager_name: str, is_ad
         return session_set_default(
             f'{task_config.name}/{manager_name}', 
             lambda : AnnotationManager(
-                output_dir / "annotation.db", # could be different
+                task_config.db_location("annotation.db"), # could be different
                 output_dir, logger,
                 table_name="sent2doc", 
-                content_obj=task_config.cited_sentences, 
+                content_obj=_user_resource(task_config.cited_sentences, task_config, username), 
                 slot_names='annot',
                 level_names=['topic_id', 'doc_id', 'run_id', 'sent_id']
             )
@@ -735,10 +1254,10 @@ def get_manager(task_config: TaskConfig, username: str, manager_name: str, is_ad
         return session_set_default(
             f'{task_config.name}/{manager_name}', 
             lambda : AnnotationManager(
-                output_dir / "annotation.db", # could be different
+                task_config.db_location("annotation.db"), # could be different
                 output_dir, logger,
                 table_name="sent2nugget", 
-                content_obj=task_config.report_runs, 
+                content_obj=_user_resource(task_config.report_runs, task_config, username), 
                 slot_names=('nugget', ),
                 level_names=['topic_id', 'run_id', 'sent_id']
             )
@@ -746,6 +1265,56 @@ def get_manager(task_config: TaskConfig, username: str, manager_name: str, is_ad
 
     return st.session_state[f"{task_config.name}/{manager_name}"]
 
+@dataclass(frozen=True)
+class TopicProgress:
+    n_done: int
+    n_job: int
+    is_done: bool
+    available: bool = True
+
+
+@timed("manager")
+def get_progress_snapshot(task_config: TaskConfig, username: str) -> Dict[str, Dict[str, TopicProgress]]:
+    """
+    Everything the task dashboard shows for the user, as stage -> topic_id -> progress. 
+    Read from the counters of the annotation managers, so no topic is scanned again.
+    """
+    user_topics = task_config.job_assignment.get(username, [])
+
+    relevance_assessment_manager = get_manager(task_config, username, 'relevance_assessment_manager')
+    citation_assessment_manager = get_manager(task_config, username, 'citation_assessment_manager')
+    nugget_alignment_manager = get_manager(task_config, username, 'nugget_alignment_manager')
+
+    relevance = { t: relevance_assessment_manager.progress(t, 'doc_id') for t in user_topics }
+    citation = { t: citation_assessment_manager.progress(t, 'doc_id') for t in user_topics }
+
+    if task_config.use_revised_nugget_only:
+        # from the source of the alignment page: the revised nuggets, or the nuggets in the db when the task loads from there
+        n_nuggets = get_nugget_loader(task_config, username, use_revised_nugget=True).count_nuggets(
+            [ t for t in user_topics if t in task_config.report_runs ]
+        )
+
+    snapshot = {'nugget_creation': {}, 'citation_assessment': {}, 'nugget_alignment': {}}
+    for topic_id in user_topics:
+        if topic_id in task_config.pooled_docs:
+            snapshot['nugget_creation'][topic_id] = TopicProgress(*relevance[topic_id])
+
+        if len(task_config.cited_sentences) > 0:
+            n_done, n_job, is_done = citation[topic_id]
+            snapshot['citation_assessment'][topic_id] = TopicProgress(min(n_done, relevance[topic_id][0]), n_job, is_done)
+
+        if topic_id in task_config.report_runs:
+            available = not task_config.force_citation_asssessment_before_report or citation[topic_id][2]
+            if task_config.use_revised_nugget_only:
+                available = available and n_nuggets[topic_id] > 0
+            snapshot['nugget_alignment'][topic_id] = TopicProgress(
+                *nugget_alignment_manager.progress(topic_id, 'run_id'), available=available
+            )
+
+    return snapshot
+
+
+@timed("manager")
 def export_data(
         task_config: TaskConfig, username: str, manager_names: List[str],
         with_revised_nuggets: bool=True, with_annotator_nuggets: bool=False
@@ -761,8 +1330,13 @@ def export_data(
             fw.writestr(f"{name}.tsv", manager.to_tsv(all_data=True))
 
         if with_revised_nuggets:
+            exported = set()
+            for topic_id, nugget_json in PreloadNuggetStore(task_config.db_location("annotation.db")).iter_all('revised'):
+                exported.add(f"nuggets_{topic_id}.revised.json")
+                fw.writestr(f"nuggets_{topic_id}.revised.json", NuggetSet.from_json(nugget_json).as_json(indent=4))
             for fn in Path(task_config.output_dir).glob("nuggets_*.revised.json"):
-                fw.writestr(fn.name, fn.read_text())
+                if fn.name not in exported:
+                    fw.writestr(fn.name, fn.read_text())
         
         if with_annotator_nuggets:
             for fn in Path(task_config.output_dir).glob("nuggets_*_*.json"):
@@ -782,7 +1356,7 @@ def get_nugget_loader(
     
     output_dir = Path(task_config.output_dir)
     return NuggetLoader(
-        username=username, db_path=output_dir / "annotation.db",
+        username=username, db_path=task_config.db_location("annotation.db"),
         load_dir=output_dir,
         use_json=(task_config.load_nugget_from == 'json'),
         combine_nuggets_from_multiple_users=from_all_users,
@@ -0,0 +1,226 @@
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Mapping, Set
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from types import MappingProxyType
+import threading
+import sqlite3
+import sys
+
+_ENTRY_OVERHEAD = 200 # key tuple, ordered dict node, mapping proxy, ...
+_SQLITE_MAX_VARS = 900
+
+
+def freeze_doc(doc: Mapping[str, str]) -> Mapping[str, str]:
+    # read-only view so the cached object can be handed out without copying
+    return doc if isinstance(doc, MappingProxyType) else MappingProxyType(dict(doc))
+
+def sizeof_doc(doc: Mapping[str, str]) -> int:
+    return _ENTRY_OVERHEAD + sys.getsizeof(doc) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in doc.items())
+
+
+class DocumentCache:
+    """
+    Segmented LRU cache bounded by an approximate byte budget.
+
+    New entries land in the probation segment and are promoted to the protected segment
+    (at most `protected_ratio` of the budget) on their second hit, so a burst of one-off
+    lookups cannot flush documents that several annotators of a topic keep coming back to.
+    Values are stored and returned as-is; callers should only put immutable objects.
+    """
+
+    def __init__(self, max_bytes: int, protected_ratio: float = 0.8, sizeof: Callable[[Any], int] = sizeof_doc):
+        self.max_bytes = max_bytes
+        self.max_protected_bytes = int(max_bytes * protected_ratio)
+        self.sizeof = sizeof
+
+        self._lock = threading.Lock()
+        self._probation: OrderedDict[Hashable, Any] = OrderedDict()
+        self._protected: OrderedDict[Hashable, Any] = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self._inflight: Dict[Hashable, Future] = {}
+
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'rejected': 0}
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, key: Hashable):
+        return key in self._sizes
+
+    @property
+    def nbytes(self):
+        return self._probation_bytes + self._protected_bytes
+
+    def _get_locked(self, key: Hashable):
+        if key in self._protected:
+            self._protected.move_to_end(key)
+            return self._protected[key]
+
+        if key in self._probation:
+            # second hit -- promote
+            value = self._probation.pop(key)
+            self._probation_bytes -= self._sizes[key]
+            self._protected[key] = value
+            self._protected_bytes += self._sizes[key]
+
+            while self._protected_bytes > self.max_protected_bytes and len(self._protected) > 1:
+                demoted, demoted_value = self._protected.popitem(last=False)
+                self._protected_bytes -= self._sizes[demoted]
+                self._probation[demoted] = demoted_value
+                self._probation_bytes += self._sizes[demoted]
+            return value
+
+        return None
+
+    def _evict_locked(self):
+        while self.nbytes > self.max_bytes:
+            segment = self._probation if len(self._probation) > 0 else self._protected
+            key, _ = segment.popitem(last=False)
+            size = self._sizes.pop(key)
+            if segment is self._probation:
+                self._probation_bytes -= size
+            else:
+                self._protected_bytes -= size
+            self._counters['evictions'] += 1
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            value = self._get_locked(key)
+            if value is None:
+                self._counters['misses'] += 1
+                return default
+            self._counters['hits'] += 1
+            return value
+
+    def put(self, key: Hashable, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._sizes:
+                return value
+            if size > self.max_bytes:
+                self._counters['rejected'] += 1
+                return value
+
+            self._probation[key] = value
+            self._sizes[key] = size
+            self._probation_bytes += size
+            self._evict_locked()
+        return value
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]):
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self._counters['hits'] += 1
+                return value
+
+            future = self._inflight.get(key, None)
+            if future is None:
+                self._counters['misses'] += 1
+                future = self._inflight[key] = Future()
+                is_loader = True
+            else:
+                # someone else is already fetching this document
+                self._counters['coalesced'] += 1
+                is_loader = False
+
+        if not is_loader:
+            return future.result()
+
+        try:
+            # None (nothing found) is handed to the waiting callers but not cached, so it is loaded again next time
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def clear(self):
+        with self._lock:
+            self._probation.clear()
+            self._protected.clear()
+            self._sizes.clear()
+            self._probation_bytes = self._protected_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **self._counters,
+                'items': len(self._sizes),
+                'bytes': self.nbytes,
+                'protected_bytes': self._protected_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+class DocumentStore:
+    """
+    Persistent document store (a sqlite file) that sits between the in-memory cache
+    and the document backends. It is shared by all processes on the host.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        with self._connect() as conn:
+            conn.execute("pragma journal_mode=wal;")
+            conn.execute("""
+                create table if not exists docs (
+                    service string, collection_id string, doc_id string,
+                    title string, text string,
+                    primary key (service, collection_id, doc_id)
+                );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn: # commits
+                yield conn
+        finally:
+            conn.close()
+
+    def _select(self, query: str, service: str, collection_id: str, doc_ids: List[str]):
+        ret = []
+        with self._connect() as conn:
+            for i in range(0, len(doc_ids), _SQLITE_MAX_VARS):
+                chunk = doc_ids[i: i+_SQLITE_MAX_VARS]
+                ret += conn.execute(
+                    query.format(placeholders=", ".join(["?"]*len(chunk))), 
+                    (service, collection_id, *chunk)
+                ).fetchall()
+        return ret
+
+    def get_many(self, service: str, collection_id: str, doc_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        return {
+            doc_id: {'title': title, 'text': text}
+            for doc_id, title, text in self._select(
+                "select doc_id, title, text from docs where service = ? and collection_id = ? and doc_id in ({placeholders});",
+                service, collection_id, list(doc_ids)
+            )
+        }
+
+    def existing_ids(self, service: str, collection_id: str, doc_ids: Iterable[str]) -> Set[str]:
+        return {
+            doc_id
+            for doc_id, in self._select(
+                "select doc_id from docs where service = ? and collection_id = ? and doc_id in ({placeholders});",
+                service, collection_id, list(doc_ids)
+            )
+        }
+
+    def put_many(self, service: str, collection_id: str, docs: Mapping[str, Mapping[str, str]]):
+        with self._connect() as conn:
+            conn.executemany(
+                "insert or replace into docs (service, collection_id, doc_id, title, text) values (?, ?, ?, ?, ?);",
+                [ (service, collection_id, doc_id, doc['title'], doc['text']) for doc_id, doc in docs.items() ]
+            )
@@ -0,0 +1,79 @@
+from typing import Mapping, Tuple
+import html
+import re
+
+import streamlit as st
+
+from data_manager import session_set_default
+
+_MAX_PARAGRAPH_CHARS = 2000
+_HARD_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"[^.!?。！？]*(?:[.!?。！？]+\s*|$)") # keeps the trailing punctuation and spaces
+
+
+def _split_long(paragraph: str):
+    # break run-on paragraphs at sentence ends, so each rendered window stays small
+    if len(paragraph) <= _MAX_PARAGRAPH_CHARS:
+        yield paragraph
+        return
+
+    buffer = ""
+    for sent in _SENTENCE.findall(paragraph):
+        if len(buffer) + len(sent) > _MAX_PARAGRAPH_CHARS and buffer != "":
+            yield buffer
+            buffer = ""
+        buffer += sent
+        while len(buffer) > _MAX_PARAGRAPH_CHARS: # no sentence boundary at all
+            yield buffer[:_MAX_PARAGRAPH_CHARS]
+            buffer = buffer[_MAX_PARAGRAPH_CHARS:]
+    if buffer.strip() != "":
+        yield buffer
+
+
+def segment_text(text: str) -> Tuple[str, ...]:
+    pieces = _HARD_BREAK.split(text)
+    if len(pieces) == 1:
+        pieces = text.split("\n")
+
+    return tuple(
+        chunk
+        for piece in pieces if piece.strip() != ""
+        for chunk in _split_long(piece.strip())
+    )
+
+
+@st.cache_resource(max_entries=2048)
+def _get_segments(service: str, collection_id: str, doc_id: str, _text: str) -> Tuple[str, ...]:
+    # shared across sessions; the text itself is not hashed
+    return segment_text(_text)
+
+
+def render_paragraphs(paragraphs: Tuple[str, ...]):
+    # escaped html rather than markdown -- documents are not markdown and the parser is slow on long texts
+    return "".join(f'<p class="doc_paragraph">{html.escape(p)}</p>' for p in paragraphs)
+
+
+def draw_document(
+        doc_content: Mapping[str, str], doc_id: str,
+        service: str, collection_id: str, key: str,
+        page_size: int = 20
+    ):
+    paragraphs = _get_segments(service, collection_id, doc_id, doc_content['text'])
+    shown_key = f"{key}/{doc_id}/n_shown"
+    n_shown = session_set_default(shown_key, page_size)
+
+    if doc_content['title'] != "":
+        st.html(f'<p class="doc_title"><b>{html.escape(doc_content["title"])}</b></p>')
+    st.caption(f"Doc ID: {doc_id}")
+    st.html(render_paragraphs(paragraphs[:n_shown]))
+
+    def _load_more():
+        st.session_state[shown_key] += page_size
+
+    if n_shown < len(paragraphs):
+        st.button(
+            f"Load more ({len(paragraphs) - n_shown} paragraphs left)",
+            icon=":material/expand_more:",
+            key=f"{shown_key}/load_more",
+            on_click=_load_more
+        )
@@ -1,16 +1,15 @@
 from argparse import ArgumentParser
 from pathlib import Path
 from datetime import datetime
-from typing import Dict
-import pandas as pd
 
 from itertools import cycle
 
 import streamlit as st
 from page_utils import random_key, draw_pages, stpage, goto_page, get_auth_manager, AuthManager
 
-from task_resources import TaskConfig
-from data_manager import AnnotationManager, get_manager, get_nugget_loader, session_set_default, export_data
+from task_resources import TaskConfig, get_task_registry
+from data_manager import get_progress_snapshot, session_set_default, export_data
+import metrics
 
 
 _style_modifier = """
@@ -47,6 +46,11 @@ button[kind="pills"] {
     text-align: left;
 }
 
+.doc_paragraph {
+    white-space: pre-wrap;
+    margin-bottom: 0.8rem;
+}
+
 [data-testid="stElementContainer"]:has(hr.nugget_set_divider) {
     margin-top: -35px; 
     margin-bottom: -35px;
@@ -76,6 +80,7 @@ def init_app(args):
     )
 
     st.html(_style_modifier)
+    metrics.start_exporter()
 
     return get_auth_manager(args.user_db_path)
 
@@ -126,6 +131,7 @@ def change_password_modal(auth_manager: AuthManager, logout_fn):
 
 @stpage(name="manage_users", require_login=True, require_admin=True)
 def manage_users_page(auth_manager: AuthManager):
+    import pandas as pd
 
     # weird hack
     session_set_default('new_user_df_uuid', random_key)
@@ -215,6 +221,36 @@ def manage_users_page(auth_manager: AuthManager):
     if delete_selection is not None:
         _delete_user(delete_selection.replace(":material/bolt: ", ""))
 
+@stpage(name="metrics", require_login=True, require_admin=True)
+def metrics_page(auth_manager: AuthManager):
+    import pandas as pd
+
+    st.write("## Metrics")
+    if not metrics.ENABLED:
+        st.info("Timing is off. Start the app with `RAG_METRICS=1` to record it.")
+        return
+    
+    st.caption("Of this process since it started. Percentiles are the upper bounds of the histogram buckets.")
+    st.dataframe(
+        pd.DataFrame([
+            {
+                'kind': kind, 'name': name, 'calls': h.n, 
+                'mean (ms)': h.total / h.n * 1000, 'p50 (ms)': h.quantile(0.5) * 1000,
+                'p95 (ms)': h.quantile(0.95) * 1000, 'p99 (ms)': h.quantile(0.99) * 1000, 
+                'total (s)': h.total
+            }
+            for (kind, name), h in metrics.snapshot().items()
+        ], columns=['kind', 'name', 'calls', 'mean (ms)', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'total (s)']).sort_values('total (s)', ascending=False),
+        hide_index=True, use_container_width=True
+    )
+
+    for prefix, values in metrics.read_gauges().items():
+        st.write(f"**{prefix.replace('_', ' ').title()}**")
+        st.dataframe(pd.DataFrame([values]), hide_index=True, use_container_width=True)
+
+    st.download_button("Prometheus text", metrics.render_prometheus(), file_name="metrics.prom", icon=":material/download:")
+
+
 @st.dialog(title="Download")
 def export_modal(task_config: TaskConfig, username: str):
     # making this a modal to prevent creating the zip file everytime 
@@ -254,21 +290,16 @@ def task_dashboard(auth_manager: AuthManager):
         if auth_manager.is_admin and button_col.button("Export Data", use_container_width=True):
             export_modal(task_config, auth_manager.current_user)
 
+        # all the numbers below, from the counters of the annotation managers
+        progress = get_progress_snapshot(task_config, auth_manager.current_user)
+
         st.write("### Step 1: Nugget Creation")
 
         # TODO change the ordering
-        relevance_assess_topics = [ t for t in user_topics if t in task_config.pooled_docs.keys() ]
-        # sorted(filter(lambda x: x in user_topics, task_config.pooled_docs.keys()))
-        relevance_assessment_manager: AnnotationManager = get_manager(task_config, auth_manager.current_user, 'relevance_assessment_manager')
-        for topic_id, col in zip(relevance_assess_topics, cycle(st.columns(6))):
-
-            n_done = relevance_assessment_manager.count_done(topic_id, level='doc_id')
-            # n_job = len(task_config.cited_sentences[topic_id])
-            n_job = relevance_assessment_manager.count_job(topic_id, level='doc_id')
-            icon = ':material/check_box_outline_blank:' if not relevance_assessment_manager.is_all_done(topic_id) else ':material/select_check_box:'
+        for (topic_id, p), col in zip(progress['nugget_creation'].items(), cycle(st.columns(6))):
             col.button(
-                f"Topic {topic_id} ({n_done}/{n_job})", 
-                icon=icon,
+                f"Topic {topic_id} ({p.n_done}/{p.n_job})", 
+                icon=':material/check_box_outline_blank:' if not p.is_done else ':material/select_check_box:',
                 use_container_width=True, 
                 key=f'{task_config.name}/entry/creation/{topic_id}',
                 args=("nugget_creation", ), 
@@ -293,21 +324,10 @@ def task_dashboard(auth_manager: AuthManager):
 
         st.write("### Step 3: Report Sentence and Nugget Support Assessment")
 
-        citation_assess_topics = [ t for t in user_topics if task_config.cited_sentences.keys() ]
-        # sorted(filter(lambda x: x in user_topics, task_config.cited_sentences.keys()))
-        citation_assessment_manager: AnnotationManager = get_manager(task_config, auth_manager.current_user, 'citation_assessment_manager')
-        for topic_id, col in zip(citation_assess_topics, cycle(st.columns(6))):
-
-            n_done = min(
-                citation_assessment_manager.count_done(topic_id, level='doc_id'), 
-                relevance_assessment_manager.count_done(topic_id, level='doc_id')
-            )
-            # n_job = len(task_config.cited_sentences[topic_id])
-            n_job = citation_assessment_manager.count_job(topic_id, level='doc_id')
-            icon = ':material/check_box_outline_blank:' if not citation_assessment_manager.is_all_done(topic_id) else ':material/select_check_box:'
+        for (topic_id, p), col in zip(progress['citation_assessment'].items(), cycle(st.columns(6))):
             col.button(
-                f"Topic {topic_id} ({n_done}/{n_job})", 
-                icon=icon,
+                f"Topic {topic_id} ({p.n_done}/{p.n_job})", 
+                icon=':material/check_box_outline_blank:' if not p.is_done else ':material/select_check_box:',
                 use_container_width=True, 
                 key=f'{task_config.name}/entry/supportive/{topic_id}',
                 args=("citation_assessment", ), 
@@ -319,27 +339,13 @@ def task_dashboard(auth_manager: AuthManager):
         st.write("### Step 4: Nugget Alignment")
         if task_config.force_citation_asssessment_before_report:
             st.caption("Can only start assessing report sentences for nugget alignment after report sentnece supportive assessments are finished.")
-        nugget_alignment_topics = [ t for t in user_topics if t in task_config.report_runs.keys() ]
-        # sorted(filter(lambda x: x in user_topics, task_config.report_runs.keys()))
-        nugget_alignment_manager: AnnotationManager = get_manager(task_config, auth_manager.current_user, 'nugget_alignment_manager')
-        nugget_loader = get_nugget_loader(
-            task_config, auth_manager.current_user, use_revised_nugget=task_config.use_revised_nugget_only
-        )
-        for topic_id, col in zip(nugget_alignment_topics, cycle(st.columns(6))):
-            icon = ':material/check_box_outline_blank:' if not nugget_alignment_manager.is_all_done(topic_id) else ':material/select_check_box:'
-            n_done = nugget_alignment_manager.count_done(topic_id, level='run_id')
-            n_job = nugget_alignment_manager.count_job(topic_id, level='run_id')
-            activated = not task_config.force_citation_asssessment_before_report or citation_assessment_manager.is_all_done(topic_id)
-
-            if task_config.use_revised_nugget_only:
-                activated = activated and len(nugget_loader[topic_id]) > 0
-
+        for (topic_id, p), col in zip(progress['nugget_alignment'].items(), cycle(st.columns(6))):
             col.button(
-                f"Topic {topic_id} ({n_done}/{n_job})", 
-                icon=icon,
+                f"Topic {topic_id} ({p.n_done}/{p.n_job})", 
+                icon=':material/check_box_outline_blank:' if not p.is_done else ':material/select_check_box:',
                 use_container_width=True, 
                 key=f'{task_config.name}/entry/alignment/{topic_id}',
-                disabled=not activated,
+                disabled=not p.available,
                 args=("nugget_alignment", ), 
                 kwargs={'topic': topic_id, "collapse_sidebar": True},
                 on_click=goto_page
@@ -376,8 +382,14 @@ def draw_sidebar():
                     args=("manage_users", ), 
                     on_click=goto_page
                 )
+                st.button(
+                    f"Metrics", 
+                    icon=":material/monitoring:",
+                    args=("metrics", ), 
+                    on_click=goto_page
+                )
                 
-                # st.write(auth_manager.session_user_mapping)
+                # st.write(auth_manager.current_session)
             
             st.divider()
             
@@ -394,7 +406,7 @@ def draw_sidebar():
 if __name__ == '__main__':
 
     parser = ArgumentParser()
-    parser.add_argument('--user_db_path', type=Path, default="./user_db.db")
+    parser.add_argument('--user_db_path', type=str, default="./user_db.db", help="sqlite file, or the url of a networked store")
     # parser.add_argument('--task_configs', nargs='+', type=Path, default=[])
     parser.add_argument('--task_config_path', type=str, default="./configs")
 
@@ -402,17 +414,15 @@ if __name__ == '__main__':
 
     auth_manager = init_app(args)
 
-    # TODO make this dynamic, with a flag
-    task_configs: Dict[str, TaskConfig] = {}
-    for config in map(TaskConfig.from_json, Path(args.task_config_path).glob("*.json")):
-        assert config.name not in task_configs, f"Task Name Collision -- {config.name}"
-        task_configs[config.name] = config
-    
+    task_configs = get_task_registry(args.task_config_path)
+    task_configs.refresh()
+    # managers of this session built on a task config that has been reloaded since
+    for task_name in task_configs.changed_since(st.session_state.get('task_config_generation', task_configs.generation)):
+        for key in [ k for k in st.session_state.keys() if k.startswith(f"{task_name}/") ]:
+            del st.session_state[key]
+    st.session_state['task_config_generation'] = task_configs.generation
     st.session_state['task_configs'] = task_configs
 
-    for config in task_configs.values():
-        Path(config.output_dir).mkdir(parents=True, exist_ok=True)
-
     draw_sidebar()
 
     draw_pages(
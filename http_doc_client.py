@@ -0,0 +1,161 @@
+from typing import Iterable, Dict, Optional
+import asyncio
+import threading
+import random
+
+import aiohttp
+
+# Protocol of the document API (see `benchmarks/doc_api_stand_in.py` for a reference server):
+#   POST {collection_url}/docs  {"doc_ids": [...]}  ->  {"docs": {doc_id: {"title": ..., "text": ...}, ...}}
+# Unknown doc ids are simply omitted from the response.
+
+_RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class DocServiceError(RuntimeError):
+    pass
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class HttpDocClient:
+    """
+    Thread-safe client for the `http_api` document service.
+
+    All requests run on a private asyncio loop in a daemon thread, sharing one keep-alive
+    connection pool. Lookups issued within `batch_window` seconds of each other, even from
+    different Streamlit sessions, are coalesced into batched requests of up to `batch_size`
+    doc ids, with at most `max_concurrency` requests in flight.
+    """
+
+    def __init__(
+            self,
+            max_connections: int = 32,
+            max_concurrency: int = 8,
+            batch_size: int = 64,
+            batch_window: float = 0.005,
+            timeout: float = 10.0,
+            max_retries: int = 3,
+            backoff: float = 0.2,
+            keepalive_timeout: float = 60.0
+        ):
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.keepalive_timeout = keepalive_timeout
+
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'docs_requested': 0}
+
+        self._pending: Dict[str, Dict[str, asyncio.Future]] = {}
+        self._flush_handles: Dict[str, asyncio.TimerHandle] = {}
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="http-doc-client", daemon=True)
+        self._thread.start()
+
+        self._session: aiohttp.ClientSession = None
+        self._semaphore: asyncio.Semaphore = None
+        self._call(self._init_session()).result()
+
+    async def _init_session(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            raise_for_status=False
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    @property
+    def _deadline(self):
+        # worst case of all attempts plus backoff, plus some queueing slack
+        return (self.timeout + self.backoff * 2**self.max_retries) * (self.max_retries + 1) + 30
+
+    async def _post(self, collection_url: str, doc_ids: list):
+        url = f"{collection_url.rstrip('/')}/docs"
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    self.stats['requests'] += 1
+                    async with self._session.post(url, json={'doc_ids': doc_ids}) as resp:
+                        if resp.status in _RETRY_STATUSES:
+                            raise _RetryableStatus(resp.status)
+                        if resp.status >= 400:
+                            raise DocServiceError(f"{url} returned HTTP {resp.status}")
+                        return (await resp.json())['docs']
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableStatus) as e:
+                if attempt == self.max_retries:
+                    self.stats['failures'] += 1
+                    raise DocServiceError(f"{url} failed after {attempt+1} attempts: {e!r}") from e
+
+                self.stats['retries'] += 1
+                # exponential backoff with full jitter
+                await asyncio.sleep(self.backoff * 2**attempt * random.random())
+
+    async def _send(self, collection_url: str, pending: Dict[str, asyncio.Future]):
+        self.stats['docs_requested'] += len(pending)
+        try:
+            docs = await self._post(collection_url, list(pending))
+        except Exception as e:
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for doc_id, fut in pending.items():
+            if not fut.done():
+                fut.set_result(docs.get(doc_id, None))
+
+    def _flush(self, collection_url: str):
+        handle = self._flush_handles.pop(collection_url, None)
+        if handle is not None:
+            handle.cancel()
+
+        pending = self._pending.pop(collection_url, None)
+        if pending:
+            self._loop.create_task(self._send(collection_url, pending))
+
+    def _enqueue(self, collection_url: str, doc_id: str) -> asyncio.Future:
+        pending = self._pending.setdefault(collection_url, {})
+        if doc_id in pending: # same doc requested concurrently
+            return pending[doc_id]
+
+        fut = pending[doc_id] = self._loop.create_future()
+        if len(pending) >= self.batch_size:
+            self._flush(collection_url)
+        elif collection_url not in self._flush_handles:
+            self._flush_handles[collection_url] = self._loop.call_later(self.batch_window, self._flush, collection_url)
+
+        return fut
+
+    async def _fetch_many(self, collection_url: str, doc_ids: Iterable[str]):
+        doc_ids = list(dict.fromkeys(doc_ids))
+        docs = await asyncio.gather(*[ self._enqueue(collection_url, doc_id) for doc_id in doc_ids ])
+        return {
+            doc_id: doc
+            for doc_id, doc in zip(doc_ids, docs) if doc is not None
+        }
+
+    def lookup_many(self, collection_url: str, doc_ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        return self._call(self._fetch_many(collection_url, doc_ids)).result(timeout=self._deadline)
+
+    def lookup(self, collection_url: str, doc_id: str) -> Optional[Dict[str, str]]:
+        return self.lookup_many(collection_url, [doc_id]).get(doc_id, None)
+
+    def close(self):
+        if self._session is not None:
+            self._call(self._session.close()).result()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
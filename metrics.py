@@ -0,0 +1,182 @@
+from typing import Callable, Dict, List, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bisect import bisect_left
+from functools import wraps
+from pathlib import Path
+import threading
+import time
+import os
+
+# In-process latency histograms of what is decorated with `timed` -- the page functions, the annotation
+# and nugget manager methods, every statement of `SqliteManager.execute_simple` (labelled by statement)
+# and the document fetches -- plus the gauges registered with `register_gauges` (document cache, write
+# spool). `start_exporter` serves them in the Prometheus text format and/or writes them to a file; admins
+# also see them on the Metrics page. Off unless RAG_METRICS is set: without it `timed` hands back the
+# function untouched and nothing is recorded.
+
+ENABLED = os.environ.get("RAG_METRICS", "0").lower() not in ("", "0", "false", "no")
+
+# upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'n')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket the q-th observation falls in
+        rank, seen = q * self.n, 0
+        for bound, count in zip(BUCKETS + (float('inf'), ), self.counts):
+            seen += count
+            if seen >= rank and seen > 0:
+                return bound
+        return 0.0
+
+    def copy(self):
+        other = Histogram()
+        other.counts, other.total, other.n = list(self.counts), self.total, self.n
+        return other
+
+
+_histograms: Dict[Tuple[str, str], Histogram] = {}
+_gauges: Dict[str, Callable[[], Dict[str, float]]] = {}
+_lock = threading.Lock()
+
+
+def observe(kind: str, name: str, seconds: float):
+    with _lock:
+        histogram = _histograms.get((kind, name), None)
+        if histogram is None:
+            histogram = _histograms[(kind, name)] = Histogram()
+        histogram.observe(seconds)
+
+
+def timed(kind: str, name: str = None, label: Callable[..., str] = None):
+    """
+    Records the run time of the decorated function under `kind` and `name` (the qualified name by default),
+    or under `label(*args, **kwargs)` of each call.
+    """
+    def dec(func: Callable):
+        if not ENABLED:
+            return func
+
+        metric_name = name or func.__qualname__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(kind, label(*args, **kwargs) if label is not None else metric_name, time.perf_counter() - start)
+        return wrapper
+
+    return dec
+
+
+def register_gauges(prefix: str, read: Callable[[], Dict[str, float]]):
+    # values read at export time, e.g., the counters of the write spool
+    _gauges[prefix] = read
+
+
+def snapshot() -> Dict[Tuple[str, str], Histogram]:
+    with _lock:
+        return { key: histogram.copy() for key, histogram in _histograms.items() }
+
+
+def read_gauges() -> Dict[str, Dict[str, float]]:
+    return { prefix: read() for prefix, read in list(_gauges.items()) }
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus() -> str:
+    lines: List[str] = [
+        "# HELP rag_duration_seconds Time spent in pages, manager methods, database statements and document lookups.",
+        "# TYPE rag_duration_seconds histogram"
+    ]
+    for (kind, name), histogram in sorted(snapshot().items()):
+        labels = f'kind="{_escape(kind)}",name="{_escape(name)}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'), ), histogram.counts):
+            cumulative += count
+            lines.append(f'rag_duration_seconds_bucket{{{labels},le="{"+Inf" if bound == float("inf") else bound}"}} {cumulative}')
+        lines.append(f"rag_duration_seconds_sum{{{labels}}} {histogram.total}")
+        lines.append(f"rag_duration_seconds_count{{{labels}}} {histogram.n}")
+
+    for prefix, values in read_gauges().items():
+        for key, value in values.items():
+            lines.append(f"# TYPE rag_{prefix}_{key} gauge")
+            lines.append(f"rag_{prefix}_{key} {float(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _write_file_forever(file_path: Path, interval: float):
+    while True:
+        time.sleep(interval)
+        # write and rename, so a collector never reads half a file
+        tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}")
+        tmp_path.write_text(render_prometheus())
+        tmp_path.replace(file_path)
+
+
+_exporter_started = False
+
+def start_exporter():
+    """
+    Once per process: serves `/metrics` on RAG_METRICS_PORT and/or rewrites RAG_METRICS_FILE (e.g., for the
+    textfile collector of node_exporter) every RAG_METRICS_INTERVAL seconds, when they are set. When the 
+    port is taken, the metrics go to RAG_METRICS_FILE, or to `./metrics.<pid>.prom` if that is not set.
+    """
+    global _exporter_started
+    with _lock:
+        if _exporter_started or not ENABLED:
+            return
+        _exporter_started = True
+
+    metrics_file = os.environ.get("RAG_METRICS_FILE", None)
+    if os.environ.get("RAG_METRICS_PORT", None) is not None:
+        port = int(os.environ["RAG_METRICS_PORT"])
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+        except OSError as e:
+            # e.g., another server process on this host already has the port -- the app runs without it
+            if metrics_file is None:
+                metrics_file = f"./metrics.{os.getpid()}.prom"
+            print(f"Cannot serve metrics on port {port} -- {e!r}, writing them to {metrics_file} instead")
+
+    if metrics_file is not None:
+        threading.Thread(
+            target=_write_file_forever, name="metrics-file-writer", daemon=True,
+            args=(Path(metrics_file), float(os.environ.get("RAG_METRICS_INTERVAL", 15)))
+        ).start()
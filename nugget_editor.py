@@ -1,19 +1,20 @@
-from typing import Callable
+from typing import Callable, Dict, Set, Union
 
 import streamlit as st
 
 from page_utils import toggle_button, random_key
-from data_manager import NuggetSet
+from data_manager import NuggetSet, session_set_default
 
 
-# @st.fragment()
 def draw_nugget_editor(
-        nugget_set: NuggetSet, current_doc_id: str, key_prefix: str,
+        nugget_set: Union[NuggetSet, Callable[[], NuggetSet]], current_doc_id: str, key_prefix: str,
         title: str = None,
         show_counts: bool = True,
         on_select_nugget_answer: Callable=None, on_unselect_nugget_answer: Callable=None,
         on_assign_group: Callable=None, on_rename_group: Callable=None,
         on_rewrite_question: Callable=None,
+        rerun_page_on: Callable=None,
+        page_size: int = None,
         highlight_group_name: bool = True,
         allow_nugget_answer_selection: bool = True,
         allow_nugget_answer_creation: bool = True,
@@ -21,7 +22,128 @@ def draw_nugget_editor(
         allow_nugget_group_edit: bool = True,
         allow_nugget_question_edit: bool = False
     ):
+    """
+    Clicks in the editor (answer selection, group assignment, question edits) only rerun the editor.
+    `nugget_set` can be a function building the set, for sets derived from other state that need
+    to be rebuilt on every rerun of the editor. If other parts of the page depend on the nuggets,
+    `rerun_page_on` returns that state, and the whole page is rerun when it changes.
+    With `page_size`, only one page of nuggets is drawn, with collapsible groups and a question search.
+    """
+    if rerun_page_on is not None:
+        st.session_state[f"{key_prefix}/page_state"] = rerun_page_on()
 
+    _nugget_editor(
+        nugget_set, current_doc_id, key_prefix,
+        title=title,
+        show_counts=show_counts,
+        on_select_nugget_answer=on_select_nugget_answer, on_unselect_nugget_answer=on_unselect_nugget_answer,
+        on_assign_group=on_assign_group, on_rename_group=on_rename_group,
+        on_rewrite_question=on_rewrite_question,
+        rerun_page_on=rerun_page_on,
+        page_size=page_size,
+        highlight_group_name=highlight_group_name,
+        allow_nugget_answer_selection=allow_nugget_answer_selection,
+        allow_nugget_answer_creation=allow_nugget_answer_creation,
+        allow_nugget_question_creation=allow_nugget_question_creation,
+        allow_nugget_group_edit=allow_nugget_group_edit,
+        allow_nugget_question_edit=allow_nugget_question_edit
+    )
+
+
+def _window_slots(nugget_set: NuggetSet, collapsed: Set[str]):
+    # one slot per nugget of the open groups, and one per collapsed group
+    slots = []
+    for group_name, nugget_members in nugget_set.iter_grouped_nuggets():
+        if group_name in collapsed:
+            slots.append((group_name, None, len(nugget_members)))
+        else:
+            slots += [ (group_name, member, len(nugget_members)) for member in nugget_members ]
+    return slots
+
+
+def _draw_window(
+        nugget_set: NuggetSet, view: Dict, page_size: int, key_prefix: str,
+        draw_group_header: Callable, draw_nugget: Callable
+    ):
+    slots = _window_slots(nugget_set, view['collapsed'])
+    n_pages = max(1, -(-len(slots) // page_size))
+    view['page'] = min(view['page'], n_pages - 1)
+
+    def _move(delta):
+        view['page'] = max(0, min(view['page'] + delta, n_pages - 1))
+
+    def _jump(jump_key):
+        nidx = st.session_state[jump_key]
+        if nidx is None:
+            return
+        view['collapsed'].discard(nugget_set.get_group(nugget_set[nidx][0]))
+        for position, (_, member, _) in enumerate(_window_slots(nugget_set, view['collapsed'])):
+            if member is not None and member[0] == nidx:
+                view['page'] = position // page_size
+                break
+        st.session_state[jump_key] = None
+
+    jump_key = f"{key_prefix}/jump"
+    jump_col, prev_col, page_col, next_col = st.columns([5, 0.7, 1.6, 0.7], vertical_alignment='center')
+    jump_col.selectbox(
+        label="jump",
+        options=list(range(len(nugget_set))),
+        format_func=lambda nidx: nugget_set[nidx][0],
+        index=None,
+        placeholder="Search questions...",
+        label_visibility="collapsed",
+        key=jump_key,
+        args=(jump_key, ),
+        on_change=_jump
+    )
+    prev_col.button(
+        "", icon=":material/chevron_left:", key=f"{key_prefix}/prev_page",
+        disabled=view['page'] == 0, args=(-1, ), on_click=_move
+    )
+    page_col.write(f"Page {view['page'] + 1} / {n_pages}")
+    next_col.button(
+        "", icon=":material/chevron_right:", key=f"{key_prefix}/next_page",
+        disabled=view['page'] == n_pages - 1, args=(1, ), on_click=_move
+    )
+
+    current_group = None
+    for group_name, member, n_members in slots[view['page'] * page_size:(view['page'] + 1) * page_size]:
+        if group_name != current_group:
+            current_group, group_container, first = group_name, st.container(border=True), True
+            draw_group_header(group_container, group_name, n_members)
+        if member is None: # collapsed
+            continue
+
+        if not first:
+            group_container.html('<hr class="nugget_set_divider">')
+        first = False
+        draw_nugget(group_container, *member, group_name)
+
+
+@st.fragment
+def _nugget_editor(
+        nugget_set: Union[NuggetSet, Callable[[], NuggetSet]], current_doc_id: str, key_prefix: str,
+        title: str, show_counts: bool,
+        on_select_nugget_answer: Callable, on_unselect_nugget_answer: Callable,
+        on_assign_group: Callable, on_rename_group: Callable,
+        on_rewrite_question: Callable,
+        rerun_page_on: Callable,
+        page_size: int,
+        highlight_group_name: bool,
+        allow_nugget_answer_selection: bool,
+        allow_nugget_answer_creation: bool,
+        allow_nugget_question_creation: bool,
+        allow_nugget_group_edit: bool,
+        allow_nugget_question_edit: bool
+    ):
+    # the arguments are the ones of the last page run; the callbacks below already changed the nuggets
+    if rerun_page_on is not None and rerun_page_on() != st.session_state.get(f"{key_prefix}/page_state"):
+        st.rerun()
+
+    if callable(nugget_set):
+        nugget_set = nugget_set()
+
+    # widget callbacks, so a click reruns this fragment instead of the page
     def _modify_answer(nidx, selection_key, add_key = None):
         if not allow_nugget_answer_selection:
             st.session_state[selection_key] = []
@@ -30,6 +152,8 @@ def draw_nugget_editor(
 
         question = nugget_set[nidx][0]
         if add_key is not None:
+            if st.session_state[add_key] is None or st.session_state[add_key] == "":
+                return
             answers = [st.session_state[add_key]]
         elif '+' not in st.session_state[selection_key]:
             answers = st.session_state[selection_key]
@@ -48,7 +172,6 @@ def draw_nugget_editor(
 
                 if on_unselect_nugget_answer:
                     on_unselect_nugget_answer(current_doc_id, question, deleted)
-                    st.rerun()
                     return
                 
         # Adding
@@ -60,17 +183,15 @@ def draw_nugget_editor(
             del st.session_state[selection_key]
             if add_key is not None:
                 del st.session_state[add_key]
-        
-        st.rerun()
     
-    def _modify_question(nidx, text_key, toggle_key):
+    def _modify_question(nidx, text_key):
         old_question = nugget_set[nidx][0]
         new_question = st.session_state[text_key]
 
         if old_question != new_question and on_rewrite_question:
             on_rewrite_question(old_question, new_question)
     
-        st.session_state[toggle_key] = False
+        view['editing'].discard(nidx)
 
 
     @st.dialog("Rename Group")
@@ -105,105 +226,133 @@ def draw_nugget_editor(
     if title is not None:
         st.write(f"**{title}**")
 
+    # compact view state of the editor; widgets only exist for the nuggets on screen
+    view = session_set_default(f"{key_prefix}/view", lambda: {'page': 0, 'collapsed': set(), 'editing': set()})
+
     sorted_nugget_groups = nugget_set.groups + [_new_group_label]
     # print(nugget_set.group_assignment)
 
-    # for nidx, question, a_dict in nugget_set.iter_nuggets():
-    for group_name, nugget_members in nugget_set.iter_grouped_nuggets():
-        group_container = st.container(border=True)
-        if group_name != "default":
-            if allow_nugget_group_edit:
-                name_col, change_col = group_container.columns([5.5,1.5], vertical_alignment='center')
-            else:
-                name_col, change_col = *group_container.columns([1], vertical_alignment='center'), None
-            
-            name_col.write(f":orange[Group: {group_name}]" if highlight_group_name else f"Group: {group_name}")
-            
-            if allow_nugget_group_edit and \
-               change_col.button("Rename", icon=":material/edit:", key=f"{key_prefix}/group/{group_name}/rename"):
-                rename_group_modal(group_name)
-
-        skipped_first = False
-        for nidx, question, a_dict in nugget_members:
-            if skipped_first:
-                group_container.html('<hr class="nugget_set_divider">')
-            skipped_first = True
-
-            need_new_answer_column = allow_nugget_answer_creation \
-                and f"{key_prefix}/nugget/{nidx}/select" in st.session_state \
-                and '+' in st.session_state[f"{key_prefix}/nugget/{nidx}/select"]
-
-            if need_new_answer_column and allow_nugget_group_edit:
-                q_col, a_col, input_col, group_col = group_container.columns([2,2,1.5,1.5], vertical_alignment='center')
-            elif allow_nugget_group_edit:
-                q_col, a_col, group_col = group_container.columns([2,3.5,1.5], vertical_alignment='center')
-            elif need_new_answer_column:
-                q_col, a_col, input_col = group_container.columns([2,2,3], vertical_alignment='center')
-            else:
-                q_col, a_col = group_container.columns([5,5], vertical_alignment='center')
-            
-            
+    def _toggle_group(group_name):
+        if group_name in view['collapsed']:
+            view['collapsed'].remove(group_name)
+        else:
+            view['collapsed'].add(group_name)
 
-            if allow_nugget_question_edit:
-                if q_col.toggle(question, key=f"{key_prefix}/nugget/{nidx}/question_toggle"):
-                    q_col.text_input(
-                        label="q_edit",
-                        value=question, 
-                        key=f"{key_prefix}/nugget/{nidx}/question_edit",
-                        label_visibility="collapsed",
-                        args=(nidx, f"{key_prefix}/nugget/{nidx}/question_edit", f"{key_prefix}/nugget/{nidx}/question_toggle"),
-                        on_change=_modify_question
-                    )
-            else:
-                q_col.write(question)
-                
-            def _display_answers(k):
-                if k == "+":
-                    return ":material/add:"
-                if show_counts:
-                    return f"{k} ({len(a_dict[k])})"
-                return k
-            
-            selected_answers = [ a for a, dids in a_dict.items() if current_doc_id in dids ]
-            answer_selection = a_col.pills(
-                label="answers", 
-                options=list(a_dict.keys()) + (["+"] if allow_nugget_answer_creation else []),
-                format_func=_display_answers,
-                default=selected_answers,
-                selection_mode='multi',
-                label_visibility='collapsed',
-                key=f"{key_prefix}/nugget/{nidx}/select",
-                # args=(nidx, f"{key_prefix}/nugget/{nidx}/select"),
-                # on_change=_modify_answer
+    def _toggle_question_edit(nidx, toggle_key):
+        if st.session_state[toggle_key]:
+            view['editing'].add(nidx)
+        else:
+            view['editing'].discard(nidx)
+
+    def _draw_group_header(group_container, group_name, n_members, collapsible):
+        if group_name == "default" and not collapsible:
+            return
+
+        col_widths = [5.5] + ([1.5] if allow_nugget_group_edit and group_name != "default" else []) + ([0.6] if collapsible else [])
+        name_col, *button_cols = group_container.columns(col_widths, vertical_alignment='center')
+
+        label = f"Group: {group_name}" + (f" ({n_members})" if collapsible else "")
+        name_col.write(f":orange[{label}]" if highlight_group_name else label)
+
+        if allow_nugget_group_edit and group_name != "default" and \
+           button_cols[0].button("Rename", icon=":material/edit:", key=f"{key_prefix}/group/{group_name}/rename"):
+            rename_group_modal(group_name)
+
+        if collapsible:
+            button_cols[-1].button(
+                "", icon=":material/unfold_more:" if group_name in view['collapsed'] else ":material/unfold_less:",
+                key=f"{key_prefix}/group/{group_name}/collapse",
+                args=(group_name, ), on_click=_toggle_group
             )
-            if set(answer_selection) != set(selected_answers):
-                _modify_answer(nidx, f"{key_prefix}/nugget/{nidx}/select")
-
-            if  "+" in answer_selection:
-                added_answer = input_col.text_input(
-                    label="add_answer",
-                    placeholder="New answer...",
-                    key=f"{key_prefix}/nugget/{nidx}/add",
-                    label_visibility='collapsed',
-                    # args=(nidx, f"{key_prefix}/nugget/{nidx}/select", f"{key_prefix}/nugget/{nidx}/add"),
-                    # on_change=_modify_answer
-                )
-                if added_answer is not None and added_answer != "":
-                    _modify_answer(nidx, f"{key_prefix}/nugget/{nidx}/select", f"{key_prefix}/nugget/{nidx}/add")
-            
-            group_key = f"{key_prefix}/nugget/{nidx}/group"
-            if allow_nugget_group_edit:
-                group_col.selectbox(
-                    label="select_group",
-                    options=sorted_nugget_groups,
-                    index=sorted_nugget_groups.index(group_name),
-                    key=group_key,
+
+    def _draw_nugget(group_container, nidx, question, a_dict, group_name):
+        need_new_answer_column = allow_nugget_answer_creation \
+            and f"{key_prefix}/nugget/{nidx}/select" in st.session_state \
+            and '+' in st.session_state[f"{key_prefix}/nugget/{nidx}/select"]
+
+        if need_new_answer_column and allow_nugget_group_edit:
+            q_col, a_col, input_col, group_col = group_container.columns([2,2,1.5,1.5], vertical_alignment='center')
+        elif allow_nugget_group_edit:
+            q_col, a_col, group_col = group_container.columns([2,3.5,1.5], vertical_alignment='center')
+        elif need_new_answer_column:
+            q_col, a_col, input_col = group_container.columns([2,2,3], vertical_alignment='center')
+        else:
+            q_col, a_col = group_container.columns([5,5], vertical_alignment='center')
+        
+        
+
+        if allow_nugget_question_edit:
+            toggle_key = f"{key_prefix}/nugget/{nidx}/question_toggle"
+            if q_col.toggle(question, value=nidx in view['editing'], key=toggle_key, args=(nidx, toggle_key), on_change=_toggle_question_edit):
+                q_col.text_input(
+                    label="q_edit",
+                    value=question, 
+                    key=f"{key_prefix}/nugget/{nidx}/question_edit",
                     label_visibility="collapsed",
-                    args=(group_key, question),
-                    on_change=_select_group
+                    args=(nidx, f"{key_prefix}/nugget/{nidx}/question_edit"),
+                    on_change=_modify_question
                 )
+        else:
+            q_col.write(question)
             
+        def _display_answers(k):
+            if k == "+":
+                return ":material/add:"
+            if show_counts:
+                return f"{k} ({len(a_dict[k])})"
+            return k
+        
+        selected_answers = [ a for a, dids in a_dict.items() if current_doc_id in dids ]
+        answer_selection = a_col.pills(
+            label="answers", 
+            options=list(a_dict.keys()) + (["+"] if allow_nugget_answer_creation else []),
+            format_func=_display_answers,
+            default=selected_answers,
+            selection_mode='multi',
+            label_visibility='collapsed',
+            key=f"{key_prefix}/nugget/{nidx}/select",
+            args=(nidx, f"{key_prefix}/nugget/{nidx}/select"),
+            on_change=_modify_answer
+        )
+
+        if  "+" in answer_selection:
+            input_col.text_input(
+                label="add_answer",
+                placeholder="New answer...",
+                key=f"{key_prefix}/nugget/{nidx}/add",
+                label_visibility='collapsed',
+                args=(nidx, f"{key_prefix}/nugget/{nidx}/select", f"{key_prefix}/nugget/{nidx}/add"),
+                on_change=_modify_answer
+            )
         
+        group_key = f"{key_prefix}/nugget/{nidx}/group"
+        if allow_nugget_group_edit:
+            group_col.selectbox(
+                label="select_group",
+                options=sorted_nugget_groups,
+                index=sorted_nugget_groups.index(group_name),
+                key=group_key,
+                label_visibility="collapsed",
+                args=(group_key, question),
+                on_change=_select_group
+            )
+
+    if page_size is None:
+        # for nidx, question, a_dict in nugget_set.iter_nuggets():
+        for group_name, nugget_members in nugget_set.iter_grouped_nuggets():
+            group_container = st.container(border=True)
+            _draw_group_header(group_container, group_name, len(nugget_members), collapsible=False)
+
+            for i, (nidx, question, a_dict) in enumerate(nugget_members):
+                if i > 0:
+                    group_container.html('<hr class="nugget_set_divider">')
+                _draw_nugget(group_container, nidx, question, a_dict, group_name)
+    else:
+        _draw_window(
+            nugget_set, view, page_size, key_prefix,
+            draw_group_header=lambda container, group_name, n_members: _draw_group_header(container, group_name, n_members, collapsible=True),
+            draw_nugget=_draw_nugget
+        )
 
 
     def _new_nugget():
@@ -1,13 +1,19 @@
-from typing import Callable, List
+from typing import Callable, Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 import streamlit as st
 import sqlite3
 
+import os
 import uuid
+import threading
+import time
 import random
 import string
 from hashlib import md5
 
-from data_manager import SqliteManager, session_set_default
+from data_manager import SqliteManager, CursorStore, session_set_default
+from metrics import timed
 
 _page_mapper = {}
 
@@ -47,7 +53,7 @@ def stpage(name: str, require_login=False, require_admin=False):
     # assert name not in _page_mapper
 
     def dec(func: Callable):
-        _page_mapper[name] = (func, require_login, require_admin)
+        _page_mapper[name] = (timed("page", name)(func), require_login, require_admin)
         return func
 
     return dec
@@ -64,10 +70,12 @@ def goto_page(page_name, collapse_sidebar: bool=False, **kwargs):
 def draw_bread_crumb(
         crumbs: List[str], n_jobs: int, n_done: int, 
         key: str, 
-        check_done: Callable,
+        next_pending: Callable[[int], Optional[int]],
+        cursor_store: CursorStore=None,
         icon=":material/double_arrow:"
     ):
-    session_set_default(key, 0)
+    # the position is kept in `cursor_store` as well, if given, to resume there in the next session
+    session_set_default(key, lambda : max(min(cursor_store.get(key), n_jobs-1), 0) if cursor_store is not None else 0)
 
     def _change_doc():
         if st.session_state.doc_nav == 'back':
@@ -75,16 +83,16 @@ def draw_bread_crumb(
         elif st.session_state.doc_nav == 'next':
             st.session_state[key] += 1
         elif st.session_state.doc_nav == 'next_unfinished':
-            l = list(range(n_jobs))
-            for idx in l[st.session_state[key]+1:] + l[:st.session_state[key]+1]:
-                if not check_done(idx):
-                    st.session_state[key] = idx
-                    break
+            idx = next_pending(st.session_state[key])
+            if idx is not None:
+                st.session_state[key] = idx
             else:
                 st.toast("Everything is done here!")
         
         st.session_state[key] = max(st.session_state[key], 0)
         st.session_state[key] = min(st.session_state[key], n_jobs-1)
+        if cursor_store is not None:
+            cursor_store.put(key, st.session_state[key])
 
         st.session_state.doc_nav = None
         
@@ -143,29 +151,136 @@ def _generate_salt(length: int=16):
     return ''.join(random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for _ in range(length))
 
 
+class SessionStore(ABC):
+    """
+    Logged in sessions, session token -> (username, is_admin). 
+    Sessions expire after `ttl` seconds without being used. 
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, token: str) -> Optional[Tuple[str, bool]]:
+        ...
+
+    @abstractmethod
+    def put(self, token: str, username: str, is_admin: bool):
+        ...
+
+    @abstractmethod
+    def delete(self, token: str):
+        ...
+
+
+class SqliteSessionStore(SqliteManager, SessionStore):
+    """
+    Sessions in the `sessions` table of the user db, so all the app processes sharing the db see the 
+    same logins and they survive restarts. Lookups are cached in the process for `cache_ttl` seconds, 
+    which is also how long a logout in another process can take to be seen here. At most 
+    `max_cached_sessions` are cached, the least recently used ones are dropped first. 
+    """
+
+    def __init__(self, db_path: str, ttl: float=None, cache_ttl: float=5., max_cached_sessions: int=4096):
+        SqliteManager.__init__(self, db_path, persistent_connection=False)
+        SessionStore.__init__(self, ttl if ttl is not None else float(os.environ.get("RAG_SESSION_TTL_HOURS", 72)) * 3600)
+        self.cache_ttl = cache_ttl
+        self.max_cached_sessions = max_cached_sessions
+
+        # token -> (session, read at, expires at)
+        self._cache: OrderedDict[str, Tuple[Optional[Tuple[str, bool]], float, float]] = OrderedDict()
+        self._cache_lock = threading.Lock() # shared by the sessions of the process
+
+        if not self.table_exists('sessions'):
+            self.execute_simple("""
+                create table if not exists sessions (
+                    token string primary key, username string, admin int default 0, expires real
+                );
+            """)
+
+    def _cache_get(self, token: str, now: float):
+        with self._cache_lock:
+            entry = self._cache.get(token, None)
+            if entry is None or now - entry[1] >= self.cache_ttl:
+                return None
+            self._cache.move_to_end(token)
+            return entry
+
+    def _cache_put(self, token: str, entry: Tuple[Optional[Tuple[str, bool]], float, float]):
+        with self._cache_lock:
+            self._cache[token] = entry
+            self._cache.move_to_end(token)
+            while len(self._cache) > self.max_cached_sessions:
+                self._cache.popitem(last=False)
+        return entry[0]
+
+    def _cache_drop(self, token: str):
+        with self._cache_lock:
+            self._cache.pop(token, None)
+
+    def get(self, token: str) -> Optional[Tuple[str, bool]]:
+        now = time.time()
+        cached = self._cache_get(token, now)
+        if cached is not None:
+            return cached[0]
+
+        records = self.execute_simple(
+            """select username, admin, expires from sessions where token = ? and expires > ?;""", (token, now)
+        )
+        if records is None:
+            # the store failed (and said so), not a logged-out session -- ask again next time
+            self._cache_drop(token)
+            return None
+        if not records:
+            return self._cache_put(token, (None, now, now))
+
+        username, admin, expires = records[0]
+        # refresh the expiry once half of the ttl is used, instead of on every read
+        if expires - now < self.ttl / 2:
+            expires = now + self.ttl
+            self.execute_simple("""update sessions set expires = ? where token = ?;""", (expires, token))
+
+        return self._cache_put(token, ((username, admin != 0), now, expires))
+
+    def put(self, token: str, username: str, is_admin: bool):
+        now = time.time()
+        self.execute_simple("""delete from sessions where expires <= ?;""", (now, ))
+        self.execute_simple(
+            """insert or replace into sessions (token, username, admin, expires) values (?, ?, ?, ?);""",
+            (token, username, int(is_admin), now + self.ttl)
+        )
+        self._cache_put(token, ((username, is_admin), now, now + self.ttl))
+
+    def delete(self, token: str):
+        self.execute_simple("""delete from sessions where token = ?;""", (token, ))
+        self._cache_drop(token)
+
+
 class AuthManager(SqliteManager):
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, session_store: SessionStore=None):
         super().__init__(db_path, persistent_connection=False)
-        self.session_user_mapping = {}
+        self.session_store = session_store if session_store is not None else SqliteSessionStore(db_path)
 
         self.init_db()
 
+    @property
+    def current_session(self) -> Optional[Tuple[str, bool]]:
+        sid = _get_session_id()
+        return self.session_store.get(sid) if sid is not None else None
+
     @property
     def current_user(self):
         if _get_session_id() is None:
             st.error("Please refresh the browser tab.")
 
-        if _get_session_id() not in self.session_user_mapping:
-            return None
-        
-        return self.session_user_mapping[_get_session_id()][0]
+        session = self.current_session
+        return session[0] if session is not None else None
 
     @property
     def is_admin(self):
-        if _get_session_id() not in self.session_user_mapping:
-            return False
-        return self.session_user_mapping[_get_session_id()][1]
+        session = self.current_session
+        return session[1] if session is not None else False
     
     def init_db(self):
         if not self.table_exists("users"):
@@ -209,7 +324,7 @@ class AuthManager(SqliteManager):
         
         if is_success:
             assert _get_session_id() is not None
-            self.session_user_mapping[ _get_session_id() ] = (username, is_admin)
+            self.session_store.put(_get_session_id(), username, is_admin)
         
         return is_success
 
@@ -234,14 +349,14 @@ class AuthManager(SqliteManager):
 
     def logout(self):
         sid = _get_session_id()
-        if sid in self.session_user_mapping:
-            del self.session_user_mapping[ _get_session_id() ]
+        if sid is not None:
+            self.session_store.delete(sid)
 
 
 
 @st.cache_resource
-def get_auth_manager(db_path):
-    return AuthManager(db_path)
+def get_auth_manager(db_path, _session_store: SessionStore=None):
+    return AuthManager(db_path, session_store=_session_store)
 
 
 
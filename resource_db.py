@@ -0,0 +1,243 @@
+from typing import Dict, Iterable, Iterator, List, Literal, Mapping, Tuple
+from collections import OrderedDict
+from types import MappingProxyType
+from pathlib import Path
+import threading
+import sqlite3
+import os
+
+# Compiled, topic-indexed version of the json resources referred by the task configs
+# (`doc_pools_path`, `cited_sentences_path`, `report_runs_path`). One sqlite file can hold
+# all three; point the config fields to it and each topic is read only when a page asks for it.
+
+ResourceKind = Literal['doc_pools', 'cited_sentences', 'report_runs']
+
+_SCHEMA = """
+create table topics (kind text, topic_id text, primary key (kind, topic_id));
+create table doc_pools (topic_id text, doc_id text);
+create table cited_sentences (topic_id text, doc_id text, run_id text, sent_id text, sentence text);
+create table report_sentences (topic_id text, run_id text, sent_id text, sentence text);
+"""
+
+_INDEXES = """
+create index doc_pools_topic on doc_pools (topic_id);
+create index cited_sentences_topic_doc on cited_sentences (topic_id, doc_id);
+create index report_sentences_topic_run on report_sentences (topic_id, run_id);
+"""
+
+
+def freeze(obj):
+    # read-only views, so one copy of the resources can be shared by all sessions
+    if isinstance(obj, dict):
+        return MappingProxyType({ key: freeze(val) for key, val in obj.items() })
+    if isinstance(obj, list):
+        return tuple(map(freeze, obj))
+    return obj
+
+
+def is_resource_db(fn: str):
+    return Path(fn).suffix in ('.db', '.sqlite')
+
+
+class ResourceDBWriter:
+    """
+    Writes a compiled resource file topic by topic. The file is built next to the
+    destination and moved into place on `close`, so readers never see a partial file.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.tmp_path = self.db_path.with_name(f".{self.db_path.name}.{os.getpid()}.tmp")
+        self.tmp_path.unlink(missing_ok=True)
+
+        self.conn = sqlite3.connect(self.tmp_path)
+        self.conn.executescript("pragma journal_mode=off; pragma synchronous=off;" + _SCHEMA)
+
+    def _add_topic(self, kind: ResourceKind, topic_id: str):
+        self.conn.execute("insert into topics (kind, topic_id) values (?, ?);", (kind, topic_id))
+
+    def add_doc_pool(self, topic_id: str, doc_ids: Iterable[str]):
+        self._add_topic('doc_pools', topic_id)
+        self.conn.executemany(
+            "insert into doc_pools (topic_id, doc_id) values (?, ?);",
+            [ (topic_id, doc_id) for doc_id in doc_ids ]
+        )
+
+    def add_cited_sentences(self, topic_id: str, docs: Mapping[str, Mapping[str, Mapping[str, str]]]):
+        self._add_topic('cited_sentences', topic_id)
+        rows = []
+        for doc_id, runs in docs.items():
+            if len(runs) == 0: # document without citing sentence, e.g., added from qrels
+                rows.append((topic_id, doc_id, None, None, None))
+            for run_id, sents in runs.items():
+                if len(sents) == 0:
+                    rows.append((topic_id, doc_id, run_id, None, None))
+                rows += [ (topic_id, doc_id, run_id, str(sent_id), sent) for sent_id, sent in sents.items() ]
+        self.conn.executemany(
+            "insert into cited_sentences (topic_id, doc_id, run_id, sent_id, sentence) values (?, ?, ?, ?, ?);", rows
+        )
+
+    def add_report_runs(self, topic_id: str, runs: Mapping[str, Mapping[str, str]]):
+        self._add_topic('report_runs', topic_id)
+        rows = []
+        for run_id, sents in runs.items():
+            if len(sents) == 0: # empty report
+                rows.append((topic_id, run_id, None, None))
+            rows += [ (topic_id, run_id, str(sent_id), sent) for sent_id, sent in sents.items() ]
+        self.conn.executemany(
+            "insert into report_sentences (topic_id, run_id, sent_id, sentence) values (?, ?, ?, ?);", rows
+        )
+
+    def close(self):
+        self.conn.executescript(_INDEXES)
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp_path, self.db_path)
+
+
+def compile_resource_db(
+        db_path: str,
+        doc_pools: Mapping[str, List[str]] = None,
+        cited_sentences: Mapping[str, Mapping] = None,
+        report_runs: Mapping[str, Mapping] = None
+    ):
+    writer = ResourceDBWriter(db_path)
+    for topic_id, doc_ids in (doc_pools or {}).items():
+        writer.add_doc_pool(topic_id, doc_ids)
+    for topic_id, docs in (cited_sentences or {}).items():
+        writer.add_cited_sentences(topic_id, docs)
+    for topic_id, runs in (report_runs or {}).items():
+        writer.add_report_runs(topic_id, runs)
+    writer.close()
+
+
+class ResourceDB:
+    # read-only, thread-safe access to a compiled resource file
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def _query(self, query: str, args: Tuple = ()):
+        with self._lock:
+            return self._conn.execute(query, args).fetchall()
+
+    def topics(self, kind: ResourceKind) -> List[str]:
+        return [ t for t, in self._query("select topic_id from topics where kind = ? order by rowid;", (kind, )) ]
+
+    def get_doc_pool(self, topic_id: str) -> List[str]:
+        return [ d for d, in self._query("select doc_id from doc_pools where topic_id = ? order by rowid;", (topic_id, )) ]
+
+    def get_cited_sentences(self, topic_id: str, doc_id: str = None) -> Dict[str, Dict[str, Dict[str, str]]]:
+        if doc_id is None:
+            rows = self._query("""
+                select doc_id, run_id, sent_id, sentence from cited_sentences where topic_id = ? order by rowid;
+            """, (topic_id, ))
+        else:
+            rows = self._query("""
+                select doc_id, run_id, sent_id, sentence from cited_sentences where topic_id = ? and doc_id = ? order by rowid;
+            """, (topic_id, doc_id))
+        return _nest_cited(rows)
+
+    def get_report_runs(self, topic_id: str, run_id: str = None) -> Dict[str, Dict[str, str]]:
+        if run_id is None:
+            rows = self._query("""
+                select run_id, sent_id, sentence from report_sentences where topic_id = ? order by rowid;
+            """, (topic_id, ))
+        else:
+            rows = self._query("""
+                select run_id, sent_id, sentence from report_sentences where topic_id = ? and run_id = ? order by rowid;
+            """, (topic_id, run_id))
+        return _nest_report(rows)
+
+    def get(self, kind: ResourceKind, topic_id: str):
+        if kind == 'doc_pools':
+            return self.get_doc_pool(topic_id)
+        if kind == 'cited_sentences':
+            return self.get_cited_sentences(topic_id)
+        return self.get_report_runs(topic_id)
+
+    def iter_all(self, kind: ResourceKind) -> Iterator[Tuple[str, object]]:
+        # one pass over the table instead of one query per topic
+        table, columns = {
+            'doc_pools': ('doc_pools', 'doc_id'),
+            'cited_sentences': ('cited_sentences', 'doc_id, run_id, sent_id, sentence'),
+            'report_runs': ('report_sentences', 'run_id, sent_id, sentence')
+        }[kind]
+        rows_by_topic: Dict[str, list] = { t: [] for t in self.topics(kind) }
+        for topic_id, *row in self._query(f"select topic_id, {columns} from {table} order by rowid;"):
+            rows_by_topic[topic_id].append(row)
+
+        for topic_id, rows in rows_by_topic.items():
+            if kind == 'doc_pools':
+                yield topic_id, [ d for d, in rows ]
+            elif kind == 'cited_sentences':
+                yield topic_id, _nest_cited(rows)
+            else:
+                yield topic_id, _nest_report(rows)
+
+
+def _nest_cited(rows):
+    docs: Dict[str, Dict[str, Dict[str, str]]] = {}
+    for doc_id, run_id, sent_id, sent in rows:
+        runs = docs.setdefault(doc_id, {})
+        if run_id is not None:
+            sents = runs.setdefault(run_id, {})
+            if sent_id is not None:
+                sents[sent_id] = sent
+    return docs
+
+def _nest_report(rows):
+    runs: Dict[str, Dict[str, str]] = {}
+    for run_id, sent_id, sent in rows:
+        sents = runs.setdefault(run_id, {})
+        if sent_id is not None:
+            sents[sent_id] = sent
+    return runs
+
+
+class LazyTopicResource(Mapping):
+    """
+    topic_id -> (read-only) resource of the topic, read from a ResourceDB on first access.
+    Behaves like the frozen json resources, so the pages do not need to know the difference.
+    """
+
+    def __init__(self, db: ResourceDB, kind: ResourceKind, max_cached_topics: int = 64):
+        self.db = db
+        self.kind = kind
+        self.max_cached_topics = max_cached_topics
+
+        self._topics = { t: None for t in db.topics(kind) }
+        self._cache: OrderedDict[str, Mapping] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, topic_id: str):
+        if topic_id not in self._topics:
+            raise KeyError(topic_id)
+
+        with self._lock:
+            if topic_id in self._cache:
+                self._cache.move_to_end(topic_id)
+                return self._cache[topic_id]
+
+        value = freeze(self.db.get(self.kind, topic_id))
+        with self._lock:
+            self._cache[topic_id] = value
+            while len(self._cache) > self.max_cached_topics:
+                self._cache.popitem(last=False)
+        return value
+
+    def __contains__(self, topic_id: str):
+        return topic_id in self._topics
+
+    def __iter__(self):
+        return iter(self._topics)
+
+    def __len__(self):
+        return len(self._topics)
+
+    def items(self):
+        # full scans (e.g., building the annotation managers) skip the per-topic cache
+        for topic_id, value in self.db.iter_all(self.kind):
+            yield topic_id, freeze(value)
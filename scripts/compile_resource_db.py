@@ -0,0 +1,30 @@
+from argparse import ArgumentParser
+from pathlib import Path
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from resource_db import compile_resource_db
+
+# Compile existing json resources (e.g., made by an older prepare_utils.py) into one
+# topic-indexed file that task configs can point `doc_pools_path`, `cited_sentences_path`
+# and `report_runs_path` to.
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('output', type=Path)
+    parser.add_argument('--doc_pools', type=Path, default=None)
+    parser.add_argument('--cited_sentences', type=Path, default=None)
+    parser.add_argument('--report_runs', type=Path, default=None)
+
+    args = parser.parse_args()
+    assert not args.output.exists(), f"{args.output} already exists."
+
+    load = lambda fn: json.loads(fn.read_text()) if fn is not None else None
+    compile_resource_db(
+        args.output, 
+        doc_pools=load(args.doc_pools), 
+        cited_sentences=load(args.cited_sentences), 
+        report_runs=load(args.report_runs)
+    )
+    print(f"{args.output} done")
@@ -3,6 +3,29 @@ import gzip
 import json
 from pathlib import Path
 
+
+def rubric_to_nugget_list(items):
+    # merge 
+    nugget_list = []
+    q_idx = {}
+    for item in items:
+        a_dict = { answer: [] for answer in item['gold_answers'] }
+        if item['question_text'] in q_idx:
+            nugget_list[ q_idx[item['question_text']] ][1].update(a_dict)
+        else:
+            nugget_list.append((item['question_text'], a_dict))
+            q_idx[item['question_text']] = len(nugget_list) - 1
+    return nugget_list
+
+
+def iter_rubric(input_fn: Path):
+    # (query_id, items) one line at a time
+    with (gzip.open if input_fn.suffix == ".gz" else open)(input_fn, 'rt') as fr:
+        for line in fr:
+            d = json.loads(line)
+            yield d['query_id'], d['items']
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
@@ -16,10 +39,7 @@ if __name__ == '__main__':
     input_fn: Path = args.input
     output_dir: Path = args.output_dir
 
-    rubric_data = {
-        d['query_id']: d['items']
-        for d in map(json.loads, (gzip.open if input_fn.suffix == ".gz" else open)(input_fn, 'rt'))
-    }
+    rubric_data = dict(iter_rubric(input_fn))
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -32,16 +52,7 @@ if __name__ == '__main__':
             print(f"[{query_id}] file {output_fn} already exists, skipped.")
             continue
     
-        # merge 
-        nugget_list = []
-        q_idx = {}
-        for item in items:
-            a_dict = { answer: [] for answer in item['gold_answers'] }
-            if item['question_text'] in q_idx:
-                nugget_list[ q_idx[item['question_text']] ][1].update(a_dict)
-            else:
-                nugget_list.append((item['question_text'], a_dict))
-                q_idx[item['question_text']] = len(nugget_list) - 1
+        nugget_list = rubric_to_nugget_list(items)
 
         with output_fn.open('w') as fw:
             json.dump({
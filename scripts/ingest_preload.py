@@ -0,0 +1,60 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from convert_rubric_to_preload import iter_rubric, rubric_to_nugget_list
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_manager import PreloadNuggetStore
+
+# Streams a (gzipped) rubric file straight into the `preload_nuggets` table of the task's annotation.db,
+# in one transaction, instead of writing one `nuggets_{query_id}.preload.json` per query.
+# `--from_files` moves the existing json files of the output directory into the table as well.
+
+
+def _iter_rubric_nuggets(input_fn: Path):
+    seen = set()
+    for query_id, items in iter_rubric(input_fn):
+        if query_id in seen:
+            print(f"[{query_id}] appears more than once in {input_fn}, only the first one is kept.")
+            continue
+        seen.add(query_id)
+        yield query_id, json.dumps({ "nugget_list": rubric_to_nugget_list(items) })
+
+
+def _iter_nugget_files(output_dir: Path, kind: str):
+    for fn in sorted(output_dir.glob(f"nuggets_*.{kind}.json")):
+        yield fn.stem.replace(f".{kind}", "").split("_", 1)[1], fn.read_text()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=Path, nargs='?', default=None, help="rubric jsonl(.gz) file")
+    parser.add_argument("output_dir", type=Path, help="output_dir of the task config, where annotation.db is")
+
+    parser.add_argument('--already_revised', action='store_true', default=False)
+    parser.add_argument('--overwrite', action='store_true', default=False, help="replace topics already in the table")
+    parser.add_argument('--storage_url', type=str, default=None, help="the storage_url of the task config, if it has one")
+    parser.add_argument('--from_files', action='store_true', default=False,
+                        help="also ingest the nuggets_*.preload.json and nuggets_*.revised.json files in output_dir")
+
+    args = parser.parse_args()
+    assert args.input is not None or args.from_files, "Nothing to ingest."
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    store = PreloadNuggetStore(args.storage_url or args.output_dir / "annotation.db")
+
+    start = time.perf_counter()
+    if args.input is not None:
+        kind = "revised" if args.already_revised else "preload"
+        n = store.ingest(_iter_rubric_nuggets(args.input), kind, overwrite=args.overwrite)
+        print(f"{args.input}: {n} topics written as {kind} nuggets.")
+
+    if args.from_files:
+        for kind in ['preload', 'revised']:
+            n = store.ingest(_iter_nugget_files(args.output_dir, kind), kind, overwrite=args.overwrite)
+            print(f"{args.output_dir}: {n} nuggets_*.{kind}.json files written.")
+
+    print(f"done in {time.perf_counter() - start:.1f}s")
@@ -1,98 +1,370 @@
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Set, Tuple
+from collections import Counter
+from datetime import datetime
+import tempfile
 import json
+import zlib
+import sys
+import os
 from pathlib import Path
 from tqdm import tqdm
 
 import pandas as pd
-import ir_measures as irms
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from resource_db import ResourceDBWriter
+
+# The resources are built in three passes with bounded memory:
+#   1. split: every run file is streamed (in parallel) into per-topic-shard record files;
+#   2. merge: every shard is loaded alone and turned into the per-topic json fragments;
+#   3. write: the fragments are concatenated in the order of first appearance of the topics,
+#      which gives exactly the files the old in-memory version of this script dumped.
+# With --append, the existing resources are split into the shards as well and the new runs and
+# qrels are applied on top of them. Nothing already in the resources is renumbered or removed,
+# so the annotations keyed by (topic, doc) and (topic, run, sentence) stay valid.
+
+_FRAGMENTS = ['report', 'cited', 'pool']
+
+
+def _shard_of(topic_id: str, num_shards: int):
+    return zlib.crc32(topic_id.encode()) % num_shards
+
+
+def _split_run(run_idx: int, fn: str, tmp_dir: Path, num_shards: int) -> Tuple[int, Dict[str, int]]:
+    # returns the topics of the run in the order of appearance
+    first_seen: Dict[str, int] = {}
+    writers = {}
+    try:
+        with open(fn) as fr:
+            for line_idx, line in enumerate(fr):
+                topic_run = json.loads(line)
+                request_id = topic_run['request_id']
+                first_seen.setdefault(request_id, line_idx)
+
+                shard = _shard_of(request_id, num_shards)
+                if shard not in writers:
+                    writers[shard] = (tmp_dir / f"shard-{shard}.run-{run_idx}.jsonl").open('w')
+                writers[shard].write(json.dumps([
+                    line_idx, request_id, [ [sent['text'], sent['citations']] for sent in topic_run['sentences'] ]
+                ]) + "\n")
+    finally:
+        for fw in writers.values():
+            fw.close()
+
+    return run_idx, first_seen
+
+
+def _split_existing(name: str, fn: str, tmp_dir: Path, num_shards: int) -> Tuple[str, List[str], Set[str]]:
+    # returns the topics of the resource in order and, for the reports, the run ids already in it
+    with open(fn) as fr:
+        data = json.load(fr)
+
+    writers = {}
+    try:
+        for request_id, value in data.items():
+            shard = _shard_of(request_id, num_shards)
+            if shard not in writers:
+                writers[shard] = (tmp_dir / f"shard-{shard}.existing-{name}.jsonl").open('w')
+            writers[shard].write(json.dumps([request_id, value]) + "\n")
+    finally:
+        for fw in writers.values():
+            fw.close()
+
+    run_ids = { run_id for runs in data.values() for run_id in runs } if name == 'report' else set()
+    return name, list(data.keys()), run_ids
+
+
+def _load_existing(shard: int, tmp_dir: Path, name: str) -> Dict:
+    fn = tmp_dir / f"shard-{shard}.existing-{name}.jsonl"
+    if not fn.exists():
+        return {}
+    with fn.open() as fr:
+        return dict( json.loads(line) for line in fr )
+
+
+def _merge_shard(shard: int, tmp_dir: Path, run_ids: List[str], rel_docs: List[Tuple[str, str, int]]):
+    # returns {topic_id: {fragment: (offset, length)}}, {(topic_id, doc_id): qrels index} of the docs added from qrels, 
+    # and {topic_id: changes} against the existing resources (empty if not appending)
+    reports, cited, pools = [ _load_existing(shard, tmp_dir, name) for name in _FRAGMENTS ]
+    existing_docs = { request_id: set(docs) for request_id, docs in cited.items() }
+
+    records = []
+    for fn in tmp_dir.glob(f"shard-{shard}.run-*.jsonl"):
+        run_idx = int(fn.stem.split(".run-")[1])
+        with fn.open() as fr:
+            records += [ (run_idx, *json.loads(line)) for line in fr ]
+    records.sort(key=lambda r: r[:2])
+
+    for run_idx, _, request_id, sentences in records:
+        run_id = run_ids[run_idx]
+        reports.setdefault(request_id, {})[run_id] = { i: text for i, (text, _) in enumerate(sentences) }
+
+        docs = cited.setdefault(request_id, {})
+        for i, (text, citations) in enumerate(sentences):
+            for doc_id in citations:
+                docs.setdefault(doc_id, {}).setdefault(run_id, {})[i] = text
+    del records
+
+    # anti-join of the (already joined and deduplicated) qrels of the shard against the cited documents
+    added = {}
+    for request_id, doc_id, qrels_idx in rel_docs:
+        if request_id in cited and doc_id not in cited[request_id]:
+            cited[request_id][doc_id] = {}
+            added[request_id, doc_id] = qrels_idx
+
+    changes, new_run_ids = {}, set(run_ids)
+    for request_id, docs in cited.items():
+        if request_id not in existing_docs:
+            continue
+        new_runs = [ run_id for run_id in reports[request_id] if run_id in new_run_ids ]
+        new_docs = [ doc_id for doc_id in docs if doc_id not in existing_docs[request_id] ]
+        cited_by_new_runs = [ 
+            doc_id for doc_id, runs in docs.items() 
+            if doc_id in existing_docs[request_id] and any(run_id in new_run_ids for run_id in runs)
+        ]
+        if len(new_runs) + len(new_docs) + len(cited_by_new_runs) > 0:
+            changes[request_id] = {'new_runs': new_runs, 'new_docs': new_docs, 'docs_with_new_citations': cited_by_new_runs}
+
+        if request_id in pools: # existing pool, e.g., edited after it was constructed, is kept as is
+            pools[request_id] = pools[request_id] + [ doc_id for doc_id in new_docs if doc_id not in pools[request_id] ]
+
+    index, offset = {}, 0
+    with (tmp_dir / f"shard-{shard}.fragments").open('wb') as fw:
+        for request_id in reports:
+            index[request_id] = {}
+            pool = pools.get(request_id, list(cited[request_id].keys()))
+            for name, value in zip(_FRAGMENTS, [reports[request_id], cited[request_id], pool]):
+                fragment = json.dumps(value).encode()
+                index[request_id][name] = (offset, len(fragment))
+                fw.write(fragment)
+                offset += len(fragment)
+
+    return shard, index, added, changes
+
+
+def _load_rel_docs(fns: List[str], rel_threshold: float = None) -> pd.DataFrame:
+    """
+    All qrels files as one frame of (query_id, doc_id, qrels_idx), keeping the first file (and line) 
+    that judges a document relevant -- the order in which the documents are added to the topics.
+    Without a threshold, only the documents judged 0 are left out. 
+    """
+    if len(fns) == 0:
+        return pd.DataFrame(columns=['query_id', 'doc_id', 'qrels_idx'])
+
+    qrels = pd.concat([
+        pd.read_csv(
+            fn, sep=r'\s+', header=None, names=['query_id', 'iteration', 'doc_id', 'relevance'],
+            dtype={'query_id': str, 'iteration': str, 'doc_id': str, 'relevance': int}
+        ).assign(qrels_idx=qrels_idx)
+        for qrels_idx, fn in enumerate(fns)
+    ], ignore_index=True)
+    qrels = qrels[qrels.relevance != 0] if rel_threshold is None else qrels[qrels.relevance >= rel_threshold]
+    return qrels.drop_duplicates(['query_id', 'doc_id'])[['query_id', 'doc_id', 'qrels_idx']]
+
+
+def _shard_rel_docs(qrels: pd.DataFrame, num_shards: int) -> List[List[Tuple[str, str, int]]]:
+    # each merge worker only gets the qrels of its own topics
+    shards = qrels.query_id.map({ query_id: _shard_of(query_id, num_shards) for query_id in qrels.query_id.unique() })
+    by_shard = [ [] for _ in range(num_shards) ]
+    for shard, group in qrels.groupby(shards, sort=False):
+        by_shard[shard] = [ (query_id, doc_id, int(qrels_idx)) for query_id, doc_id, qrels_idx in group.itertuples(index=False, name=None) ]
+    return by_shard
+
+
+class _Fragments:
+    # random access to the per-topic json fragments of all shards
+
+    def __init__(self, tmp_dir: Path):
+        self.index: Dict[str, Tuple[int, Dict[str, Tuple[int, int]]]] = {}
+        self.files = {}
+        self.tmp_dir = tmp_dir
+
+    def add(self, shard: int, index: Dict[str, Dict[str, Tuple[int, int]]]):
+        for request_id, offsets in index.items():
+            self.index[request_id] = (shard, offsets)
+
+    def get(self, request_id: str, name: str) -> str:
+        shard, offsets = self.index[request_id]
+        if shard not in self.files:
+            self.files[shard] = (self.tmp_dir / f"shard-{shard}.fragments").open('rb')
+        offset, length = offsets[name]
+        fr = self.files[shard]
+        fr.seek(offset)
+        return fr.read(length).decode()
+
+    def write_json(self, fn: Path, topics: List[str], name: str):
+        # same bytes as `json.dump` of the whole dict
+        with fn.open('w') as fw:
+            fw.write("{")
+            for i, request_id in enumerate(topics):
+                fw.write(f"{', ' if i > 0 else ''}{json.dumps(request_id)}: {self.get(request_id, name)}")
+            fw.write("}")
+
+    def close(self):
+        for fr in self.files.values():
+            fr.close()
+
+
+def _map(pool: ProcessPoolExecutor, fn, *iterables, desc: str = None):
+    # in this process if there is no pool
+    results = map(fn, *iterables) if pool is None else pool.map(fn, *iterables)
+    return tqdm(results, desc=desc, total=len(iterables[0]))
+
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--name', type=str, required=True)
-    parser.add_argument('--input_reports', type=str, nargs='+', required=True)
+    parser.add_argument('--input_reports', type=str, nargs='*', default=[])
     parser.add_argument('--output_dir', type=str, default='./resources')
 
     parser.add_argument('--qrels', nargs='+', type=str, default=[])
 
     parser.add_argument('--add_rel_docs', action='store_true', default=False)
+    parser.add_argument('--rel_threshold', type=float, default=None, 
+                        help="minimum relevance of the qrels documents to add; by default everything not judged 0")
+    parser.add_argument('--qrels_tags', nargs='+', type=str, default=None, 
+                        help="provenance tag of each qrels file, recorded for the documents it adds; defaults to the file names")
     parser.add_argument('--construct_doc_pool', action='store_true', default=False)
+    parser.add_argument('--compile_db', action='store_true', default=False,
+                        help="also write the resources as a compiled, topic-indexed {name}.resources.db")
+    parser.add_argument('--append', action='store_true', default=False, 
+                        help="add the reports and qrels to the existing resources of the same name; runs already in them are skipped")
+
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help="0 to run everything in this process")
+    parser.add_argument('--num_shards', type=int, default=64, help="more shards for less memory per merge")
+    parser.add_argument('--tmp_dir', type=str, default=None, help="for the intermediate files; defaults to output_dir")
 
     args = parser.parse_args()
+    assert args.append or len(args.input_reports) > 0, "Need --input_reports."
 
     print(f"Got {len(args.input_reports)} reports.")
 
-    all_runs = {
-        (f.stem if f.suffix == ".jsonl" else f.name): [ json.loads(l) for l in f.open() ]
+    runs = {
+        (f.stem if f.suffix == ".jsonl" else f.name): str(f)
         for f in map(Path, args.input_reports)
     }
 
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    assert not (output_dir / f"{args.name}.citation-to-sentences.json").exists()
-    assert not (output_dir / f"{args.name}.report-sentences.json").exists()
-
-    if args.construct_doc_pool:
-        assert not (output_dir / f"{args.name}.document_pool.json").exists()
-
-    data = {}
-    for run_id, run in all_runs.items():
-        for topic_run in run:
-            request_id = topic_run['request_id']
-
-            if request_id not in data:
-                data[ request_id ] = {}
-            
-            data[ request_id ][ run_id ] = {
-                i: s['text'] for i, s in enumerate(topic_run['sentences'])
-            }
-
-    with (output_dir / f"{args.name}.report-sentences.json").open('w') as fw:
-        json.dump(data, fw)
-    
-    data = {}
-    for run_id, run in all_runs.items():
-        for topic_run in run:
-            request_id = topic_run['request_id']
-
-            if request_id not in data:
-                data[ request_id ] = {}
-            
-            for i, sent in enumerate(topic_run['sentences']):
-                for doc_id in sent['citations']:
-                    if doc_id not in data[ request_id ]:
-                        data[ request_id ][ doc_id ] = {}
-
-                    if run_id not in data[ request_id ][ doc_id ]:
-                        data[ request_id ][ doc_id ][ run_id ] = {}
-                    
-                    data[ request_id ][ doc_id ][ run_id ][ i ] = sent['text']
-    
-    if args.add_rel_docs:
-        for fn in args.qrels:
-            qrel = pd.DataFrame(irms.read_trec_qrels(fn)).set_index(['query_id', 'relevance']).doc_id
-            if 0 in qrel.index.get_level_values('relevance').unique():
-                qrel = qrel.drop(0, level='relevance')
-
-            
-            for request_id in data:
-                counter = 0
-                if request_id not in qrel.index:
-                    continue
-                for doc_id in qrel.loc[request_id]:
-                    if doc_id not in data[request_id]:
-                        data[request_id][doc_id] = {}
-                        counter += 1
-
-                if counter > 0:
-                    print(f"[{request_id}] {fn} adds {counter} additional rel docs.")
-
-    with (output_dir / f"{args.name}.citation-to-sentences.json").open('w') as fw:
-        json.dump(data, fw)
-
-    if args.construct_doc_pool:
-        with (output_dir / f"{args.name}.document_pool.json").open('w') as fw:
-            json.dump({
-                topic_id: list(d.keys())
-                for topic_id, d in data.items()
-            }, fw)
\ No newline at end of file
+    output_fns = {
+        'report': output_dir / f"{args.name}.report-sentences.json",
+        'cited': output_dir / f"{args.name}.citation-to-sentences.json",
+        'pool': output_dir / f"{args.name}.document_pool.json"
+    }
+    db_fn = output_dir / f"{args.name}.resources.db"
+
+    if args.append:
+        assert output_fns['report'].exists() and output_fns['cited'].exists(), f"Nothing to append to for {args.name}."
+        # keep the doc pool and the compiled file in sync if they were made before
+        args.construct_doc_pool = args.construct_doc_pool or output_fns['pool'].exists()
+        args.compile_db = args.compile_db or db_fn.exists()
+    else:
+        assert not output_fns['cited'].exists(), f"{output_fns['cited']} exists, use --append to add to it."
+        assert not output_fns['report'].exists(), f"{output_fns['report']} exists, use --append to add to it."
+
+        if args.construct_doc_pool:
+            assert not output_fns['pool'].exists()
+
+        if args.compile_db:
+            assert not db_fn.exists()
+
+    qrels_fns = args.qrels if args.add_rel_docs else []
+    qrels_tags = args.qrels_tags or [ Path(fn).name for fn in qrels_fns ]
+    assert len(qrels_tags) == len(qrels_fns), "Need one --qrels_tags per qrels file."
+    rel_docs = _shard_rel_docs(_load_rel_docs(qrels_fns, args.rel_threshold), args.num_shards)
+
+    provenance_fn = output_dir / f"{args.name}.rel-doc-provenance.json"
+
+    pool = ProcessPoolExecutor(args.num_workers) if args.num_workers > 0 else None
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir or output_dir) as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+
+        topics: Dict[str, None] = {}
+        if args.append:
+            existing = [ name for name in _FRAGMENTS if output_fns[name].exists() ]
+            for name, existing_topics, existing_runs in _map(
+                    pool, _split_existing, existing, [ str(output_fns[name]) for name in existing ], 
+                    [tmp_dir]*len(existing), [args.num_shards]*len(existing), desc="split existing resources"
+                ):
+                if name == 'report':
+                    topics.update(dict.fromkeys(existing_topics))
+                    existing_topics = set(existing_topics)
+                    for run_id in existing_runs & runs.keys():
+                        print(f"{run_id} is already in {output_fns['report'].name}, skipped.")
+                        del runs[run_id]
+
+        run_ids, run_fns = list(runs.keys()), list(runs.values())
+        for _, first_seen in _map(
+                pool, _split_run, range(len(run_ids)), run_fns,
+                [tmp_dir]*len(run_ids), [args.num_shards]*len(run_ids), desc="split runs"
+            ):
+            topics.update(dict.fromkeys(first_seen)) # results come in the order of the runs
+        topics = list(topics)
+
+        fragments = _Fragments(tmp_dir)
+        added, changes = {}, {}
+        for shard, index, shard_added, shard_changes in _map(
+                pool, _merge_shard, range(args.num_shards), [tmp_dir]*args.num_shards,
+                [run_ids]*args.num_shards, rel_docs, desc="merge shards"
+            ):
+            fragments.add(shard, index)
+            added.update(shard_added)
+            changes.update(shard_changes)
+
+        if pool is not None:
+            pool.shutdown()
+
+        n_added = Counter( (qrels_idx, request_id) for (request_id, _), qrels_idx in added.items() )
+        for qrels_idx, fn in enumerate(qrels_fns):
+            for request_id in topics:
+                if n_added[qrels_idx, request_id] > 0:
+                    print(f"[{request_id}] {fn} adds {n_added[qrels_idx, request_id]} additional rel docs.")
+
+        # topic_id -> doc_id -> tag of the qrels file that added the document
+        provenance = json.loads(provenance_fn.read_text()) if args.append and provenance_fn.exists() else {}
+        for (request_id, doc_id), qrels_idx in added.items():
+            provenance.setdefault(request_id, {})[doc_id] = qrels_tags[qrels_idx]
+
+        # written next to the destination and moved into place, so the app never reads a partial file
+        tmp_fns = { name: fn.with_name(f".{fn.name}.tmp") for name, fn in output_fns.items() }
+        fragments.write_json(tmp_fns['report'], topics, 'report')
+        fragments.write_json(tmp_fns['cited'], topics, 'cited')
+        if args.construct_doc_pool:
+            fragments.write_json(tmp_fns['pool'], topics, 'pool')
+
+        if args.compile_db:
+            writer = ResourceDBWriter(db_fn)
+            for request_id in tqdm(topics, desc="compile db"):
+                if args.construct_doc_pool:
+                    writer.add_doc_pool(request_id, json.loads(fragments.get(request_id, 'pool')))
+                writer.add_cited_sentences(request_id, json.loads(fragments.get(request_id, 'cited')))
+                writer.add_report_runs(request_id, json.loads(fragments.get(request_id, 'report')))
+            writer.close()
+
+        fragments.close()
+
+        for name, tmp_fn in tmp_fns.items():
+            if tmp_fn.exists():
+                os.replace(tmp_fn, output_fns[name])
+
+        if len(provenance) > 0:
+            with provenance_fn.open('w') as fw:
+                json.dump({ request_id: provenance[request_id] for request_id in topics if request_id in provenance }, fw)
+
+    if args.append:
+        new_topics = [ request_id for request_id in topics if request_id not in existing_topics ]
+        changes = { request_id: changes[request_id] for request_id in topics if request_id in changes }
+        for request_id, change in changes.items():
+            print(
+                f"[{request_id}] {len(change['new_runs'])} new runs, {len(change['new_docs'])} new docs, "
+                f"{len(change['docs_with_new_citations'])} existing docs with new citing sentences."
+            )
+        print(f"{len(new_topics)} new topics, {len(changes)} existing topics changed.")
+
+        changes_fn = output_dir / f"{args.name}.changes.{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        with changes_fn.open('w') as fw:
+            json.dump({'runs': run_ids, 'qrels': qrels_fns, 'new_topics': new_topics, 'changed_topics': changes}, fw, indent=2)
+        print(f"Changes are listed in {changes_fn}")
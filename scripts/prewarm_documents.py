@@ -0,0 +1,111 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Tuple
+import json
+import os
+import sys
+import time
+
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from doc_cache import DocumentStore
+from resource_db import ResourceDB, is_resource_db
+
+
+def collect_doc_ids(config_fns: List[Path]) -> Dict[Tuple[str, str], List[str]]:
+    # (service, collection_id) -> [doc_id, ...] in the order of appearance
+    collections: Dict[Tuple[str, str], Dict[str, None]] = {}
+    for fn in config_fns:
+        config = json.loads(fn.read_text())
+        key = (config.get('doc_service', 'ir_datasets'), config['collection_id'])
+        doc_ids = collections.setdefault(key, {})
+
+        for field, kind in [('doc_pools_path', 'doc_pools'), ('cited_sentences_path', 'cited_sentences')]:
+            if config.get(field, None) is None:
+                continue
+            if is_resource_db(config[field]):
+                resource = ResourceDB(config[field]).iter_all(kind)
+            else:
+                resource = json.loads(Path(config[field]).read_text()).items()
+            for _, docs in resource:
+                doc_ids.update(dict.fromkeys(docs))
+
+        print(f"{fn}: {config['name']} -> {key[0]} {key[1]}")
+
+    return { key: list(doc_ids) for key, doc_ids in collections.items() }
+
+
+def _fetch(service: str, collection_id: str, doc_ids: List[str]):
+    # runs in the worker processes
+    from data_manager import _fetch_doc_contents
+    return doc_ids, _fetch_doc_contents(service, collection_id, doc_ids)
+
+
+def prewarm(store: DocumentStore, service: str, collection_id: str, doc_ids: List[str], pool: ProcessPoolExecutor, chunk_size: int):
+    todo = sorted(set(doc_ids) - store.existing_ids(service, collection_id, doc_ids))
+    n_found = n_missing = 0
+
+    start = time.perf_counter()
+    with tqdm(total=len(doc_ids), initial=len(doc_ids) - len(todo), desc=f"{service} {collection_id}", unit="doc") as pbar:
+        futures = [
+            pool.submit(_fetch, service, collection_id, todo[i: i+chunk_size])
+            for i in range(0, len(todo), chunk_size)
+        ]
+        for future in as_completed(futures):
+            requested, docs = future.result()
+            store.put_many(service, collection_id, docs)
+
+            n_found += len(docs)
+            n_missing += len(requested) - len(docs)
+            pbar.update(len(requested))
+            pbar.set_postfix(missing=n_missing)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"[{service} {collection_id}] {len(doc_ids)} docs, {len(doc_ids) - len(todo)} already stored, "
+        f"fetched {n_found} in {elapsed:.1f}s ({n_found / max(elapsed, 1e-6):.1f} docs/s), {n_missing} not found."
+    )
+
+
+def verify(store: DocumentStore, service: str, collection_id: str, doc_ids: List[str]):
+    stored = store.get_many(service, collection_id, doc_ids)
+    missing = [ doc_id for doc_id in doc_ids if doc_id not in stored ]
+    empty = [ doc_id for doc_id, doc in stored.items() if doc['text'] is None or doc['text'].strip() == "" ]
+
+    print(f"[{service} {collection_id}] verified {len(doc_ids)} docs: {len(missing)} missing, {len(empty)} empty.")
+    for doc_id in (missing + empty)[:10]:
+        print(f"    {doc_id}")
+
+    return len(missing) == 0 and len(empty) == 0
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Fetch every pooled and cited document of the task configs into the persistent document store.")
+    parser.add_argument('configs', type=Path, nargs='+', help="task config json files or directories of them")
+    parser.add_argument('--store_path', type=str, default=os.environ.get('RAG_DOC_STORE_PATH', None),
+                        help="defaults to RAG_DOC_STORE_PATH; the app reads from the same path")
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk_size', type=int, default=256)
+    parser.add_argument('--verify_only', action='store_true', default=False)
+    parser.add_argument('--no_verify', action='store_true', default=False)
+
+    args = parser.parse_args()
+    assert args.store_path is not None, "Need --store_path or RAG_DOC_STORE_PATH."
+
+    config_fns = [ fn for path in args.configs for fn in (sorted(path.glob("*.json")) if path.is_dir() else [path]) ]
+    collections = collect_doc_ids(config_fns)
+    store = DocumentStore(args.store_path)
+
+    if not args.verify_only:
+        with ProcessPoolExecutor(args.num_workers) as pool:
+            for (service, collection_id), doc_ids in collections.items():
+                prewarm(store, service, collection_id, doc_ids, pool, args.chunk_size)
+
+    if not args.no_verify:
+        all_good = all([
+            verify(store, service, collection_id, doc_ids)
+            for (service, collection_id), doc_ids in collections.items()
+        ])
+        sys.exit(0 if all_good else 1)
@@ -1,6 +1,5 @@
 from typing import Callable, Dict
 import streamlit as st
-import pandas as pd
 from pathlib import Path
 
 from page_utils import stpage, draw_bread_crumb, toggle_button, get_auth_manager, random_key, AuthManager
@@ -8,6 +7,7 @@ from page_utils import stpage, draw_bread_crumb, toggle_button, get_auth_manager
 from task_resources import TaskConfig
 from data_manager import NuggetSaverManager, AnnotationManager, get_manager, get_doc_content
 from nugget_editor import draw_nugget_editor
+from doc_viewer import draw_document
 
 
 @st.dialog("Full Report", width="large")
@@ -22,6 +22,8 @@ def show_full_report(run_dict: Dict[str, str], highlight_sent_id: str):
 @stpage(name='citation_assessment', require_login=True)
 @st.fragment
 def citation_assessment_page(auth_manager: AuthManager):
+    import pandas as pd # already loaded by the annotation managers
+
     if 'topic' not in st.query_params:
         st.query_params.clear()
 
@@ -44,6 +46,17 @@ def citation_assessment_page(auth_manager: AuthManager):
         st.toast(f'Topic {current_topic} is done.', icon=':material/thumb_up:')
         n_done = len(sorted_doc_list)
 
+    def _next_pending(idx):
+        # a document is done once both managers are done with it -- the nearer of their next pending ones
+        candidates = [ 
+            manager.next_pending(current_topic, 'doc_id', sorted_doc_list, idx) 
+            for manager in [citation_assessment_manager, relevance_assessment_manager] 
+        ]
+        return min(
+            ( c for c in candidates if c is not None ), 
+            key=lambda c: (c - idx - 1) % len(sorted_doc_list), default=None
+        )
+
     current_doc_offset = draw_bread_crumb(
         crumbs=[
             st.query_params.task, "Sentence and Nugget Support Assessment", 
@@ -53,8 +66,8 @@ def citation_assessment_page(auth_manager: AuthManager):
         n_jobs=len(sorted_doc_list), 
         n_done=n_done,
         key=f'{task_config.name}/citation/{current_topic}/current_doc_offset',
-        check_done=lambda idx: citation_assessment_manager.is_all_done(current_topic, sorted_doc_list[idx]) \
-                               and relevance_assessment_manager.is_all_done(current_topic, sorted_doc_list[idx])
+        next_pending=_next_pending,
+        cursor_store=get_manager(task_config, auth_manager.current_user, 'cursor_store')
     )
 
     
@@ -69,10 +82,10 @@ def citation_assessment_page(auth_manager: AuthManager):
 
     with doc_col.container(height=615):
         doc_content = get_doc_content(task_config.doc_service, task_config.collection_id, doc_id)
-        if doc_content['title'] != "":
-            st.write(f"**{doc_content['title']}**")
-        st.caption(f"Doc ID: {doc_id}")
-        st.write(doc_content['text'])
+        draw_document(
+            doc_content, doc_id, task_config.doc_service, task_config.collection_id,
+            key=f'{task_config.name}/citation/{current_topic}/doc_viewer'
+        )
         
     current_content_iter = citation_assessment_manager[current_topic, doc_id]
 
@@ -173,6 +186,7 @@ def citation_assessment_page(auth_manager: AuthManager):
             on_unselect_nugget_answer=_on_unselect_nugget_answer,
             on_assign_group=_on_assign_group,
             on_rename_group=_on_rename_group,
+            rerun_page_on=lambda: nugget_set.doc_has_nugget(doc_id), # the no nugget checkbox above
             allow_nugget_question_creation=False,
             allow_nugget_group_edit=False
         )
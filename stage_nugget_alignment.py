@@ -1,15 +1,26 @@
+from typing import Tuple
 import streamlit as st
-import pandas as pd
 from pathlib import Path
 import json
 
 from page_utils import stpage, draw_bread_crumb, stable_hash, get_auth_manager, AuthManager
 
 from task_resources import TaskConfig
-from data_manager import NuggetSelection, AnnotationManager, session_set_default, get_manager, get_nugget_loader
+from data_manager import NuggetSelection, NuggetLoader, AnnotationManager, session_set_default, get_manager, get_nugget_loader
 from nugget_editor import draw_nugget_editor
 
 
+@st.cache_resource(max_entries=64)
+def get_selection_template(topic_id: str, nugget_version: str, additional_options: Tuple[str], _nugget_loader: NuggetLoader):
+    # nuggets of the topic plus the *Other* options, shared by all sessions and sentences -- do not modify
+    template = _nugget_loader.get(topic_id)
+    for _, a_dict in template.nugget_list:
+        a_dict.setdefault("*Other answer*", set()).add("_")
+
+    template.add("*Other Options*", [ ("_", f"*{o}*") for o in additional_options ])
+    return template
+
+
 @stpage(name="nugget_alignment", require_login=True)
 @st.fragment
 def nugget_alignment_page(auth_manager: AuthManager):
@@ -34,7 +45,8 @@ def nugget_alignment_page(auth_manager: AuthManager):
         n_jobs=len(sorted_report_list), 
         n_done=nugget_alignment_manager.count_done(current_topic, level='run_id'),
         key=f'{task_config.name}/report/{current_topic}/current_report_offset',
-        check_done=lambda idx: nugget_alignment_manager.is_all_done(current_topic, sorted_report_list[idx])
+        next_pending=lambda idx: nugget_alignment_manager.next_pending(current_topic, 'run_id', sorted_report_list, idx),
+        cursor_store=get_manager(task_config, auth_manager.current_user, 'cursor_store')
     )
 
     run_id = sorted_report_list[run_id_offset]
@@ -113,21 +125,18 @@ def nugget_alignment_page(auth_manager: AuthManager):
         
         active_sent_id = st.session_state[f'active_sent/{current_topic}/{run_id}'] 
 
-        nuggets_for_selection = nugget_loader[current_topic].clone()
-        for q in nuggets_for_selection.get_all_questions():
-            nuggets_for_selection.add(q, [("_", "*Other answer*")])
-
-        nuggets_for_selection.add("*Other Options*", [
-            ("_", f"*{o}*")
-            for o in task_config.additional_nugget_options
-        ])
-
-        # add selected nuggets
-        for q, a in nugget_alignment_manager[current_topic, run_id, active_sent_id]['nugget']:
-            nuggets_for_selection.add(q, [(active_sent_id, a)])
+        def _nuggets_for_selection():
+            # rebuilt on every rerun of the editor, since the selection lives in the annotation manager
+            template = get_selection_template(
+                current_topic, nugget_loader.version(current_topic), 
+                tuple(task_config.additional_nugget_options), nugget_loader
+            )
+            return template.with_selections(
+                active_sent_id, nugget_alignment_manager[current_topic, run_id, active_sent_id]['nugget']
+            )
 
         draw_nugget_editor(
-            nuggets_for_selection,
+            _nuggets_for_selection,
             # title="Nugget Selection For The Active Sentence",
             current_doc_id=active_sent_id,
             show_counts=False,
@@ -138,6 +147,7 @@ def nugget_alignment_page(auth_manager: AuthManager):
             allow_nugget_group_edit=False,
             allow_nugget_question_edit=False,
             on_select_nugget_answer=_on_nugget_select,
-            on_unselect_nugget_answer=_on_nugget_unselect
+            on_unselect_nugget_answer=_on_nugget_unselect,
+            rerun_page_on=lambda: nugget_alignment_manager.is_all_done(current_topic, run_id, active_sent_id) # the sentence icons
         )
 
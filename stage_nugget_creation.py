@@ -1,6 +1,5 @@
 from typing import Callable, Dict
 import streamlit as st
-import pandas as pd
 from pathlib import Path
 
 from page_utils import stpage, draw_bread_crumb, toggle_button, get_auth_manager, random_key, AuthManager
@@ -9,11 +8,14 @@ from task_resources import TaskConfig
 from data_manager import NuggetSaverManager, NuggetSet, AnnotationManager, \
                          get_manager, get_doc_content
 from nugget_editor import draw_nugget_editor
+from doc_viewer import draw_document
 
 
 @stpage(name='nugget_creation', require_login=True)
 @st.fragment()
 def nugget_creation_page(auth_manager: AuthManager):
+    import pandas as pd # already loaded by the annotation managers
+
     if 'topic' not in st.query_params:
         st.query_params.clear()
 
@@ -39,7 +41,8 @@ def nugget_creation_page(auth_manager: AuthManager):
         n_jobs=len(sorted_doc_list), 
         n_done=relevance_assessment_manager.count_done(current_topic, level='doc_id'),
         key=f'{task_config.name}/nugget_creation/{current_topic}/current_doc_offset',
-        check_done=lambda idx: relevance_assessment_manager.is_all_done(current_topic, sorted_doc_list[idx])
+        next_pending=lambda idx: relevance_assessment_manager.next_pending(current_topic, 'doc_id', sorted_doc_list, idx),
+        cursor_store=get_manager(task_config, auth_manager.current_user, 'cursor_store')
     )
 
 
@@ -57,10 +60,10 @@ def nugget_creation_page(auth_manager: AuthManager):
 
     with doc_col.container(height=620):
         doc_content = get_doc_content(task_config.doc_service, task_config.collection_id, doc_id)
-        if doc_content['title'] != "":
-            st.write(f"**{doc_content['title']}**")
-        st.caption(f"Doc ID: {doc_id}")
-        st.write(doc_content['text'])
+        draw_document(
+            doc_content, doc_id, task_config.doc_service, task_config.collection_id,
+            key=f'{task_config.name}/nugget_creation/{current_topic}/doc_viewer'
+        )
     
     def _on_select_nugget_answer(doc_id, question, answers):
         nugget_set.add(question, [ (doc_id, answer) for answer in answers ])
@@ -114,7 +117,8 @@ def nugget_creation_page(auth_manager: AuthManager):
             on_select_nugget_answer=_on_select_nugget_answer,
             on_unselect_nugget_answer=_on_unselect_nugget_answer,
             on_assign_group=_on_assign_group,
-            on_rename_group=_on_rename_group
+            on_rename_group=_on_rename_group,
+            rerun_page_on=lambda: nugget_set.doc_has_nugget(doc_id) # the no nugget checkbox above
         )
 
 
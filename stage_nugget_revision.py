@@ -1,6 +1,5 @@
 from typing import Literal
 import streamlit as st
-import pandas as pd
 from pathlib import Path
 
 from page_utils import stpage, draw_bread_crumb, toggle_button, get_auth_manager, random_key, AuthManager
@@ -119,6 +118,8 @@ def nugget_revision_page(auth_manager: AuthManager):
     )
 
     source_col, editor_col = st.columns(column_ratio)
+    # combined topics can have hundreds of questions -- only draw one page of each editor
+    editor_page_size = 25
 
     source_nugget_set = nugget_loader.get(current_topic, source=st.session_state[f"{key_prefix}/source"])
 
@@ -127,6 +128,7 @@ def nugget_revision_page(auth_manager: AuthManager):
             source_nugget_set,
             current_doc_id="_post_hoc_edit_",
             key_prefix=f'{key_prefix}/source_nugget_viewer',
+            page_size=editor_page_size,
             highlight_group_name=False,
             allow_nugget_answer_selection=False,
             allow_nugget_answer_creation=False,
@@ -199,6 +201,7 @@ def nugget_revision_page(auth_manager: AuthManager):
             edit_nuget_set, 
             current_doc_id="_post_hoc_edit_",
             key_prefix=f'{key_prefix}/nugget_editor',
+            page_size=editor_page_size,
             allow_nugget_answer_selection=True,
             allow_nugget_answer_creation=False,
             allow_nugget_question_creation=False,
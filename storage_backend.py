@@ -0,0 +1,381 @@
+from typing import Callable, Deque, Dict, Iterable, List, Sequence, Tuple, TYPE_CHECKING
+from collections import Counter, deque
+from urllib.parse import urlsplit
+from pathlib import Path
+import http.client
+import threading
+import sqlite3
+import random
+import fcntl
+import uuid
+import json
+import time
+import os
+
+from metrics import register_gauges
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Where the tables of the managers (annotations, nuggets, logs, users) live. `SqliteManager` runs its
+# statements through a backend instead of a sqlite3 connection, so the tables can be a local sqlite
+# file (the default) or sit on a networked SQL server shared by several annotation hosts.
+# Both backends take the SQLite dialect the managers are written in.
+
+
+class StorageError(RuntimeError):
+    """The store could not run a statement, e.g., it is locked or cannot be reached."""
+
+    def __init__(self, message: str, transient: bool = False):
+        super().__init__(message)
+        # worth trying again, e.g., a lock held by another writer or a store that is briefly unreachable
+        self.transient = transient
+
+
+def _sqlite_error(e: sqlite3.OperationalError):
+    return StorageError(str(e), transient=any( w in str(e) for w in ["locked", "busy"] ))
+
+
+class StorageBackend:
+
+    def query(self, query: str, args: Sequence = None) -> Tuple[List[str], List[Tuple]]:
+        """Column names and rows of a select."""
+        raise NotImplementedError
+
+    def execute(self, query: str, args: Sequence = None) -> int:
+        """Runs one statement that writes; returns the number of rows changed."""
+        raise NotImplementedError
+
+    def executemany(self, query: str, seq_of_args: Iterable[Sequence]) -> int:
+        """Runs the statement for each args in one transaction; returns the number of rows changed."""
+        raise NotImplementedError
+
+    def read_frame(self, query: str, args: Sequence = None) -> "pd.DataFrame":
+        import pandas as pd
+        columns, rows = self.query(query, args)
+        return pd.DataFrame(rows, columns=columns)
+
+
+class SqliteBackend(StorageBackend):
+
+    def __init__(self, db_path: str, persistent_connection: bool = True, busy_timeout: float = 1.0):
+        self.db_path = str(db_path)
+        self.persistent_connection = persistent_connection
+        # how long one attempt waits for a lock held by another writer, `WriteSpool` tries again after that
+        self.busy_timeout = busy_timeout
+
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self.persistent_connection:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+            return self._conn
+        return sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+
+    def _release(self, conn: sqlite3.Connection):
+        if not self.persistent_connection:
+            conn.close()
+
+    def query(self, query: str, args: Sequence = None):
+        conn = self.conn
+        try:
+            cursor = conn.execute(query, args or ())
+            return [ d[0] for d in cursor.description or [] ], cursor.fetchall()
+        except sqlite3.OperationalError as e:
+            raise _sqlite_error(e) from e
+        finally:
+            self._release(conn)
+
+    def execute(self, query: str, args: Sequence = None):
+        conn = self.conn
+        try:
+            cursor = conn.execute(query, args or ())
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.OperationalError as e:
+            raise _sqlite_error(e) from e
+        finally:
+            self._release(conn)
+
+    def executemany(self, query: str, seq_of_args: Iterable[Sequence]):
+        conn = self.conn
+        try:
+            with conn:
+                return conn.executemany(query, seq_of_args).rowcount
+        except sqlite3.OperationalError as e:
+            raise _sqlite_error(e) from e
+        finally:
+            self._release(conn)
+
+
+class RqliteBackend(StorageBackend):
+    """
+    Tables on an rqlite node (a networked SQLite, https://rqlite.io) through its HTTP API, e.g.,
+    `http://db-host:4001`. `python -m benchmarks.sql_stand_in` serves the same API from a local file.
+    Each thread keeps its own keep-alive connection.
+    """
+
+    def __init__(self, url: str, timeout: float = 10.0, consistency: str = "weak"):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.consistency = consistency
+
+        parts = urlsplit(self.url)
+        self._connection_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = self._connection_cls(self._netloc, timeout=self.timeout)
+        return self._local.conn
+
+    def _request(self, path: str, statements: List[List]) -> List[Dict]:
+        body = json.dumps(statements)
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                payload = resp.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # the server may have closed the kept-alive connection, try once on a new one
+                conn.close()
+                self._local.conn = None
+                if attempt == 1:
+                    raise StorageError(f"{self.url}: {e}", transient=True) from e
+
+        if resp.status != 200:
+            raise StorageError(f"{self.url}{path}: HTTP {resp.status} {payload[:200]!r}", transient=resp.status >= 500)
+
+        results = json.loads(payload).get('results', [])
+        for result in results:
+            if 'error' in result:
+                raise StorageError(result['error'], transient=any( w in result['error'] for w in ["locked", "busy"] ))
+        return results
+
+    def query(self, query: str, args: Sequence = None):
+        result = self._request(f"/db/query?level={self.consistency}", [[query, *(args or ())]])[0]
+        return result.get('columns', []), [ tuple(row) for row in result.get('values', []) ]
+
+    def execute(self, query: str, args: Sequence = None):
+        return self._request("/db/execute", [[query, *(args or ())]])[0].get('rows_affected', 0)
+
+    def executemany(self, query: str, seq_of_args: Iterable[Sequence]):
+        statements = [ [query, *args] for args in seq_of_args ]
+        if len(statements) == 0:
+            return 0
+        return sum( r.get('rows_affected', 0) for r in self._request("/db/execute?transaction", statements) )
+
+
+def is_remote(location: str) -> bool:
+    return str(location).startswith(("http://", "https://"))
+
+
+_remote_backends: Dict[str, RqliteBackend] = {}
+_remote_lock = threading.Lock()
+
+def get_backend(location: str, persistent_connection: bool = True) -> StorageBackend:
+    # `location` is either the url of a networked store, shared by every manager of the process, or a sqlite file
+    location = str(location)
+    if is_remote(location):
+        with _remote_lock:
+            if location not in _remote_backends:
+                _remote_backends[location] = RqliteBackend(location)
+            return _remote_backends[location]
+    return SqliteBackend(location, persistent_connection)
+
+
+class WriteSpool:
+    """
+    Writes that keep failing with transient errors are retried with jittered exponential backoff for up to 
+    `deadline` seconds, then appended to a per-process spool file (fsync'd) and replayed in order by a 
+    background thread. While a location has writes in the spool, its new writes queue behind them. 
+    Each process holds a lock on its own spool file for as long as it runs; spool files whose lock can be 
+    taken -- their process is gone, e.g., before the container restarted -- are taken over at start. 
+    A write can be applied twice if the process dies right after replaying it, which the tables tolerate -- 
+    annotations are appended with a timestamp and nuggets are replaced. 
+    """
+
+    def __init__(
+            self, spool_dir: str, 
+            deadline: float = 5.0, base_backoff: float = 0.05, max_backoff: float = 1.0, 
+            replay_interval: float = 1.0
+        ):
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        # not the pid alone: the server is pid 1 again after a container restart, in every container
+        self.spool_id = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self.spool_fn = self.spool_dir / f"spool.{self.spool_id}.jsonl"
+        self.deadline = deadline
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.replay_interval = replay_interval
+
+        self.stats = {'writes': 0, 'retries': 0, 'read_retries': 0, 'spooled': 0, 'replayed': 0, 'replay_errors': 0, 'dropped': 0}
+
+        self._pending: Deque[Dict] = deque()
+        self._pending_locations = Counter()
+        self._replayed = 0 # lines of the spool file already applied, kept in the .offset file next to it
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock() # one replay at a time, the thread's or a caller's
+        self._wakeup = threading.Event()
+
+        self._lock_fd = self._hold_lock(self.spool_fn)
+        self._adopt_orphans()
+
+        self._thread = threading.Thread(target=self._replay_loop, name="write-spool-replay", daemon=True)
+        self._thread.start()
+
+    @property
+    def replay_lag(self) -> float:
+        # seconds the oldest write in the spool has been waiting
+        with self._lock:
+            return time.time() - self._pending[0]['ts'] if self._pending else 0.0
+
+    def metrics(self) -> Dict[str, float]:
+        return {**self.stats, 'pending': len(self._pending), 'replay_lag': self.replay_lag}
+
+    def _retry(self, call: Callable, stat: str):
+        # runs `call` until it does not fail with a transient error or `deadline` passes; raises the last error then
+        stop_at, attempt = time.monotonic() + self.deadline, 0
+        while True:
+            try:
+                return call()
+            except StorageError as e:
+                remaining = stop_at - time.monotonic()
+                if not e.transient or remaining <= 0:
+                    raise
+            self.stats[stat] += 1
+            time.sleep(min(remaining, random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))))
+            attempt += 1
+
+    def execute(self, backend: StorageBackend, location: str, query: str, args: Sequence = None) -> bool:
+        """Runs the write on `backend`; returns True if it went to the spool instead."""
+        self.stats['writes'] += 1
+        if self._pending_locations[location] == 0:
+            try:
+                self._retry(lambda : backend.execute(query, args), 'retries')
+                return False
+            except StorageError as e:
+                if not e.transient:
+                    raise
+
+        self._spool({'location': location, 'query': query, 'args': list(args or ()), 'ts': time.time()})
+        return True
+
+    def read(self, call: Callable):
+        """
+        Runs the read `call` (e.g., a `backend.query`) with the retries of a write -- the short lock wait of 
+        `SqliteBackend` applies to reads too. Reads are not spooled; the last error is raised after `deadline`.
+        """
+        return self._retry(call, 'read_retries')
+
+    def _append(self, records: List[Dict]):
+        with self.spool_fn.open("a") as fw:
+            fw.writelines( json.dumps(r) + "\n" for r in records )
+            fw.flush()
+            os.fsync(fw.fileno())
+
+    def _spool(self, record: Dict):
+        with self._lock:
+            self._append([record])
+            self._pending.append(record)
+            self._pending_locations[record['location']] += 1
+            self.stats['spooled'] += 1
+        self._wakeup.set()
+
+    @staticmethod
+    def _hold_lock(spool_fn: Path):
+        # an exclusive lock on the .lock file next to the spool file; None if another process holds it
+        fd = os.open(spool_fn.with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _adopt_orphans(self):
+        for fn in sorted(self.spool_dir.glob("spool.*.jsonl")):
+            if fn == self.spool_fn:
+                continue
+            # the lock is the claim: a process that is alive holds its own, and of two processes
+            # starting together only one gets the lock of an orphan
+            fd = self._hold_lock(fn)
+            if fd is None:
+                continue
+            try:
+                try:
+                    lines = fn.read_text().splitlines()
+                except FileNotFoundError:
+                    # taken over and removed by another process in the meantime
+                    continue
+                offset_fn = fn.with_suffix(".offset")
+                replayed = int(offset_fn.read_text() or 0) if offset_fn.exists() else 0
+                for record in [ json.loads(line) for line in lines if line.strip() ][replayed:]:
+                    self._spool(record)
+                offset_fn.unlink(missing_ok=True)
+                fn.unlink(missing_ok=True)
+                fn.with_suffix(".lock").unlink(missing_ok=True)
+            finally:
+                os.close(fd)
+
+    def replay(self) -> int:
+        """Applies the spooled writes in order until the spool is empty or the store fails again."""
+        with self._replay_lock:
+            return self._replay()
+
+    def _replay(self) -> int:
+        n = 0
+        while True:
+            with self._lock:
+                if not self._pending:
+                    if self.spool_fn.exists():
+                        self.spool_fn.unlink()
+                        self.spool_fn.with_suffix(".offset").unlink(missing_ok=True)
+                    self._replayed = 0
+                    return n
+                record = self._pending[0]
+
+            try:
+                get_backend(record['location'], persistent_connection=False).execute(record['query'], record['args'])
+            except StorageError as e:
+                if e.transient:
+                    self.stats['replay_errors'] += 1
+                    return n
+                # would block everything behind it forever -- keep it aside for a person to look at
+                with (self.spool_dir / f"failed.{self.spool_id}.jsonl").open("a") as fw:
+                    fw.write(json.dumps({**record, 'error': str(e)}) + "\n")
+                self.stats['dropped'] += 1
+
+            with self._lock:
+                self._pending.popleft()
+                self._pending_locations[record['location']] -= 1
+                self._replayed += 1
+                self.spool_fn.with_suffix(".offset").write_text(str(self._replayed))
+                self.stats['replayed'] += 1
+            n += 1
+
+    def _replay_loop(self):
+        while True:
+            self._wakeup.wait(self.replay_interval)
+            self._wakeup.clear()
+            if self._pending:
+                self.replay()
+
+
+_write_spool: WriteSpool = None
+_write_spool_lock = threading.Lock()
+
+def get_write_spool() -> WriteSpool:
+    # one per process, the spool directory is set by RAG_SPOOL_DIR
+    global _write_spool
+    with _write_spool_lock:
+        if _write_spool is None:
+            _write_spool = WriteSpool(os.environ.get("RAG_SPOOL_DIR", "./write_spool"))
+            register_gauges("write_spool", _write_spool.metrics)
+        return _write_spool
@@ -1,19 +1,32 @@
 from typing import Iterable, Set, Tuple, List, Dict, Literal, Mapping, Union
 from dataclasses import dataclass, asdict, field
+from types import MappingProxyType
+from functools import lru_cache
 from pathlib import Path
+import threading
+import time
 
 import streamlit as st
 
 import json
 
+from resource_db import ResourceDB, ResourceKind, LazyTopicResource, freeze, is_resource_db
+
+
+@lru_cache(maxsize=16)
+def _open_resource_db(fn: str, mtime_ns: int):
+    # configs pointing several fields to the same compiled file share one connection
+    return ResourceDB(fn)
+
+def _load_resource(fn: str, kind: ResourceKind):
+    if is_resource_db(fn):
+        return LazyTopicResource(_open_resource_db(str(Path(fn).resolve()), Path(fn).stat().st_mtime_ns), kind)
 
-@st.cache_data
-def _load_json_resource(fn: str):
     with open(fn) as fr:
         data = json.load(fr)
-    return data
+    return freeze(data)
 
-@dataclass
+@dataclass(frozen=True)
 class TaskConfig:
     name: str = None
     output_dir: str = None # need to save nuggets and annotation
@@ -24,6 +37,7 @@ class TaskConfig:
     topic_id_field: str = "request_id"
     topic_fields: List[str] = field(default_factory=lambda :['problem_statement', 'background'])
 
+    # the three resource paths below can also point to a compiled resource file (.db), see `resource_db.py`
     doc_pools_path: str = None # a json with {'topic_id: ['doc_id', ...] }
 
     # pooling decisions should live outside of this app
@@ -46,7 +60,10 @@ class TaskConfig:
     ])
     
     collection_id: str = None    
-    doc_service: Literal['ir_datasets', 'http_api'] = 'ir_datasets'
+    doc_service: Literal['ir_datasets', 'hf_datasets', 'http_api'] = 'ir_datasets'
+
+    # url of a networked store for the annotation and log tables, instead of the sqlite files in output_dir
+    storage_url: str = None
 
     @classmethod
     def from_json(cls, file_path: str):
@@ -57,13 +74,172 @@ class TaskConfig:
         with open(file_path, "w") as fw:
             json.dump(data, fw, indent=4, allow_nan=True)   
 
+    def db_location(self, db_name: str) -> str:
+        return self.storage_url if self.storage_url is not None else str(Path(self.output_dir) / db_name)
+
     def __post_init__(self):
-        self.requests: Dict[str, Dict[str, str]] = {
-            topic[self.topic_id_field]: { key: topic[key] for key in self.topic_fields }
-            for topic in map(json.loads, open(self.topic_file))
-        }
-        self.pooled_docs: Dict[str, List[str]] = _load_json_resource(self.doc_pools_path)
-        self.cited_sentences: Dict[str, Dict[str, Dict[str, Dict[str, str]]]] = _load_json_resource(self.cited_sentences_path)
-        self.report_runs: Dict[str, Dict[str, Dict[str, str]]] = _load_json_resource(self.report_runs_path)
+        with open(self.topic_file) as fr:
+            requests = {
+                topic[self.topic_id_field]: { key: topic[key] for key in self.topic_fields }
+                for topic in map(json.loads, fr)
+            }
+
+        # frozen dataclass -- the (read-only) resources are set once here
+        object.__setattr__(self, 'requests', freeze(requests)) # Mapping[str, Mapping[str, str]]
+        object.__setattr__(self, 'pooled_docs', _load_resource(self.doc_pools_path, 'doc_pools'))
+        object.__setattr__(self, 'cited_sentences', _load_resource(self.cited_sentences_path, 'cited_sentences'))
+        object.__setattr__(self, 'report_runs', _load_resource(self.report_runs_path, 'report_runs'))
+
+
+class TaskRegistry(Mapping[str, TaskConfig]):
+    # task name -> TaskConfig of every config file in a directory, kept in sync with the directory by `refresh`
+
+    RESOURCE_FIELDS = ['topic_file', 'doc_pools_path', 'cited_sentences_path', 'report_runs_path']
+
+    def __init__(self, config_dir: str, min_refresh_interval: float = 2.0, max_retry_interval: float = 60.0):
+        self.config_dir = Path(config_dir)
+        self.min_refresh_interval = min_refresh_interval
+        # a config that failed to load is tried again when one of its files changes, or after a backoff
+        # growing from `min_refresh_interval` to `max_retry_interval`, e.g., when it points to a directory
+        # that is mounted later
+        self.max_retry_interval = max_retry_interval
+
+        self._configs: Mapping[str, TaskConfig] = MappingProxyType({})
+        self._loaded: Dict[Path, Tuple[Tuple, TaskConfig]] = {} # config file -> (signature, config)
+        self._failed: Dict[Path, Tuple[Tuple, float, int]] = {} # config file -> (signature, retry at, failures)
+        self._changed_at: Dict[str, int] = {} # task name -> generation
+        self.generation = 0
+
+        self._lock = threading.Lock() # the swap of the configs
+        self._refresh_lock = threading.Lock() # one refresh at a time, loading the configs outside of `_lock`
+        self._last_refresh = 0.0
+        self.refresh(force=True, strict=True)
+
+    def __getitem__(self, task_name: str) -> TaskConfig:
+        return self._configs[task_name]
+
+    def __iter__(self):
+        return iter(self._configs)
+
+    def __len__(self):
+        return len(self._configs)
+
+    def changed_since(self, generation: int) -> List[str]:
+        with self._lock:
+            return [ name for name, g in self._changed_at.items() if g > generation ]
+
+    @classmethod
+    def _resource_paths(cls, fn: Path, config: TaskConfig = None) -> List[str]:
+        if config is not None:
+            return [ getattr(config, f) for f in cls.RESOURCE_FIELDS ]
+        # a config that does not load may still say which files it needs
+        try:
+            data = json.loads(fn.read_text())
+        except (OSError, ValueError):
+            return []
+        return [ data.get(f, None) for f in cls.RESOURCE_FIELDS ] if isinstance(data, dict) else []
+
+    @classmethod
+    def _signature(cls, fn: Path, config: TaskConfig = None):
+        # the config file and every file it refers to
+        files = [fn] + [ Path(f) for f in cls._resource_paths(fn, config) if isinstance(f, str) ]
+        sig = []
+        for f in files:
+            try:
+                stat = f.stat()
+                sig.append((str(f), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                sig.append((str(f), None, None))
+        return tuple(sig)
+
+    def _load(self, fn: Path, strict: bool, now: float):
+        # (signature, config) of the file, or None if it should keep what it had
+        if fn in self._loaded and self._signature(fn, self._loaded[fn][1]) == self._loaded[fn][0]:
+            return self._loaded[fn]
+        if fn in self._failed:
+            failed_sig, retry_at, _ = self._failed[fn]
+            if now < retry_at and self._signature(fn) == failed_sig:
+                return self._loaded.get(fn, None)
+        try:
+            config = TaskConfig.from_json(fn)
+            Path(config.output_dir).mkdir(parents=True, exist_ok=True)
+            self._failed.pop(fn, None)
+            return (self._signature(fn, config), config)
+        except Exception as e:
+            if strict:
+                raise
+            # keep serving the last good version, e.g., while the file is half-written
+            print(f"Failed to load task config {fn} -- {e!r}")
+            n_failures = self._failed[fn][2] + 1 if fn in self._failed else 1
+            backoff = min(self.max_retry_interval, self.min_refresh_interval * 2 ** n_failures)
+            self._failed[fn] = (self._signature(fn), now + backoff, n_failures)
+            return self._loaded.get(fn, None)
+
+    def refresh(self, force=False, strict=False) -> List[str]:
+        """
+        Reloads only the configs whose file or referenced resources changed since the last refresh, 
+        picks up new files and drops removed ones. Calls within `min_refresh_interval` seconds of 
+        the last one are no-ops, so it can be called on every rerun; so are calls while another
+        session is refreshing -- they keep the current configs. Returns the changed task names.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.min_refresh_interval:
+            return []
+        if not self._refresh_lock.acquire(blocking=force):
+            return []
+
+        try:
+            if not force and now - self._last_refresh < self.min_refresh_interval: # another session just did it
+                return []
+            self._last_refresh = now
+
+            loaded = {}
+            for fn in sorted(self.config_dir.glob("*.json")):
+                entry = self._load(fn, strict, now)
+                if entry is not None:
+                    loaded[fn] = entry
+            for fn in self._failed.keys() - loaded.keys():
+                if not fn.exists():
+                    del self._failed[fn]
+
+            configs: Dict[str, TaskConfig] = {}
+            # the tables have no task column, so two tasks on one store would overwrite each other's annotations
+            stores: Dict[str, str] = {} # storage_url -> task name
+            # on a collision, the task already served keeps running and the new one is left out
+            for fn, (_, config) in sorted(loaded.items(), key=lambda item: item[1][1].name not in self._configs):
+                if config.name in configs:
+                    assert not strict, f"Task Name Collision -- {config.name}"
+                    print(f"Task Name Collision -- {config.name} in {fn}, ignored")
+                    continue
+                if config.storage_url is not None:
+                    store = config.storage_url.rstrip("/")
+                    if store in stores:
+                        assert not strict, f"Storage Collision -- {config.name} and {stores[store]} share {config.storage_url}"
+                        print(f"Storage Collision -- {config.name} in {fn} shares {config.storage_url} with {stores[store]}, ignored")
+                        continue
+                    stores[store] = config.name
+                configs[config.name] = config
+
+            with self._lock:
+                changed = [ 
+                    name for name in configs.keys() | self._configs.keys() 
+                    if configs.get(name, None) is not self._configs.get(name, None) 
+                ]
+                if len(changed) > 0:
+                    self.generation += 1
+                    for name in changed:
+                        self._changed_at[name] = self.generation
+
+                self._loaded = loaded
+                self._configs = MappingProxyType(configs) # readers always see either the old or the new mapping
+            return changed
+        finally:
+            self._refresh_lock.release()
+
+
+@st.cache_resource
+def get_task_registry(config_dir: str) -> TaskRegistry:
+    # built once per process and shared by all sessions and reruns
+    return TaskRegistry(config_dir)
 
 